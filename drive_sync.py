@@ -8,57 +8,133 @@ Permite sincronizar repositorios locales con Google Drive para colaboración.
 
 import os
 import json
+import datetime
 import pickle
-import time
+import socket
+import threading
 from pathlib import Path
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, build_http
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import io
 import hashlib
 
+from remote import (RemoteSync, TransferScheduler, ObjectWriter, CorruptObjectError, INDEX_HEAD_FILE,
+                    INDEX_LOG_FOLDER, LOG_APPEND_ATTEMPTS, LOG_COMPACT_SEGMENTS, LOG_COMPACT_KEEP,
+                    segment_range, segments_after)
+
 
 # Permisos necesarios para Google Drive API
 SCOPES = ['https://www.googleapis.com/auth/drive']
 TOKEN_FILE = 'token.pickle'
 CREDENTIALS_FILE = 'credentials.json'
 
-class DriveSync:
-    """Clase para manejar la sincronización con Google Drive."""
+# Las credenciales se renuevan si caducan en menos de este margen
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Caché de clientes compartida por todo el proceso: ruta del token -> (credenciales, servicio)
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+# Conexiones HTTP autenticadas reutilizables, una por hilo y cliente
+_HTTP_LOCAL = threading.local()
+_AUTH_REQUEST = None
+
+# Motivos de error 403 que indican límite de cuota
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+
+
+def _error_reason(error):
+    """Obtiene el motivo ('reason') de un HttpError de la API de Drive."""
+    details = getattr(error, 'error_details', None)
+    if isinstance(details, list):
+        for detail in details:
+            if isinstance(detail, dict) and detail.get('reason'):
+                return detail['reason']
+    try:
+        content = json.loads(error.content.decode('utf-8'))
+        return content['error']['errors'][0]['reason']
+    except Exception:
+        return None
+
+
+def classify_error(error):
+    """Clasifica un error de transferencia.
     
-    def __init__(self, repo_path='.'):
-        """Inicializa el cliente de Google Drive."""
-        self.repo_path = Path(repo_path)
-        self.vcs_dir = self.repo_path / '.shit'
-        self.drive_config_file = self.vcs_dir / 'drive_config.json'
-        self.drive_config = {}
-        self.service = None
+    Devuelve 'quota' para límites de cuota (403 userRateLimitExceeded, 429),
+    'transient' para errores de servidor o de red, y None si no se debe
+    reintentar (entre otros, los objetos dañados).
+    """
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429:
+            return 'quota'
+        if status == 403 and _error_reason(error) in RATE_LIMIT_REASONS:
+            return 'quota'
+        if status >= 500:
+            return 'transient'
+        return None
+    if isinstance(error, CorruptObjectError):
+        return None
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout, httplib2.HttpLib2Error)):
+        return 'transient'
+    return None
+
+
+def _auth_request():
+    """Transporte compartido (con conexiones reutilizables) para renovar credenciales."""
+    global _AUTH_REQUEST
+    if _AUTH_REQUEST is None:
+        import requests
+        _AUTH_REQUEST = Request(session=requests.Session())
+    return _AUTH_REQUEST
+
+
+def _needs_refresh(creds):
+    """Indica si las credenciales no son válidas o caducan pronto."""
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    return creds.expiry - datetime.datetime.utcnow() < REFRESH_MARGIN
+
+
+def get_client(vcs_dir):
+    """Devuelve (clave, credenciales, servicio) de Drive, reutilizados en todo el proceso.
+    
+    Las credenciales se cargan de `token.pickle` una sola vez, se renuevan
+    antes de caducar y el servicio se construye con el documento de
+    descubrimiento estático incluido en la biblioteca.
+    """
+    vcs_dir = Path(vcs_dir)
+    
+    # Buscar el archivo de token tanto en directorio actual como en .shit
+    token_path = None
+    for candidate in [Path(TOKEN_FILE), vcs_dir / TOKEN_FILE]:
+        if candidate.exists():
+            token_path = candidate
+            break
+    key = str((token_path or vcs_dir / TOKEN_FILE).resolve())
+    
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        creds = client[0] if client else None
         
-    def authenticate(self):
-        """Autentica con Google Drive API."""
-        creds = None
-        
-        # Buscar el archivo de token tanto en directorio actual como en .shit
-        token_paths = [
-            Path(TOKEN_FILE),
-            self.vcs_dir / TOKEN_FILE
-        ]
-        
-        for token_path in token_paths:
-            if token_path.exists():
-                with open(token_path, 'rb') as token:
-                    creds = pickle.load(token)
-                    break
-        
-        # Si no hay credenciales válidas, solicitar inicio de sesión
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
+        if creds is None and token_path is not None:
+            with open(token_path, 'rb') as token:
+                creds = pickle.load(token)
+        
+        # Si no hay credenciales válidas (o caducan pronto), renovarlas o solicitar inicio de sesión
+        if not creds or _needs_refresh(creds):
+            if creds and creds.refresh_token:
+                creds.refresh(_auth_request())
+            elif not creds or not creds.valid:
                 credentials_paths = [
                     Path(CREDENTIALS_FILE),
-                    self.vcs_dir / CREDENTIALS_FILE
+                    vcs_dir / CREDENTIALS_FILE
                 ]
                 
                 credentials_path = None
@@ -80,14 +156,70 @@ class DriveSync:
                 creds = flow.run_local_server(port=0)
             
             # Guardar el token para la próxima vez
-            token_save_path = self.vcs_dir / TOKEN_FILE
-            self.vcs_dir.mkdir(exist_ok=True)
+            token_save_path = token_path or vcs_dir / TOKEN_FILE
+            token_save_path.parent.mkdir(exist_ok=True)
             with open(token_save_path, 'wb') as token:
                 pickle.dump(creds, token)
         
-        self.service = build('drive', 'v3', credentials=creds)
+        if client and client[1] is not None and client[0] is creds:
+            service = client[1]
+        else:
+            service = build('drive', 'v3', credentials=creds,
+                            static_discovery=True, cache_discovery=False)
+        
+        _CLIENTS[key] = (creds, service)
+        return key, creds, service
+
+
+def _thread_http(key, creds):
+    """Devuelve la conexión HTTP autenticada del hilo actual para un cliente.
+    
+    httplib2 no es seguro entre hilos, así que cada hilo usa su propia
+    conexión, que se mantiene abierta y se reutiliza entre operaciones.
+    """
+    connections = getattr(_HTTP_LOCAL, 'connections', None)
+    if connections is None:
+        connections = _HTTP_LOCAL.connections = {}
+    
+    http = connections.get(key)
+    if http is None or http.credentials is not creds:
+        http = connections[key] = AuthorizedHttp(creds, http=build_http())
+    return http
+
+
+class DriveSync(RemoteSync):
+    """Clase para manejar la sincronización con Google Drive."""
+    
+    description = "Google Drive"
+    config_name = 'drive_config.json'
+    
+    def __init__(self, repo_path='.'):
+        """Inicializa el cliente de Google Drive."""
+        super().__init__(repo_path)
+        self.service = None
+        self.creds = None
+        self.client_key = None
+        self.scheduler = TransferScheduler(classify=classify_error)
+        # Ids de Drive de los objetos remotos (hash -> id) del último listado
+        self._object_ids = {}
+        
+    def authenticate(self):
+        """Autentica con Google Drive API usando el cliente compartido del proceso."""
+        self.client_key, self.creds, self.service = get_client(self.vcs_dir)
         return True
     
+    def connect(self):
+        return self.authenticate()
+    
+    def _http(self):
+        """Devuelve la conexión HTTP autenticada del hilo actual."""
+        return _thread_http(self.client_key, self.creds)
+    
+    def _execute(self, request):
+        """Ejecuta una petición de la API con reintentos y control de cuota."""
+        request.http = self._http()
+        return self.scheduler.call(request.execute)
+    
     def init_remote(self, repo_name):
         """Inicializa un repositorio remoto en Google Drive."""
         try:
@@ -99,10 +231,10 @@ class DriveSync:
                 'mimeType': 'application/vnd.google-apps.folder'
             }
             
-            folder = self.service.files().create(
+            folder = self._execute(self.service.files().create(
                 body=file_metadata,
                 fields='id'
-            ).execute()
+            ))
             
             folder_id = folder.get('id')
             
@@ -111,7 +243,7 @@ class DriveSync:
             refs_folder = self._create_folder('refs', folder_id)
             
             # Guardar la configuración
-            self.drive_config = {
+            self.remote_config = {
                 'repo_name': repo_name,
                 'repo_id': folder_id,
                 'objects_folder_id': objects_folder,
@@ -120,7 +252,7 @@ class DriveSync:
             }
             
             # Guardar la configuración de Drive
-            self._save_drive_config()
+            self._save_remote_config()
             
             print(f"Repositorio remoto '{repo_name}' inicializado en Google Drive.")
             print(f"ID del repositorio: {folder_id}")
@@ -139,8 +271,13 @@ class DriveSync:
             print(f"Error al inicializar repositorio remoto: {e}")
             return None
     
-    def clone(self, repo_id, target_dir='.'):
-        """Clona un repositorio desde Google Drive."""
+    def clone(self, repo_id, target_dir='.', branch='master', depth=None, lazy=False):
+        """Clona un repositorio desde Google Drive.
+        
+        Solo se descargan los objetos alcanzables desde la rama indicada
+        (opcionalmente limitados a las `depth` versiones más recientes por archivo).
+        En modo `lazy` no se descarga ningún objeto: se obtendrán bajo demanda.
+        """
         target_path = Path(target_dir)
         target_path.mkdir(exist_ok=True)
         
@@ -148,27 +285,18 @@ class DriveSync:
             self.authenticate()
             
             # Obtener información del repositorio
-            repo_file = self.service.files().get(fileId=repo_id).execute()
+            repo_file = self._execute(self.service.files().get(fileId=repo_id))
             repo_name = repo_file['name']
             
             # Crear estructura de directorios local
             local_repo = target_path / repo_name
             local_repo.mkdir(exist_ok=True)
             
-            vcs_dir = local_repo / '.shit'
-            vcs_dir.mkdir(exist_ok=True)
-            
-            objects_dir = vcs_dir / 'objects'
-            objects_dir.mkdir(exist_ok=True)
-            
-            refs_dir = vcs_dir / 'refs'
-            refs_dir.mkdir(exist_ok=True)
-            
             # Buscar subcarpetas
             query = f"'{repo_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-            folders = self.service.files().list(
+            folders = self._execute(self.service.files().list(
                 q=query, fields="files(id, name)"
-            ).execute().get('files', [])
+            )).get('files', [])
             
             objects_folder_id = None
             refs_folder_id = None
@@ -179,126 +307,32 @@ class DriveSync:
                 elif folder['name'] == 'refs':
                     refs_folder_id = folder['id']
             
-            # Descargar archivos de configuración
-            query = f"'{repo_id}' in parents and mimeType != 'application/vnd.google-apps.folder'"
-            files = self.service.files().list(
-                q=query, fields="files(id, name)"
-            ).execute().get('files', [])
-            
-            for file in files:
-                if file['name'] in ['config.json', 'index.json']:
-                    self._download_file(file['id'], vcs_dir / file['name'])
-            
             # Guardar configuración de Drive
             drive_config = {
                 'repo_name': repo_name,
                 'repo_id': repo_id,
                 'objects_folder_id': objects_folder_id,
-                'refs_folder_id': refs_folder_id,
-                'last_sync': None
+                'refs_folder_id': refs_folder_id
             }
             
-            with open(vcs_dir / 'drive_config.json', 'w', encoding='utf-8') as f:
-                json.dump(drive_config, f, indent=2)
+            descargados = self._clone_into(local_repo, drive_config, branch, depth, lazy)
             
             print(f"Repositorio '{repo_name}' clonado desde Google Drive a {local_repo}")
+            if lazy:
+                print("Clon bajo demanda: los objetos se descargarán cuando se necesiten.")
+            else:
+                print(f"Rama '{branch}': {descargados} objetos descargados.")
             return local_repo
             
         except Exception as e:
             print(f"Error al clonar repositorio: {e}")
             return None
     
-    def push(self, branch='master'):
-        """Sube cambios locales a Google Drive."""
-        try:
-            # Cargar configuración
-            self._load_drive_config()
-            if not self.drive_config:
-                print("No hay repositorio remoto configurado. Use init_remote primero.")
-                return False
-            
-            self.authenticate()
-            
-            # Cargar el índice local
-            index_path = self.vcs_dir / 'index.json'
-            if not index_path.exists():
-                print("No hay índice local.")
-                return False
-            
-            with open(index_path, 'r', encoding='utf-8') as f:
-                local_index = json.load(f)
-            
-            # Verificar si existe el índice remoto y descargarlo
-            remote_index = self._get_remote_index()
-            
-            # Sincronizar objetos (archivos versionados)
-            self._sync_objects()
-            
-            # Actualizar rama actual
-            branch_path = self.vcs_dir / 'refs' / branch
-            if branch_path.exists():
-                self._upload_refs(branch)
-            
-            # Subir el índice actualizado
-            self._upload_file(
-                index_path,
-                'index.json',
-                self.drive_config['repo_id'],
-                'application/json'
-            )
-            
-            # Actualizar última sincronización
-            self.drive_config['last_sync'] = str(time.time())
-            self._save_drive_config()
-            
-            print(f"Cambios de la rama '{branch}' enviados a Google Drive.")
-            return True
-            
-        except Exception as e:
-            print(f"Error al enviar cambios: {e}")
-            return False
-    
-    def pull(self, branch='master'):
-        """Obtiene cambios desde Google Drive."""
-        try:
-            # Cargar configuración
-            self._load_drive_config()
-            if not self.drive_config:
-                print("No hay repositorio remoto configurado. Use init_remote o clone primero.")
-                return False
-            
-            self.authenticate()
-            
-            # Descargar el índice remoto
-            index_id = self._find_file_by_name('index.json', self.drive_config['repo_id'])
-            if not index_id:
-                print("No se encontró el índice remoto.")
-                return False
-            
-            self._download_file(index_id, self.vcs_dir / 'index.json')
-            
-            # Descargar los objetos necesarios
-            self._sync_objects(download_only=True)
-            
-            # Descargar las referencias de ramas
-            self._download_refs(branch)
-            
-            # Actualizar última sincronización
-            self.drive_config['last_sync'] = str(time.time())
-            self._save_drive_config()
-            
-            print(f"Cambios de la rama '{branch}' obtenidos desde Google Drive.")
-            return True
-            
-        except Exception as e:
-            print(f"Error al obtener cambios: {e}")
-            return False
-    
     def share(self, email, role='writer'):
         """Comparte el repositorio con otro usuario."""
         try:
-            self._load_drive_config()
-            if not self.drive_config or 'repo_id' not in self.drive_config:
+            self._load_remote_config()
+            if not self.remote_config or 'repo_id' not in self.remote_config:
                 print("No hay repositorio remoto configurado.")
                 return False
             
@@ -317,11 +351,11 @@ class DriveSync:
                 'emailAddress': email
             }
             
-            self.service.permissions().create(
-                fileId=self.drive_config['repo_id'],
+            self._execute(self.service.permissions().create(
+                fileId=self.remote_config['repo_id'],
                 body=user_permission,
                 sendNotificationEmail=True
-            ).execute()
+            ))
             
             print(f"Repositorio compartido con {email} (rol: {role}).")
             return True
@@ -330,6 +364,208 @@ class DriveSync:
             print(f"Error al compartir repositorio: {e}")
             return False
     
+    # Operaciones del transporte sobre Google Drive
+    
+    def list_objects(self):
+        self._object_ids = self._list_remote_objects()
+        return set(self._object_ids)
+    
+    def has_object(self, obj_hash):
+        return self._find_file_by_name(obj_hash, self.remote_config['objects_folder_id']) is not None
+    
+    def put_object(self, obj_hash, local_path):
+        self._object_ids[obj_hash] = self._upload_file(
+            local_path,
+            obj_hash,
+            self.remote_config['objects_folder_id'],
+            check_existing=False
+        )
+    
+    def get_object(self, obj_hash, local_path):
+        # Para pocos objetos es más barato buscarlos por nombre que listar todo el remoto
+        remote_id = self._object_ids.get(obj_hash)
+        if not remote_id:
+            remote_id = self._find_file_by_name(obj_hash, self.remote_config['objects_folder_id'])
+        if not remote_id:
+            return False
+        
+        self._download_file(remote_id, Path(local_path), obj_hash)
+        return True
+    
+    def read_ref(self, branch):
+        branches_folder_id = self._find_file_by_name('branches', self.remote_config['refs_folder_id'])
+        if not branches_folder_id:
+            return None
+        
+        branch_id = self._find_file_by_name(branch, branches_folder_id)
+        if not branch_id:
+            return None
+        
+        temp_path = self.vcs_dir / 'temp_ref'
+        self._download_file(branch_id, temp_path)
+        with open(temp_path, 'r') as f:
+            value = f.read().strip()
+        temp_path.unlink()
+        return value
+    
+    def update_ref(self, branch, old_value, new_value):
+        """Actualiza la referencia remota si su valor actual es `old_value`.
+        
+        Drive no permite escrituras condicionales, así que la comprobación se
+        hace justo antes de subir: reduce las carreras pero no las elimina.
+        """
+        if self.read_ref(branch) != old_value:
+            return False
+        
+        # Buscar o crear carpeta de ramas en Drive
+        branches_folder_id = self._find_file_by_name('branches', self.remote_config['refs_folder_id'])
+        if not branches_folder_id:
+            branches_folder_id = self._create_folder('branches', self.remote_config['refs_folder_id'])
+        
+        # Subir archivo de rama
+        temp_path = self.vcs_dir / 'temp_ref'
+        with open(temp_path, 'w') as f:
+            f.write(new_value)
+        self._upload_file(temp_path, branch, branches_folder_id, 'text/plain')
+        temp_path.unlink()
+        return True
+    
+    def read_log_head(self):
+        head_id = self._find_file_by_name(INDEX_HEAD_FILE, self.remote_config['repo_id'])
+        if not head_id:
+            return None
+        
+        temp_path = self.vcs_dir / 'temp_index_head.json'
+        self._download_file(head_id, temp_path)
+        
+        with open(temp_path, 'r', encoding='utf-8') as f:
+            head = json.load(f)
+        
+        temp_path.unlink()
+        return head['seq']
+    
+    def read_log_records(self, after_seq):
+        folder_id = self._get_index_log_folder()
+        if not folder_id:
+            return []
+        
+        temp_path = self.vcs_dir / 'temp_segment.jsonl'
+        
+        # Solo se descargan los segmentos con registros nuevos. Una fusión
+        # simultánea puede borrar un segmento entre el listado y la descarga:
+        # se vuelve a listar (los registros repetidos se descartan por secuencia)
+        for _ in range(LOG_APPEND_ATTEMPTS):
+            records = {}
+            segments = self._list_folder(folder_id)
+            try:
+                for name in segments_after(segments, after_seq):
+                    self._download_file(segments[name], temp_path)
+                    with open(temp_path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            if line.strip():
+                                record = json.loads(line)
+                                if record['seq'] > after_seq:
+                                    records[record['seq']] = record
+                    temp_path.unlink()
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                continue
+            return [records[seq] for seq in sorted(records)]
+        raise RuntimeError("El registro remoto del índice cambia continuamente; inténtelo más tarde.")
+    
+    def append_log_records(self, records, expected_seq):
+        """Sube un segmento con los registros y actualiza la cabecera del registro remoto.
+        
+        Como en `update_ref`, la comparación con la secuencia remota se hace
+        justo antes de subir. Si hay demasiados segmentos se fusionan los antiguos.
+        """
+        if (self.read_log_head() or 0) != expected_seq:
+            return False
+        
+        first_seq = records[0]['seq']
+        last_seq = records[-1]['seq']
+        
+        # Subir el segmento con los nuevos registros
+        segment_name = f"segment_{first_seq:012d}_{last_seq:012d}.jsonl"
+        temp_path = self.vcs_dir / 'temp_segment.jsonl'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        self._upload_file(temp_path, segment_name, self._get_index_log_folder(create=True), 'application/json')
+        temp_path.unlink()
+        
+        # Actualizar la cabecera del registro remoto
+        head_path = self.vcs_dir / 'temp_index_head.json'
+        with open(head_path, 'w', encoding='utf-8') as f:
+            json.dump({'seq': last_seq}, f)
+        self._upload_file(head_path, INDEX_HEAD_FILE, self.remote_config['repo_id'], 'application/json')
+        head_path.unlink()
+        
+        self._compact_log(self._get_index_log_folder())
+        return True
+    
+    def _compact_log(self, folder_id):
+        """Fusiona los segmentos antiguos del registro si hay demasiados.
+        
+        Como en LocalRemote, el segmento fusionado se sube antes de borrar los
+        originales, así que quien lee a la vez encuentra siempre todos los
+        registros. Drive no tiene bloqueos: si dos usuarios fusionan a la vez
+        los segmentos pueden solaparse, y los lectores descartan los repetidos.
+        """
+        segments = self._list_folder(folder_id)
+        names = segments_after(segments, 0)
+        if len(names) <= LOG_COMPACT_SEGMENTS:
+            return
+        
+        old = names[:-LOG_COMPACT_KEEP]
+        first_seq, last_seq = segment_range(old[0])[0], segment_range(old[-1])[1]
+        merged_name = f"segment_{first_seq:012d}_{last_seq:012d}.jsonl"
+        temp_path = self.vcs_dir / 'temp_segment.jsonl'
+        merged_path = self.vcs_dir / 'temp_merged_segment.jsonl'
+        try:
+            with open(merged_path, 'wb') as out:
+                for name in old:
+                    self._download_file(segments[name], temp_path)
+                    with open(temp_path, 'rb') as f:
+                        out.write(f.read())
+                    temp_path.unlink()
+            self._upload_file(merged_path, merged_name, folder_id, 'application/json')
+        finally:
+            if merged_path.exists():
+                merged_path.unlink()
+        
+        for name in old:
+            if name != merged_name:
+                self._delete_file(segments[name])
+    
+    def read_legacy_index(self):
+        """Obtiene el índice remoto completo si existe (repositorios sin registro incremental)."""
+        index_id = self._find_file_by_name('index.json', self.remote_config['repo_id'])
+        if not index_id:
+            return None
+        
+        temp_path = self.vcs_dir / 'temp_index.json'
+        self._download_file(index_id, temp_path)
+        
+        with open(temp_path, 'r', encoding='utf-8') as f:
+            remote_index = json.load(f)
+        
+        # Eliminar archivo temporal
+        temp_path.unlink()
+        
+        return remote_index
+    
+    def get_file(self, name, local_path):
+        file_id = self._find_file_by_name(name, self.remote_config['repo_id'])
+        if not file_id:
+            return False
+        
+        self._download_file(file_id, Path(local_path))
+        return True
+    
+    # Utilidades de la API de Drive
+    
     def _create_folder(self, folder_name, parent_id):
         """Crea una carpeta en Google Drive."""
         file_metadata = {
@@ -338,15 +574,18 @@ class DriveSync:
             'parents': [parent_id]
         }
         
-        folder = self.service.files().create(
+        folder = self._execute(self.service.files().create(
             body=file_metadata,
             fields='id'
-        ).execute()
+        ))
         
         return folder.get('id')
     
-    def _upload_file(self, local_path, file_name, parent_id, mime_type=None):
-        """Sube un archivo a Google Drive."""
+    def _upload_file(self, local_path, file_name, parent_id, mime_type=None, check_existing=True):
+        """Sube un archivo a Google Drive.
+        
+        Con `check_existing=False` se crea directamente sin buscar si ya existe.
+        """
         if not mime_type:
             mime_type = 'application/octet-stream'
             
@@ -356,36 +595,44 @@ class DriveSync:
         }
         
         # Verificar si el archivo ya existe
-        existing_file_id = self._find_file_by_name(file_name, parent_id)
+        existing_file_id = self._find_file_by_name(file_name, parent_id) if check_existing else None
         
         media = MediaFileUpload(local_path, mimetype=mime_type)
         
         if existing_file_id:
             # Actualizar archivo existente
-            file = self.service.files().update(
+            file = self._execute(self.service.files().update(
                 fileId=existing_file_id,
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            ))
         else:
             # Crear nuevo archivo
-            file = self.service.files().create(
+            file = self._execute(self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            ))
         
         return file.get('id')
     
+    def _delete_file(self, file_id):
+        """Borra un archivo de Google Drive (si ya no existe no hace nada)."""
+        try:
+            self._execute(self.service.files().delete(fileId=file_id))
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+    
     def _find_file_by_name(self, file_name, parent_id):
         """Busca un archivo por nombre en una carpeta específica."""
         query = f"name = '{file_name}' and '{parent_id}' in parents and trashed = false"
         
-        results = self.service.files().list(
+        results = self._execute(self.service.files().list(
             q=query,
             fields="files(id)"
-        ).execute()
+        ))
         
         files = results.get('files', [])
         
@@ -394,129 +641,70 @@ class DriveSync:
         
         return files[0]['id']
     
-    def _download_file(self, file_id, local_path):
-        """Descarga un archivo desde Google Drive."""
-        request = self.service.files().get_media(fileId=file_id)
+    def _download_file(self, file_id, local_path, obj_hash=None):
+        """Descarga un archivo desde Google Drive (reintentando la descarga completa).
         
+        Con `obj_hash` el archivo es un objeto: se descarga a un temporal, se
+        verifica mientras llega y solo se mueve a `local_path` si es correcto.
+        """
         local_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with io.FileIO(local_path, 'wb') as fh:
+        def fetch(fh):
+            request = self.service.files().get_media(fileId=file_id)
+            request.http = self._http()
             downloader = MediaIoBaseDownload(fh, request)
             done = False
             while not done:
                 _, done = downloader.next_chunk()
-    
-    def _get_remote_index(self):
-        """Obtiene el índice remoto si existe."""
-        index_id = self._find_file_by_name('index.json', self.drive_config['repo_id'])
-        if not index_id:
-            return {}
         
-        temp_path = self.vcs_dir / 'temp_index.json'
-        self._download_file(index_id, temp_path)
+        def download():
+            if obj_hash is None:
+                with io.FileIO(local_path, 'wb') as fh:
+                    fetch(fh)
+                return
+            with ObjectWriter(obj_hash, local_path) as writer:
+                fetch(writer)
+                writer.commit()
         
-        with open(temp_path, 'r', encoding='utf-8') as f:
-            remote_index = json.load(f)
-        
-        # Eliminar archivo temporal
-        temp_path.unlink()
-        
-        return remote_index
+        self.scheduler.call(download)
     
-    def _sync_objects(self, download_only=False):
-        """Sincroniza los objetos entre local y remoto."""
-        # Obtener lista de objetos locales
-        objects_dir = self.vcs_dir / 'objects'
-        local_objects = []
-        
-        if objects_dir.exists():
-            for prefix_dir in objects_dir.iterdir():
-                if prefix_dir.is_dir():
-                    for obj_file in prefix_dir.iterdir():
-                        if obj_file.is_file():
-                            local_objects.append(prefix_dir.name + obj_file.name)
-        
-        # Obtener lista de objetos remotos
-        remote_objects = []
-        query = f"'{self.drive_config['objects_folder_id']}' in parents and trashed = false"
-        results = self.service.files().list(q=query, fields="files(id, name)").execute()
-        
-        for file in results.get('files', []):
-            remote_objects.append(file['name'])
-        
-        if not download_only:
-            # Subir objetos locales que no están en remoto
-            for obj_hash in local_objects:
-                if obj_hash not in remote_objects:
-                    prefix = obj_hash[:2]
-                    suffix = obj_hash[2:]
-                    
-                    local_path = objects_dir / prefix / suffix
-                    
-                    self._upload_file(
-                        local_path,
-                        obj_hash,
-                        self.drive_config['objects_folder_id']
-                    )
+    def _get_index_log_folder(self, create=False):
+        """Obtiene (o crea) la carpeta remota con los segmentos del registro del índice."""
+        folder_id = self.remote_config.get('index_log_folder_id')
+        if folder_id:
+            return folder_id
         
-        # Descargar objetos remotos que no están en local
-        for obj_hash in remote_objects:
-            if obj_hash not in local_objects:
-                prefix = obj_hash[:2]
-                suffix = obj_hash[2:]
-                
-                remote_id = self._find_file_by_name(obj_hash, self.drive_config['objects_folder_id'])
-                if remote_id:
-                    local_path = objects_dir / prefix / suffix
-                    objects_dir.mkdir(exist_ok=True)
-                    (objects_dir / prefix).mkdir(exist_ok=True)
-                    
-                    self._download_file(remote_id, local_path)
-    
-    def _upload_refs(self, branch):
-        """Sube referencias de ramas a Google Drive."""
-        branch_path = self.vcs_dir / 'refs' / branch
-        if not branch_path.exists():
-            return
+        folder_id = self._find_file_by_name(INDEX_LOG_FOLDER, self.remote_config['repo_id'])
+        if not folder_id and create:
+            folder_id = self._create_folder(INDEX_LOG_FOLDER, self.remote_config['repo_id'])
         
-        # Buscar o crear carpeta de ramas en Drive
-        branches_folder_id = self._find_file_by_name('branches', self.drive_config['refs_folder_id'])
-        if not branches_folder_id:
-            branches_folder_id = self._create_folder('branches', self.drive_config['refs_folder_id'])
-        
-        # Subir archivo de rama
-        self._upload_file(
-            branch_path,
-            branch,
-            branches_folder_id,
-            'text/plain'
-        )
+        if folder_id:
+            self.remote_config['index_log_folder_id'] = folder_id
+        return folder_id
     
-    def _download_refs(self, branch):
-        """Descarga referencias de ramas desde Google Drive."""
-        # Buscar carpeta de ramas en Drive
-        branches_folder_id = self._find_file_by_name('branches', self.drive_config['refs_folder_id'])
-        if not branches_folder_id:
-            return
+    def _list_remote_objects(self):
+        """Lista los objetos remotos como un diccionario nombre -> id de Drive."""
+        return self._list_folder(self.remote_config['objects_folder_id'])
+    
+    def _list_folder(self, folder_id):
+        """Lista el contenido de una carpeta de Drive como un diccionario nombre -> id."""
+        remote_objects = {}
+        query = f"'{folder_id}' in parents and trashed = false"
+        page_token = None
         
-        # Buscar archivo de rama específica
-        branch_id = self._find_file_by_name(branch, branches_folder_id)
-        if branch_id:
-            branch_path = self.vcs_dir / 'refs' / branch
-            (self.vcs_dir / 'refs').mkdir(exist_ok=True)
-            
-            self._download_file(branch_id, branch_path)
-    
-    def _save_drive_config(self):
-        """Guarda la configuración de Drive en el repositorio local."""
-        self.vcs_dir.mkdir(exist_ok=True)
-        with open(self.drive_config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.drive_config, f, indent=2)
-    
-    def _load_drive_config(self):
-        """Carga la configuración de Drive desde el repositorio local."""
-        if self.drive_config_file.exists():
-            with open(self.drive_config_file, 'r', encoding='utf-8') as f:
-                self.drive_config = json.load(f)
-        else:
-            self.drive_config = {}
\ No newline at end of file
+        while True:
+            results = self._execute(self.service.files().list(
+                q=query,
+                fields="nextPageToken, files(id, name)",
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            
+            for file in results.get('files', []):
+                remote_objects[file['name']] = file['id']
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        return remote_objects
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Índice de historial de SHIT
+Copia el historial de versiones de index.json en una base de datos SQLite
+(.shit/history.db) con índices secundarios por rama y fecha, por mensaje,
+por archivo y por hash, para responder consultas sobre todo el repositorio
+sin recorrer el índice completo. La base de datos es una caché: cuando
+index.json cambia se le aplican los cambios anotados en el diario
+(.shit/history_log.jsonl) y, si no bastan, se reconstruye. Puede borrarse en
+cualquier momento.
+"""
+
+import os
+import re
+import json
+import sqlite3
+
+
+# Base de datos dentro de .shit
+HISTORY_FILE = 'history.db'
+
+# Diario de cambios del índice: una cabecera con la generación del diario y
+# una línea por guardado, con la versión de index.json anterior ('base') y la
+# resultante ('key') y sus registros
+HISTORY_LOG_FILE = 'history_log.jsonl'
+
+# Al superar este tamaño el diario se sustituye por uno nuevo, con otra
+# generación (las bases más atrasadas se reconstruyen)
+HISTORY_LOG_LIMIT = 4 * 1024 * 1024
+
+# Cambiar al modificar el esquema: fuerza la reconstrucción de las bases existentes
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, text TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    message_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS versions_branch_time ON versions (branch, timestamp);
+CREATE INDEX IF NOT EXISTS versions_message ON versions (message_id, branch, timestamp);
+CREATE INDEX IF NOT EXISTS versions_path ON versions (path, branch, timestamp);
+CREATE INDEX IF NOT EXISTS versions_hash ON versions (hash);
+"""
+
+INDEXES = re.findall(r'CREATE INDEX IF NOT EXISTS (\w+)', SCHEMA)
+
+
+class HistoryIndex:
+    """Historial de versiones indexado de un repositorio.
+
+    Uso:
+
+        history = HistoryIndex(vcs_dir)
+        conn = history.open(load_index)
+        try:
+            for row in history.query(conn, 'master', since='2024-05-01T00:00:00'):
+                ...
+        finally:
+            conn.close()
+    """
+
+    def __init__(self, vcs_dir):
+        self.path = os.path.join(str(vcs_dir), HISTORY_FILE)
+        self.index_file = os.path.join(str(vcs_dir), 'index.json')
+        self.log_file = os.path.join(str(vcs_dir), HISTORY_LOG_FILE)
+
+    def index_key(self):
+        """Identifica la versión de index.json (y del esquema) por su fecha de modificación y tamaño."""
+        try:
+            st = os.stat(self.index_file)
+        except FileNotFoundError:
+            return f"{SCHEMA_VERSION}:0:0"
+        return f"{SCHEMA_VERSION}:{st.st_mtime_ns}:{st.st_size}"
+
+    def open(self, load_index):
+        """Abre la base de datos y la pone al día con index.json.
+
+        Si index.json cambió se aplican los cambios del diario; `load_index()`
+        devuelve el índice y solo se llama si no bastan y hay que reconstruir
+        el historial. Devuelve la conexión, que debe cerrarse.
+        """
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            conn.executescript(SCHEMA)
+            key = self.index_key()
+            if self._stored_key(conn) != key:
+                # Bloquear la escritura y comprobar de nuevo: otro proceso puede haberla actualizado ya
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    stored = self._stored_key(conn)
+                    if stored != key and not self._apply_log(conn, stored, key):
+                        self._rebuild(conn, load_index(), key)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _stored_key(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'index_key'").fetchone()
+        return row[0] if row else None
+
+    def log_changes(self, base_key, records):
+        """Anota en el diario los registros que acaban de guardarse en index.json.
+
+        `base_key` es la versión del índice antes de guardarlo. Quien guarda
+        el índice lo hace con el repositorio bloqueado, así que las líneas
+        quedan en el orden de los guardados.
+        """
+        line = json.dumps({'base': base_key, 'key': self.index_key(), 'records': list(records)}) + '\n'
+        try:
+            if os.path.getsize(self.log_file) <= HISTORY_LOG_LIMIT:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                return
+        except OSError:
+            pass
+
+        # Diario nuevo (o demasiado grande): se sustituye de una vez por otro con
+        # una generación distinta, para que nadie aplique una posición del anterior
+        header = json.dumps({'generation': os.urandom(8).hex()}) + '\n'
+        tmp_file = f"{self.log_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(header + line)
+        os.replace(tmp_file, self.log_file)
+
+    def _apply_log(self, conn, stored_key, key):
+        """Aplica las líneas del diario que llevan de `stored_key` a `key`.
+
+        Se lee desde la posición en la que terminó la última actualización
+        (desde el principio si el diario es de otra generación) y se aplican
+        las líneas que continúan la cadena de versiones del índice. Devuelve
+        False si la cadena no llega a `key` (cambios sin anotar, como los de
+        `remote pull`, o diario sustituido) o si el diario está dañado: hay que
+        reconstruir.
+        """
+        if stored_key is None:
+            return False
+        row = conn.execute("SELECT value FROM meta WHERE key = 'log_offset'").fetchone()
+        offset = int(row[0]) if row else 0
+        row = conn.execute("SELECT value FROM meta WHERE key = 'log_generation'").fetchone()
+        stored_generation = row[0] if row else None
+        try:
+            with open(self.log_file, 'rb') as f:
+                generation = self._read_generation(f)
+                if generation != stored_generation or offset > os.fstat(f.fileno()).st_size:
+                    offset = 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return False
+
+        # Solo las líneas completas: la última puede estar escribiéndose
+        current = stored_key
+        end = data.rfind(b'\n') + 1
+        try:
+            for line in data[:end].splitlines():
+                entry = json.loads(line)
+                if entry.get('base') == current:
+                    self._apply_records(conn, entry['records'])
+                    current = entry['key']
+        except (ValueError, KeyError, TypeError):
+            return False
+        if current != key:
+            return False
+
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_key', ?)", (key,))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('log_offset', ?)", (str(offset + end),))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('log_generation', ?)", (generation,))
+        return True
+
+    def _apply_records(self, conn, records):
+        """Añade al historial los archivos y versiones de registros del índice."""
+        message_ids = {}
+        for record in records:
+            conn.execute('INSERT OR IGNORE INTO paths (path) VALUES (?)', (record['path'],))
+            if record['op'] != 'version':
+                continue
+            version = record['version']
+            message = version.get('message', '')
+            if message not in message_ids:
+                message_ids[message] = conn.execute('INSERT INTO messages (text) VALUES (?)', (message,)).lastrowid
+            conn.execute('INSERT INTO versions (path, branch, version, hash, timestamp, message_id) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (record['path'], version.get('branch', 'master'), version['version'],
+                          version['hash'], version['timestamp'], message_ids[message]))
+
+    def _rebuild(self, conn, index, key):
+        """Vuelve a copiar todas las versiones del índice."""
+        # Es más rápido crear los índices secundarios al final que mantenerlos en cada inserción
+        for name in INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+        conn.execute('DELETE FROM versions')
+        conn.execute('DELETE FROM messages')
+        conn.execute('DELETE FROM paths')
+
+        # Cada mensaje distinto se guarda una sola vez (un commit de varios archivos lo repite)
+        message_ids = {}
+        rows = []
+        for path, info in index.items():
+            for version in info.get('versions', []):
+                message = version.get('message', '')
+                message_id = message_ids.setdefault(message, len(message_ids) + 1)
+                rows.append((path, version.get('branch', 'master'), version['version'],
+                             version['hash'], version['timestamp'], message_id))
+
+        conn.executemany('INSERT INTO paths (path) VALUES (?)', ((path,) for path in index))
+        conn.executemany('INSERT INTO messages (id, text) VALUES (?, ?)',
+                         ((message_id, text) for text, message_id in message_ids.items()))
+        conn.executemany('INSERT INTO versions (path, branch, version, hash, timestamp, message_id) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_key', ?)", (key,))
+        generation, size = self._log_position()
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('log_offset', ?)", (str(size),))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('log_generation', ?)", (generation,))
+        for statement in SCHEMA.split(';'):
+            if statement.strip().startswith('CREATE INDEX'):
+                conn.execute(statement)
+
+    def _log_position(self):
+        """Devuelve la generación y el tamaño actuales del diario."""
+        try:
+            with open(self.log_file, 'rb') as f:
+                return self._read_generation(f), os.fstat(f.fileno()).st_size
+        except OSError:
+            return None, 0
+
+    def _read_generation(self, f):
+        """Lee la generación de la cabecera del diario abierto (None si no la tiene)."""
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        return header.get('generation') if isinstance(header, dict) else None
+
+    def tracks(self, conn, path):
+        """Indica si el archivo está bajo control de versiones (aunque no tenga versiones)."""
+        return conn.execute('SELECT 1 FROM paths WHERE path = ?', (path,)).fetchone() is not None
+
+    def query(self, conn, branch, path=None, since=None, until=None, pattern=None, limit=None, offset=0):
+        """Busca versiones de una rama, ordenadas por fecha.
+
+        `since` y `until` (inclusivas) son marcas de tiempo en el formato del
+        índice y `pattern` una expresión regular que debe aparecer en el
+        mensaje: se evalúa una vez por mensaje distinto, no por versión.
+        `limit` y `offset` paginan el resultado. Devuelve un iterador de
+        tuplas (path, branch, version, hash, timestamp, message).
+        """
+        conditions = ['v.branch = ?']
+        params = [branch]
+        if path is not None:
+            conditions.append('v.path = ?')
+            params.append(path)
+        if since is not None:
+            conditions.append('v.timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('v.timestamp <= ?')
+            params.append(until)
+
+        if pattern is not None:
+            regex = re.compile(pattern)
+            matched = [(message_id,) for message_id, text in conn.execute('SELECT id, text FROM messages')
+                       if regex.search(text)]
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS matched_messages (id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM temp.matched_messages')
+            conn.executemany('INSERT INTO temp.matched_messages (id) VALUES (?)', matched)
+            conditions.append('v.message_id IN (SELECT id FROM temp.matched_messages)')
+
+        sql = ('SELECT v.path, v.branch, v.version, v.hash, v.timestamp, m.text '
+               'FROM versions v JOIN messages m ON m.id = v.message_id '
+               f"WHERE {' AND '.join(conditions)} ORDER BY v.timestamp, v.id")
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([limit if limit is not None else -1, offset])
+        return conn.execute(sql, params)
+
+    def paths_under(self, conn, directory):
+        """Devuelve los archivos bajo control de versiones dentro de `directory` (con su separador final)."""
+        # Los que empiezan por el prefijo están entre el prefijo y el prefijo con
+        # el último carácter incrementado
+        end = directory[:-1] + chr(ord(directory[-1]) + 1)
+        rows = conn.execute('SELECT path FROM paths WHERE path >= ? AND path < ? ORDER BY path', (directory, end))
+        return [row[0] for row in rows]
+
+    def versions_at(self, conn, branch, at, paths=None):
+        """Devuelve la última versión de cada archivo en `branch` con fecha igual o anterior a `at`.
+
+        Cada archivo se resuelve con una búsqueda en el índice (path, branch,
+        timestamp), no recorriendo sus versiones, aunque una descarga del
+        remoto las haya añadido fuera de orden. Sin `paths` se consideran
+        todos los archivos. Los archivos sin versiones hasta esa fecha se
+        omiten. Devuelve tuplas (path, branch, version, hash, timestamp, message).
+        """
+        source = 'paths'
+        if paths is not None:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_paths (path TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM temp.wanted_paths')
+            conn.executemany('INSERT OR IGNORE INTO temp.wanted_paths (path) VALUES (?)', ((path,) for path in paths))
+            source = 'temp.wanted_paths'
+
+        return conn.execute('SELECT v.path, v.branch, v.version, v.hash, v.timestamp, m.text '
+                            'FROM versions v JOIN messages m ON m.id = v.message_id '
+                            'WHERE v.id IN (SELECT (SELECT w.id FROM versions w '
+                            '                       WHERE w.path = p.path AND w.branch = ? AND w.timestamp <= ? '
+                            '                       ORDER BY w.timestamp DESC, w.id DESC LIMIT 1) '
+                            f'               FROM {source} p) '
+                            'ORDER BY v.path', (branch, at)).fetchall()
+
+    def match_hashes(self, conn, prefix, limit=2):
+        """Devuelve hasta `limit` hashes distintos que empiezan por `prefix` (hexadecimal en minúsculas).
+
+        La búsqueda es un rango sobre el índice de hashes: todos los que
+        empiezan por el prefijo están entre el prefijo y el prefijo seguido de
+        'g', el primer carácter posterior a los dígitos hexadecimales.
+        """
+        rows = conn.execute('SELECT DISTINCT hash FROM versions WHERE hash >= ? AND hash < ? ORDER BY hash LIMIT ?',
+                            (prefix, prefix + 'g', limit))
+        return [row[0] for row in rows]
+
+    def versions_with_hash(self, conn, content_hash):
+        """Devuelve las versiones con el hash indicado como tuplas (path, branch, version, hash, timestamp, message)."""
+        return conn.execute('SELECT v.path, v.branch, v.version, v.hash, v.timestamp, m.text '
+                            'FROM versions v JOIN messages m ON m.id = v.message_id '
+                            'WHERE v.hash = ? ORDER BY v.timestamp, v.id', (content_hash,)).fetchall()
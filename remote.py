@@ -0,0 +1,1149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Transporte remoto de SHIT
+Define la interfaz común de los repositorios remotos (objetos, referencias y
+registro del índice), la lógica de sincronización que la usa y un transporte
+sobre un directorio local o montado en red (NAS).
+"""
+
+import os
+import json
+import bisect
+import contextlib
+import hashlib
+import random
+import shutil
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from pathlib import Path
+
+
+# Registro incremental del índice: segmentos de registros con número de secuencia
+INDEX_HEAD_FILE = 'index_head.json'
+INDEX_LOG_FOLDER = 'index_log'
+INDEX_LOG_PENDING = 'index_log.jsonl'
+
+# Con más segmentos que este número se fusionan los antiguos en uno solo,
+# conservando los LOG_COMPACT_KEEP más recientes (que son los que lee un pull al día)
+LOG_COMPACT_SEGMENTS = 64
+LOG_COMPACT_KEEP = 16
+
+# Planificador de transferencias
+MAX_CONCURRENCY = 8  # Transferencias simultáneas como máximo
+INITIAL_CONCURRENCY = 2  # Transferencias simultáneas al empezar
+MAX_RETRIES = 8  # Reintentos por llamada
+RETRY_BUDGET = 20  # Reintentos disponibles en reserva
+RETRY_BUDGET_RATIO = 0.1  # Reintentos que recupera cada llamada correcta
+BACKOFF_BASE = 1.0  # Segundos
+BACKOFF_MAX = 64.0  # Segundos
+
+# Intentos de publicar en el registro remoto si otro usuario lo actualiza a la vez
+LOG_APPEND_ATTEMPTS = 5
+
+# Con más objetos que este número se lista el remoto en lugar de consultarlos uno a uno
+FETCH_LIST_THRESHOLD = 20
+
+# Tamaño de bloque al verificar objetos
+VERIFY_CHUNK_SIZE = 1024 * 1024
+
+# Bloqueo de los metadatos del repositorio local (índice, ramas y cachés)
+REPO_LOCK_NAME = 'lock'
+REPO_LOCK_TIMEOUT = 60  # Segundos
+
+# Bloqueos del repositorio que tiene cada hilo: (archivo, hilo) -> anidamiento
+_held_repo_locks = {}
+
+
+class CorruptObjectError(ValueError):
+    """El contenido de un objeto no coincide con el hash de su nombre."""
+
+
+def classify_network_error(error):
+    """Clasifica un error de transferencia genérico.
+    
+    Devuelve 'transient' para errores de red y None si no se debe
+    reintentar. Un objeto dañado no se reintenta: volver a copiarlo del mismo
+    remoto daría el mismo resultado.
+    """
+    if isinstance(error, CorruptObjectError):
+        return None
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+        return 'transient'
+    return None
+
+
+class ObjectVerifier:
+    """Descomprime y calcula el hash de un objeto de forma incremental."""
+    
+    def __init__(self, obj_hash):
+        self.obj_hash = obj_hash
+        self._decompressor = zlib.decompressobj()
+        self._hasher = hashlib.sha256()
+    
+    def update(self, data):
+        try:
+            self._hasher.update(self._decompressor.decompress(data))
+        except zlib.error as e:
+            raise CorruptObjectError(f"El objeto {self.obj_hash} está dañado ({e}).")
+    
+    def check(self):
+        """Comprueba que el objeto está completo y que su hash es el esperado."""
+        self._hasher.update(self._decompressor.flush())
+        if not self._decompressor.eof:
+            raise CorruptObjectError(f"El objeto {self.obj_hash} está incompleto.")
+        if self._hasher.hexdigest() != self.obj_hash:
+            raise CorruptObjectError(f"El objeto {self.obj_hash} está dañado (el hash no coincide).")
+
+
+class ObjectWriter:
+    """Destino de descarga de un objeto que se verifica mientras llega.
+    
+    Los datos se escriben en un archivo temporal a la vez que se descomprimen
+    y se añaden al hash; `commit` comprueba el hash y solo entonces mueve el
+    objeto a su ubicación definitiva. Si no se confirma, el temporal se borra.
+    """
+    
+    def __init__(self, obj_hash, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.temp_path = self.path.with_name(f"{self.path.name}.tmp{os.getpid()}_{threading.get_ident()}")
+        self._verifier = ObjectVerifier(obj_hash)
+        self._file = open(self.temp_path, 'wb')
+        self._committed = False
+    
+    def write(self, data):
+        self._file.write(data)
+        self._verifier.update(data)
+        return len(data)
+    
+    def commit(self):
+        self._file.close()
+        self._verifier.check()
+        os.replace(self.temp_path, self.path)
+        self._committed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._committed:
+            self._file.close()
+            if self.temp_path.exists():
+                self.temp_path.unlink()
+        return False
+
+
+def verify_object_file(path, obj_hash):
+    """Verifica un objeto ya escrito leyéndolo una sola vez por bloques."""
+    verifier = ObjectVerifier(obj_hash)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(VERIFY_CHUNK_SIZE)
+            if not chunk:
+                break
+            verifier.update(chunk)
+    verifier.check()
+
+
+def segment_range(name):
+    """Devuelve la primera y la última secuencia de un segmento (segment_<primera>_<última>.jsonl)."""
+    first, last = name[len('segment_'):-len('.jsonl')].split('_')
+    return int(first), int(last)
+
+
+def segments_after(names, after_seq):
+    """Devuelve, en orden, los segmentos con registros posteriores a `after_seq`.
+    
+    Los números de los nombres tienen ceros a la izquierda, así que el orden
+    alfabético es el de las secuencias y el primer segmento necesario (el
+    último que empieza antes de `after_seq` + 1) se busca por bisección.
+    """
+    names = sorted(name for name in names if name.startswith('segment_') and name.endswith('.jsonl'))
+    start = max(0, bisect.bisect_right(names, f"segment_{after_seq + 1:012d}_~") - 1)
+    return [name for name in names[start:] if segment_range(name)[1] > after_seq]
+
+
+def index_to_records(index):
+    """Convierte un índice completo en registros del registro incremental."""
+    records = []
+    for path, info in index.items():
+        records.append({'op': 'add', 'path': path, 'added_at': info.get('added_at')})
+        for version in info.get('versions', []):
+            records.append({'op': 'version', 'path': path, 'version': version})
+    return records
+
+
+def apply_index_records(index, records):
+    """Aplica registros al índice ignorando los ya presentes.
+    
+    Los números de versión se recalculan por rama en el orden de llegada.
+    Devuelve el número de registros aplicados.
+    """
+    aplicados = 0
+    for record in records:
+        path = record['path']
+        entry = index.get(path)
+        if entry is None:
+            added_at = record.get('added_at') or record.get('version', {}).get('timestamp')
+            entry = index[path] = {'added_at': added_at, 'versions': []}
+            if record['op'] == 'add':
+                aplicados += 1
+        
+        if record['op'] != 'version':
+            continue
+        
+        version = dict(record['version'])
+        branch = version.get('branch', 'master')
+        branch_versions = [v for v in entry['versions'] if v.get('branch', 'master') == branch]
+        if any(v['hash'] == version['hash'] and v['timestamp'] == version['timestamp']
+               for v in branch_versions):
+            continue
+        
+        version['version'] = len(branch_versions) + 1
+        entry['versions'].append(version)
+        aplicados += 1
+    
+    return aplicados
+
+
+class TransferScheduler:
+    """Planificador de transferencias con reintentos y control de concurrencia AIMD.
+    
+    Cada llamada correcta aumenta de forma aditiva el número de transferencias
+    simultáneas (hasta `max_concurrency`); cada error de cuota lo reduce a la
+    mitad. Los errores reintentables se reintentan con espera exponencial con
+    jitter; los errores transitorios consumen además un presupuesto de
+    reintentos que se recupera poco a poco con las llamadas correctas.
+    
+    Los hilos de `run` se crean la primera vez y se reutilizan en las
+    siguientes operaciones, junto con lo que cada uno guarde por hilo (p. ej.
+    las conexiones HTTP de Google Drive).
+    """
+    
+    def __init__(self, classify=classify_network_error, max_concurrency=MAX_CONCURRENCY,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_retries=MAX_RETRIES,
+                 retry_budget=RETRY_BUDGET):
+        self.classify = classify
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.max_budget = float(retry_budget)
+        self.retry_budget = float(retry_budget)
+        self.active = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._pool = None
+    
+    def _acquire(self):
+        """Espera a que haya hueco según el límite de concurrencia actual."""
+        with self._cond:
+            while self.active >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.active += 1
+    
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+    
+    def _on_success(self):
+        """Aumento aditivo de la concurrencia y recuperación del presupuesto."""
+        with self._cond:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self.retry_budget = min(self.max_budget, self.retry_budget + RETRY_BUDGET_RATIO)
+            self._cond.notify_all()
+    
+    def _on_quota_error(self, started):
+        """Reducción multiplicativa de la concurrencia.
+        
+        Solo se reduce una vez por episodio de saturación: los errores de
+        llamadas iniciadas antes de la última reducción no vuelven a reducir.
+        """
+        with self._cond:
+            if started > self._last_decrease:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = time.monotonic()
+    
+    def call(self, fn):
+        """Ejecuta `fn` reintentando los errores de cuota y transitorios.
+        
+        Cada intento ocupa un hueco del límite de concurrencia; las esperas
+        entre reintentos no lo ocupan.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self._release()
+                kind = self.classify(e)
+                if kind is None:
+                    raise
+                if kind == 'quota':
+                    self._on_quota_error(started)
+                
+                if attempt >= self.max_retries:
+                    raise
+                
+                # Los errores de cuota ya se frenan con el control AIMD; el
+                # presupuesto evita tormentas de reintentos ante fallos del servicio
+                if kind == 'transient':
+                    with self._cond:
+                        if self.retry_budget < 1:
+                            raise
+                        self.retry_budget -= 1
+                
+                # Espera exponencial con jitter completo
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
+                continue
+            
+            self._release()
+            self._on_success()
+            return result
+    
+    def run(self, tasks):
+        """Ejecuta en paralelo una lista de tareas (funciones sin argumentos).
+        
+        Las tareas se reparten entre los `max_concurrency` hilos del
+        planificador; las llamadas que hacen pasan por `call`, así que nunca
+        hay más en curso que el límite AIMD actual. Si alguna tarea falla no se
+        empiezan las pendientes (se espera a las que están en curso) y se
+        relanza el error.
+        """
+        with self._cond:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            pool = self._pool
+        
+        futures = [pool.submit(task) for task in tasks]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        wait(futures)
+        
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        return [future.result() for future in futures]
+
+
+class RemoteSync:
+    """Sincronización de un repositorio local con un repositorio remoto.
+    
+    Las subclases implementan el transporte (listar, comprobar, subir y
+    descargar objetos; leer y actualizar referencias con comparación previa;
+    leer y ampliar el registro del índice). Esta clase implementa sobre esas
+    operaciones push, pull, clone y la descarga de objetos bajo demanda.
+    """
+    
+    # Nombre del remoto para los mensajes
+    description = "el repositorio remoto"
+    # Archivo de configuración del remoto dentro de .shit
+    config_name = 'remote_config.json'
+    
+    def __init__(self, repo_path='.'):
+        self.repo_path = Path(repo_path)
+        self.vcs_dir = self.repo_path / '.shit'
+        self.remote_config_file = self.vcs_dir / self.config_name
+        self.remote_config = {}
+        self.scheduler = TransferScheduler()
+    
+    # Operaciones del transporte (a implementar por cada remoto)
+    
+    def connect(self):
+        """Prepara el acceso al remoto (autenticación, comprobaciones)."""
+        raise NotImplementedError
+    
+    def list_objects(self):
+        """Devuelve el conjunto de hashes de los objetos remotos."""
+        raise NotImplementedError
+    
+    def has_object(self, obj_hash):
+        """Indica si el objeto existe en el remoto."""
+        raise NotImplementedError
+    
+    def put_object(self, obj_hash, local_path):
+        """Sube un objeto al remoto."""
+        raise NotImplementedError
+    
+    def get_object(self, obj_hash, local_path):
+        """Descarga un objeto del remoto. Devuelve False si no existe."""
+        raise NotImplementedError
+    
+    def read_ref(self, branch):
+        """Lee la referencia remota de una rama (None si no existe)."""
+        raise NotImplementedError
+    
+    def update_ref(self, branch, old_value, new_value):
+        """Actualiza la referencia remota solo si su valor actual es `old_value`.
+        
+        Devuelve False si la referencia cambió entretanto.
+        """
+        raise NotImplementedError
+    
+    def read_log_head(self):
+        """Devuelve la última secuencia del registro remoto (None si no hay registro)."""
+        raise NotImplementedError
+    
+    def read_log_records(self, after_seq):
+        """Devuelve los registros remotos con secuencia posterior a `after_seq`."""
+        raise NotImplementedError
+    
+    def append_log_records(self, records, expected_seq):
+        """Añade un segmento de registros si la secuencia remota sigue siendo `expected_seq`.
+        
+        Devuelve False si otro usuario amplió el registro entretanto.
+        """
+        raise NotImplementedError
+    
+    def read_legacy_index(self):
+        """Devuelve el índice completo de remotos sin registro incremental, o None."""
+        return None
+    
+    def get_file(self, name, local_path):
+        """Descarga un archivo de la raíz del remoto. Devuelve False si no existe."""
+        raise NotImplementedError
+    
+    # Sincronización
+    
+    def push(self, branch='master'):
+        """Sube cambios locales al remoto."""
+        try:
+            # Cargar configuración
+            self._load_remote_config()
+            if not self.remote_config:
+                print("No hay repositorio remoto configurado. Use init_remote primero.")
+                return False
+            
+            self.connect()
+            
+            # Verificar el índice local
+            index_path = self.vcs_dir / 'index.json'
+            if not index_path.exists():
+                print("No hay índice local.")
+                return False
+            
+            # Incorporar primero los registros remotos que aún no conocemos
+            self._pull_index()
+            
+            # Sincronizar objetos (archivos versionados)
+            self._sync_objects()
+            
+            # Enviar solo los registros del índice que el remoto no tiene
+            enviados = self._push_index()
+            
+            # Actualizar rama actual
+            self._push_ref(branch)
+            
+            if enviados:
+                print(f"{enviados} registros del índice enviados.")
+            
+            # Actualizar última sincronización
+            self.remote_config['last_sync'] = str(time.time())
+            self._save_remote_config()
+            
+            print(f"Cambios de la rama '{branch}' enviados a {self.description}.")
+            return True
+        
+        except Exception as e:
+            print(f"Error al enviar cambios: {e}")
+            return False
+    
+    def pull(self, branch='master', depth=None):
+        """Obtiene cambios del remoto.
+        
+        Solo se descargan los objetos alcanzables desde la rama indicada
+        (opcionalmente limitados a las `depth` versiones más recientes por
+        archivo). En un clon bajo demanda solo se actualizan el índice y la
+        referencia: los objetos se descargan cuando se necesiten.
+        """
+        try:
+            # Cargar configuración
+            self._load_remote_config()
+            if not self.remote_config:
+                print("No hay repositorio remoto configurado. Use init_remote o clone primero.")
+                return False
+            
+            self.connect()
+            
+            # Incorporar los registros remotos posteriores al último conocido
+            remote_index = self._pull_index()
+            if remote_index is None:
+                print("No se encontró el índice remoto.")
+                return False
+            
+            # Descargar solo los objetos alcanzables desde la rama
+            lazy = self.remote_config.get('lazy')
+            if lazy:
+                descargados = 0
+            else:
+                wanted = self._reachable_hashes(remote_index, branch, depth)
+                descargados = self._sync_objects(download_only=True, wanted=wanted)
+            
+            # Descargar las referencias de ramas
+            self._pull_ref(branch)
+            
+            # Actualizar última sincronización
+            self.remote_config['last_sync'] = str(time.time())
+            self._save_remote_config()
+            
+            if lazy:
+                print(f"Cambios de la rama '{branch}' obtenidos desde {self.description} "
+                      "(clon bajo demanda: los objetos se descargarán cuando se necesiten).")
+            else:
+                print(f"Cambios de la rama '{branch}' obtenidos desde {self.description} ({descargados} objetos descargados).")
+            return True
+        
+        except Exception as e:
+            print(f"Error al obtener cambios: {e}")
+            return False
+    
+    def fetch_objects(self, hashes, quiet=False):
+        """Descarga bajo demanda los objetos indicados que falten en local.
+        
+        Devuelve la lista de hashes descargados. Con `quiet` los errores no se
+        muestran: los objetos que falten los detecta quien los pidió.
+        """
+        try:
+            self._load_remote_config()
+            if not self.remote_config:
+                return []
+            
+            self.connect()
+            
+            objects_dir = self.vcs_dir / 'objects'
+            missing = [h for h in hashes if not (objects_dir / h[:2] / h[2:]).exists()]
+            if not missing:
+                return []
+            
+            # Para muchos objetos es más barato listar el remoto una vez
+            if len(missing) > FETCH_LIST_THRESHOLD:
+                available = self.list_objects()
+                missing = [h for h in missing if h in available]
+            
+            results = self.scheduler.run([
+                lambda h=obj_hash: self.get_object(h, objects_dir / h[:2] / h[2:])
+                for obj_hash in missing
+            ])
+            
+            return [h for h, ok in zip(missing, results) if ok]
+        
+        except Exception as e:
+            if not quiet:
+                print(f"Error al descargar objetos: {e}")
+            return []
+    
+    def remote_objects(self):
+        """Devuelve el conjunto de hashes de los objetos presentes en el remoto.
+        
+        Devuelve None si no hay repositorio remoto configurado.
+        """
+        self._load_remote_config()
+        if not self.remote_config:
+            return None
+        
+        self.connect()
+        return self.list_objects()
+    
+    def share(self, email, role='writer'):
+        """Comparte el repositorio con otro usuario."""
+        print(f"Compartir no está disponible para {self.description}.")
+        return False
+    
+    def _clone_into(self, local_repo, remote_config, branch='master', depth=None, lazy=False):
+        """Crea un clon local en `local_repo` a partir del remoto ya identificado.
+        
+        Devuelve el número de objetos descargados.
+        """
+        vcs_dir = local_repo / '.shit'
+        (vcs_dir / 'objects').mkdir(parents=True, exist_ok=True)
+        (vcs_dir / 'refs' / 'branches').mkdir(parents=True, exist_ok=True)
+        
+        # A partir de aquí se trabaja sobre el repositorio clonado
+        self.repo_path = local_repo
+        self.vcs_dir = vcs_dir
+        self.remote_config_file = vcs_dir / self.config_name
+        self.remote_config = dict(remote_config, lazy=lazy, index_log_seeded=True, last_sync=None)
+        self._save_remote_config()
+        
+        # Descargar la configuración compartida
+        self.get_file('config.json', vcs_dir / 'config.json')
+        
+        # Establecer la rama actual del clon
+        with open(vcs_dir / 'HEAD', 'w') as f:
+            f.write(branch)
+        
+        # Reconstruir el índice a partir del registro remoto
+        remote_index = self._pull_index()
+        if remote_index is None:
+            remote_index = {}
+            self._save_local_index(remote_index)
+        self._save_remote_config()
+        
+        # Descargar solo los objetos que necesita la rama solicitada
+        if lazy:
+            descargados = 0
+        else:
+            wanted = self._reachable_hashes(remote_index, branch, depth)
+            descargados = self._sync_objects(download_only=True, wanted=wanted)
+        self._pull_ref(branch)
+        
+        return descargados
+    
+    def _push_ref(self, branch):
+        """Publica la referencia local de la rama si cambió."""
+        branch_path = self.vcs_dir / 'refs' / 'branches' / branch
+        if not branch_path.exists():
+            return
+        
+        with open(branch_path, 'r') as f:
+            local_value = f.read().strip()
+        
+        remote_value = self.read_ref(branch)
+        if remote_value == local_value:
+            return
+        
+        if not self.update_ref(branch, remote_value, local_value):
+            print(f"Advertencia: La rama remota '{branch}' cambió durante el envío; no se actualizó.")
+    
+    def _pull_ref(self, branch):
+        """Descarga la referencia remota de la rama."""
+        remote_value = self.read_ref(branch)
+        if remote_value is None:
+            return
+        
+        branch_path = self.vcs_dir / 'refs' / 'branches' / branch
+        branch_path.parent.mkdir(parents=True, exist_ok=True)
+        with repo_lock(self.vcs_dir):
+            write_atomic(branch_path, remote_value)
+    
+    def _local_objects(self):
+        """Devuelve el conjunto de hashes de los objetos locales."""
+        objects_dir = self.vcs_dir / 'objects'
+        local_objects = set()
+        
+        if objects_dir.exists():
+            for prefix_dir in objects_dir.iterdir():
+                if prefix_dir.is_dir():
+                    for obj_file in prefix_dir.iterdir():
+                        if obj_file.is_file() and '.tmp' not in obj_file.name:
+                            local_objects.add(prefix_dir.name + obj_file.name)
+        
+        return local_objects
+    
+    def _sync_objects(self, download_only=False, wanted=None):
+        """Sincroniza los objetos entre local y remoto.
+        
+        Si se indica `wanted`, solo se descargan los objetos de ese conjunto.
+        Devuelve el número de objetos descargados.
+        """
+        objects_dir = self.vcs_dir / 'objects'
+        local_objects = self._local_objects()
+        remote_objects = self.list_objects()
+        
+        if not download_only:
+            # Subir en paralelo los objetos locales que no están en remoto
+            self.scheduler.run([
+                lambda h=obj_hash: self.put_object(h, objects_dir / h[:2] / h[2:])
+                for obj_hash in sorted(local_objects - remote_objects)
+            ])
+        
+        # Descargar objetos remotos que no están en local
+        if wanted is None:
+            to_download = set(remote_objects)
+        else:
+            to_download = set(wanted)
+            missing = to_download - remote_objects - local_objects
+            if missing:
+                print(f"Advertencia: {len(missing)} objetos de la rama no están en el remoto.")
+        
+        # Descargar en paralelo
+        hashes = sorted((to_download & remote_objects) - local_objects)
+        self.scheduler.run([
+            lambda h=obj_hash: self.get_object(h, objects_dir / h[:2] / h[2:])
+            for obj_hash in hashes
+        ])
+        return len(hashes)
+    
+    def _reachable_hashes(self, index, branch, depth=None):
+        """Calcula los hashes de objetos alcanzables desde una rama del índice.
+        
+        Si se indica `depth`, solo se consideran las `depth` versiones más
+        recientes de cada archivo en la rama.
+        """
+        hashes = set()
+        for info in index.values():
+            versions = [v for v in info.get('versions', []) if v.get('branch', 'master') == branch]
+            if depth is not None and depth > 0:
+                versions = versions[-depth:]
+            for version in versions:
+                hashes.add(version['hash'])
+        return hashes
+    
+    def _load_local_index(self):
+        """Carga el índice local."""
+        index_path = self.vcs_dir / 'index.json'
+        if index_path.exists():
+            with open(index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+    
+    def _save_local_index(self, index):
+        """Guarda el índice local."""
+        write_atomic(self.vcs_dir / 'index.json', json.dumps(index, indent=2))
+    
+    def _pull_index(self):
+        """Incorpora al índice local los registros remotos posteriores al último conocido.
+        
+        Devuelve el índice local actualizado, o None si el remoto no tiene índice.
+        """
+        head_seq = self.read_log_head()
+        
+        if head_seq is None:
+            # Remoto sin registro incremental: usar el índice completo si existe
+            legacy_index = self.read_legacy_index()
+            if legacy_index is None:
+                return None
+            with repo_lock(self.vcs_dir):
+                local_index = self._load_local_index()
+                apply_index_records(local_index, index_to_records(legacy_index))
+                self._save_local_index(local_index)
+            return local_index
+        
+        known_seq = self.remote_config.get('remote_seq', 0)
+        if head_seq > known_seq:
+            records = self.read_log_records(known_seq)
+            # Leer, aplicar y guardar con el repositorio bloqueado para no perder commits simultáneos
+            with repo_lock(self.vcs_dir):
+                local_index = self._load_local_index()
+                aplicados = apply_index_records(local_index, records)
+                self._save_local_index(local_index)
+            if aplicados:
+                print(f"{aplicados} registros del índice recibidos.")
+        else:
+            local_index = self._load_local_index()
+        
+        self.remote_config['remote_seq'] = head_seq
+        return local_index
+    
+    def _push_index(self):
+        """Publica como un nuevo segmento los registros del índice que el remoto no tiene.
+        
+        Si otro usuario amplía el registro a la vez, se incorporan sus
+        registros y se vuelve a intentar. Devuelve el número de registros enviados.
+        """
+        pending_path = self.vcs_dir / INDEX_LOG_PENDING
+        pending_lines = []
+        if pending_path.exists():
+            with open(pending_path, 'r', encoding='utf-8') as f:
+                pending_lines = [line for line in f if line.strip()]
+        
+        if not self.remote_config.get('index_log_seeded'):
+            # Primera sincronización incremental: enviar el índice completo
+            records = index_to_records(self._load_local_index())
+        else:
+            records = [json.loads(line) for line in pending_lines]
+        
+        if records:
+            for _ in range(LOG_APPEND_ATTEMPTS):
+                head_seq = self.remote_config.get('remote_seq', 0)
+                for offset, record in enumerate(records, 1):
+                    record['seq'] = head_seq + offset
+                
+                if self.append_log_records(records, head_seq):
+                    self.remote_config['remote_seq'] = head_seq + len(records)
+                    break
+                
+                # Otro usuario publicó antes: incorporar sus registros y reintentar
+                self._pull_index()
+            else:
+                raise RuntimeError("El registro remoto del índice cambia continuamente; inténtelo más tarde.")
+        
+        self.remote_config['index_log_seeded'] = True
+        
+        # Descartar los registros pendientes ya enviados (conservar los añadidos mientras tanto)
+        if pending_lines:
+            with repo_lock(self.vcs_dir):
+                with open(pending_path, 'r', encoding='utf-8') as f:
+                    remaining = [line for line in f if line.strip()][len(pending_lines):]
+                write_atomic(pending_path, ''.join(remaining))
+        
+        return len(records)
+    
+    def _save_remote_config(self):
+        """Guarda la configuración del remoto en el repositorio local."""
+        self.vcs_dir.mkdir(exist_ok=True)
+        write_atomic(self.remote_config_file, json.dumps(self.remote_config, indent=2))
+    
+    def _load_remote_config(self):
+        """Carga la configuración del remoto desde el repositorio local."""
+        if self.remote_config_file.exists():
+            with open(self.remote_config_file, 'r', encoding='utf-8') as f:
+                self.remote_config = json.load(f)
+        else:
+            self.remote_config = {}
+
+
+def _copy_file(src, dst):
+    """Copia un archivo usando copy_file_range cuando el sistema lo permite.
+    
+    En sistemas de archivos que lo soportan (Btrfs, XFS, NFS 4.2, SMB) la copia
+    se hace en el servidor o compartiendo bloques, sin pasar los datos por el proceso.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def _link_or_copy(src, dst, obj_hash=None):
+    """Coloca `src` en `dst` de forma atómica: enlace duro si es posible, si no copia.
+    
+    Con `obj_hash` el objeto se verifica antes de moverlo a `dst`.
+    """
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = dst.with_name(f"{dst.name}.tmp{os.getpid()}_{threading.get_ident()}")
+    try:
+        try:
+            os.link(src, temp_path)
+        except OSError:
+            _copy_file(src, temp_path)
+        if obj_hash is not None:
+            verify_object_file(temp_path, obj_hash)
+        os.replace(temp_path, dst)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def write_atomic(path, content):
+    """Escribe un archivo de texto de forma atómica (temporal y os.replace).
+    
+    Quien lo lee ve el contenido anterior o el nuevo, nunca uno a medias.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f"{path.name}.tmp{os.getpid()}_{threading.get_ident()}")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def _try_lock_file(fd):
+    """Intenta bloquear un archivo abierto sin esperar; el sistema libera el bloqueo al terminar el proceso."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (BlockingIOError, PermissionError):
+        return False
+    return True
+
+def _unlock_file(fd):
+    """Libera el bloqueo obtenido con _try_lock_file."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        return
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+@contextlib.contextmanager
+def repo_lock(vcs_dir, timeout=REPO_LOCK_TIMEOUT):
+    """Bloqueo exclusivo de los metadatos de un repositorio local (`.shit/lock`).
+    
+    Protege las actualizaciones del índice, las ramas y las cachés, que
+    comparten los directorios de trabajo adicionales. Usa un bloqueo del
+    sistema (flock o msvcrt.locking) sobre el archivo, que se libera solo si
+    el proceso termina de forma inesperada; es reentrante dentro de un mismo
+    hilo. Lanza TimeoutError si no se obtiene en `timeout` segundos.
+    """
+    lock_path = Path(vcs_dir) / REPO_LOCK_NAME
+    key = (os.path.abspath(lock_path), threading.get_ident())
+    if key in _held_repo_locks:
+        _held_repo_locks[key] += 1
+        try:
+            yield lock_path
+        finally:
+            _held_repo_locks[key] -= 1
+        return
+    
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        deadline = time.monotonic() + timeout
+        while not _try_lock_file(fd):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"El repositorio está bloqueado por otro proceso ({lock_path}).")
+            time.sleep(0.05)
+        
+        # Solo informativo: quién tiene el bloqueo
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{socket.gethostname()}:{os.getpid()}".encode())
+        os.lseek(fd, 0, os.SEEK_SET)
+        
+        _held_repo_locks[key] = 1
+        try:
+            yield lock_path
+        finally:
+            del _held_repo_locks[key]
+            _unlock_file(fd)
+    finally:
+        os.close(fd)
+
+
+class LocalRemote(RemoteSync):
+    """Repositorio remoto en un directorio local o montado en red (NAS).
+    
+    Estructura del remoto:
+        config.json, index_head.json
+        objects/<xx>/<resto del hash>
+        refs/branches/<rama>
+        index_log/segment_<primera>_<última>.jsonl (los antiguos se fusionan)
+    
+    Los objetos se transfieren con enlaces duros cuando el remoto está en el
+    mismo sistema de archivos, y con copy_file_range en otro caso. Las
+    actualizaciones de referencias y del registro se serializan con un
+    archivo de bloqueo, lo que permite comparar e intercambiar de forma segura.
+    """
+    
+    config_name = 'remote_config.json'
+    
+    # Tiempo máximo esperando el bloqueo del remoto (segundos)
+    LOCK_TIMEOUT = 30
+    
+    @property
+    def remote_path(self):
+        return Path(self.remote_config['path'])
+    
+    @property
+    def description(self):
+        return self.remote_config.get('path', 'el directorio remoto')
+    
+    def init_remote(self, repo_name, base_path):
+        """Inicializa un repositorio remoto en un directorio."""
+        try:
+            remote_path = Path(base_path).resolve() / repo_name
+            if (remote_path / INDEX_HEAD_FILE).exists() or (remote_path / 'objects').exists():
+                print(f"Error: Ya existe un repositorio remoto en {remote_path}")
+                return None
+            
+            (remote_path / 'objects').mkdir(parents=True, exist_ok=True)
+            (remote_path / 'refs' / 'branches').mkdir(parents=True, exist_ok=True)
+            (remote_path / INDEX_LOG_FOLDER).mkdir(exist_ok=True)
+            
+            # Crear archivo compartido de configuración
+            if (self.vcs_dir / 'config.json').exists():
+                shutil.copyfile(self.vcs_dir / 'config.json', remote_path / 'config.json')
+            
+            self.remote_config = {
+                'type': 'local',
+                'repo_name': repo_name,
+                'path': str(remote_path),
+                'last_sync': None
+            }
+            self._save_remote_config()
+            
+            print(f"Repositorio remoto '{repo_name}' inicializado en {remote_path}.")
+            return str(remote_path)
+        
+        except Exception as e:
+            print(f"Error al inicializar repositorio remoto: {e}")
+            return None
+    
+    def clone(self, remote_dir, target_dir='.', branch='master', depth=None, lazy=False):
+        """Clona un repositorio desde un directorio remoto."""
+        try:
+            remote_path = Path(remote_dir).resolve()
+            if not (remote_path / 'objects').is_dir():
+                print(f"Error: {remote_path} no es un repositorio remoto de SHIT.")
+                return None
+            
+            repo_name = remote_path.name
+            local_repo = Path(target_dir) / repo_name
+            local_repo.mkdir(parents=True, exist_ok=True)
+            
+            self.remote_config = {'type': 'local', 'repo_name': repo_name, 'path': str(remote_path)}
+            descargados = self._clone_into(local_repo, self.remote_config, branch, depth, lazy)
+            
+            print(f"Repositorio '{repo_name}' clonado desde {remote_path} a {local_repo}")
+            if lazy:
+                print("Clon bajo demanda: los objetos se descargarán cuando se necesiten.")
+            else:
+                print(f"Rama '{branch}': {descargados} objetos descargados.")
+            return local_repo
+        
+        except Exception as e:
+            print(f"Error al clonar repositorio: {e}")
+            return None
+    
+    def connect(self):
+        if not self.remote_path.is_dir():
+            raise FileNotFoundError(f"No se encuentra el repositorio remoto en {self.remote_path}")
+        return True
+    
+    def _lock(self):
+        """Adquiere el bloqueo exclusivo del remoto (archivo creado con O_EXCL)."""
+        lock_path = self.remote_path / 'lock'
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, f"{socket.gethostname()}:{os.getpid()}".encode())
+                os.close(fd)
+                return lock_path
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"No se pudo bloquear el remoto ({lock_path} existe).")
+                time.sleep(0.05)
+    
+    def list_objects(self):
+        objects_dir = self.remote_path / 'objects'
+        remote_objects = set()
+        for prefix_dir in os.scandir(objects_dir):
+            if prefix_dir.is_dir():
+                for obj_file in os.scandir(prefix_dir.path):
+                    if obj_file.is_file() and '.tmp' not in obj_file.name:
+                        remote_objects.add(prefix_dir.name + obj_file.name)
+        return remote_objects
+    
+    def has_object(self, obj_hash):
+        return (self.remote_path / 'objects' / obj_hash[:2] / obj_hash[2:]).exists()
+    
+    def put_object(self, obj_hash, local_path):
+        _link_or_copy(local_path, self.remote_path / 'objects' / obj_hash[:2] / obj_hash[2:])
+    
+    def get_object(self, obj_hash, local_path):
+        remote_file = self.remote_path / 'objects' / obj_hash[:2] / obj_hash[2:]
+        if not remote_file.exists():
+            return False
+        # El enlace o la copia no pasan los datos por el proceso: se verifican con una lectura
+        self.scheduler.call(lambda: _link_or_copy(remote_file, local_path, obj_hash))
+        return True
+    
+    def read_ref(self, branch):
+        ref_path = self.remote_path / 'refs' / 'branches' / branch
+        if not ref_path.exists():
+            return None
+        with open(ref_path, 'r') as f:
+            return f.read().strip()
+    
+    def update_ref(self, branch, old_value, new_value):
+        lock_path = self._lock()
+        try:
+            if self.read_ref(branch) != old_value:
+                return False
+            ref_path = self.remote_path / 'refs' / 'branches' / branch
+            ref_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(ref_path, new_value)
+            return True
+        finally:
+            os.unlink(lock_path)
+    
+    def read_log_head(self):
+        head_path = self.remote_path / INDEX_HEAD_FILE
+        if not head_path.exists():
+            return None
+        with open(head_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['seq']
+    
+    def read_log_records(self, after_seq):
+        log_dir = self.remote_path / INDEX_LOG_FOLDER
+        if not log_dir.exists():
+            return []
+        
+        # Una fusión simultánea puede borrar un segmento entre el listado y la
+        # lectura: se vuelve a listar (los registros repetidos se descartan por secuencia)
+        for _ in range(LOG_APPEND_ATTEMPTS):
+            records = {}
+            try:
+                for name in segments_after(os.listdir(log_dir), after_seq):
+                    with open(log_dir / name, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            if line.strip():
+                                record = json.loads(line)
+                                if record['seq'] > after_seq:
+                                    records[record['seq']] = record
+            except FileNotFoundError:
+                continue
+            return [records[seq] for seq in sorted(records)]
+        raise RuntimeError("El registro remoto del índice cambia continuamente; inténtelo más tarde.")
+    
+    def append_log_records(self, records, expected_seq):
+        lock_path = self._lock()
+        try:
+            if (self.read_log_head() or 0) != expected_seq:
+                return False
+            
+            first_seq = records[0]['seq']
+            last_seq = records[-1]['seq']
+            log_dir = self.remote_path / INDEX_LOG_FOLDER
+            log_dir.mkdir(exist_ok=True)
+            
+            segment_name = f"segment_{first_seq:012d}_{last_seq:012d}.jsonl"
+            write_atomic(log_dir / segment_name, ''.join(json.dumps(r) + '\n' for r in records))
+            write_atomic(self.remote_path / INDEX_HEAD_FILE, json.dumps({'seq': last_seq}))
+            self._compact_log(log_dir)
+            return True
+        finally:
+            os.unlink(lock_path)
+    
+    def _compact_log(self, log_dir):
+        """Fusiona los segmentos antiguos del registro si hay demasiados (con el remoto bloqueado).
+        
+        El segmento fusionado se escribe antes de borrar los originales, así
+        que quien lee a la vez encuentra siempre todos los registros.
+        """
+        names = segments_after(os.listdir(log_dir), 0)
+        if len(names) <= LOG_COMPACT_SEGMENTS:
+            return
+        
+        old = names[:-LOG_COMPACT_KEEP]
+        first_seq, last_seq = segment_range(old[0])[0], segment_range(old[-1])[1]
+        merged_path = log_dir / f"segment_{first_seq:012d}_{last_seq:012d}.jsonl"
+        temp_path = merged_path.with_name(f"{merged_path.name}.tmp{os.getpid()}")
+        with open(temp_path, 'wb') as out:
+            for name in old:
+                with open(log_dir / name, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(temp_path, merged_path)
+        for name in old:
+            if log_dir / name != merged_path:
+                os.unlink(log_dir / name)
+    
+    def get_file(self, name, local_path):
+        remote_file = self.remote_path / name
+        if not remote_file.exists():
+            return False
+        shutil.copyfile(remote_file, local_path)
+        return True
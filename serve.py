@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Servidor de SHIT por repositorio (shit serve)
+Mantiene el proceso de Python, el índice y la caché de estado de archivos en
+memoria y atiende los comandos de la CLI a través de un socket Unix. El
+cliente no depende de nada más que la biblioteca estándar para que el
+arranque sea mínimo.
+"""
+
+import os
+import io
+import sys
+import json
+
+
+# Socket del servidor dentro de .shit
+SOCKET_NAME = 'serve.sock'
+
+# Tamaño de lectura del socket
+RECV_SIZE = 65536
+
+
+def supported():
+    """Indica si el sistema tiene sockets Unix.
+    
+    `socket` se importa aquí y no al cargar el módulo: el cliente se carga en
+    cada ejecución de `shit` y casi nunca hay un servidor al que conectarse.
+    """
+    import socket
+    return hasattr(socket, 'AF_UNIX')
+
+
+def find_socket(start_dir=None):
+    """Busca el socket del servidor subiendo desde `start_dir` (o el directorio actual)."""
+    current = os.path.abspath(start_dir or os.getcwd())
+    while True:
+        candidate = os.path.join(current, '.shit', SOCKET_NAME)
+        if os.path.exists(candidate):
+            return candidate
+        # Un repositorio sin servidor: no seguir buscando en directorios superiores
+        if os.path.isdir(os.path.join(current, '.shit')):
+            return None
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _messages(conn):
+    """Itera sobre los mensajes (una línea JSON cada uno) recibidos por el socket."""
+    buffer = b''
+    while True:
+        data = conn.recv(RECV_SIZE)
+        if not data:
+            return
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            yield json.loads(line)
+
+
+def run_client(argv):
+    """Ejecuta un comando en el servidor del repositorio, si hay uno en marcha.
+    
+    Devuelve el código de salida del comando, o None si no hay servidor y el
+    comando debe ejecutarse en el propio proceso.
+    """
+    socket_path = find_socket()
+    if socket_path is None or not supported():
+        return None
+    
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        # Socket de un servidor que ya no existe
+        conn.close()
+        return None
+    
+    try:
+        _send(conn, {'argv': argv, 'cwd': os.getcwd()})
+        for message in _messages(conn):
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+            elif 'exit' in message:
+                sys.stdout.flush()
+                return message['exit']
+    except BrokenPipeError:
+        # La salida se cerró antes de tiempo (p. ej. `shit log | head -1`):
+        # terminar sin traza y sin volver a escribir en ella al salir
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        return 1
+    finally:
+        conn.close()
+    
+    # El servidor se cerró a mitad del comando
+    sys.stderr.write("Error: Se perdió la conexión con 'shit serve'.\n")
+    return 1
+
+
+def server_running(vcs_dir):
+    """Indica si hay un servidor vivo escuchando en el socket del repositorio."""
+    socket_path = os.path.join(str(vcs_dir), SOCKET_NAME)
+    if not os.path.exists(socket_path) or not supported():
+        return False
+    
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def stop_server(vcs_dir):
+    """Pide al servidor del repositorio que termine. Devuelve False si no había servidor."""
+    socket_path = os.path.join(str(vcs_dir), SOCKET_NAME)
+    if not os.path.exists(socket_path) or not supported():
+        return False
+    
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        _send(conn, {'shutdown': True})
+        for _ in _messages(conn):
+            pass
+        return True
+    except OSError:
+        os.unlink(socket_path)
+        return False
+    finally:
+        conn.close()
+
+
+class _SocketWriter(io.TextIOBase):
+    """Salida de texto que reenvía lo escrito al cliente.
+    
+    Si el cliente se desconecta la salida se descarta: el comando termina
+    igualmente en lugar de quedarse a medias.
+    """
+    
+    encoding = 'utf-8'
+    
+    def __init__(self, conn, stream):
+        self.conn = conn
+        self.stream = stream
+        self.closed_by_client = False
+    
+    def writable(self):
+        return True
+    
+    def write(self, text):
+        # Algunas bibliotecas (click) escriben bytes en la salida de errores
+        if isinstance(text, (bytes, bytearray)):
+            text = bytes(text).decode(self.encoding, 'replace')
+        if text and not self.closed_by_client:
+            try:
+                _send(self.conn, {self.stream: text})
+            except OSError:
+                self.closed_by_client = True
+        return len(text)
+
+
+class ServeDaemon:
+    """Servidor de comandos de un repositorio sobre un socket Unix.
+    
+    Los comandos se atienden de uno en uno: cada uno se ejecuta con
+    `handler(argv)` en el directorio de trabajo del cliente y con la salida
+    estándar y de errores redirigidas al socket.
+    """
+    
+    def __init__(self, vcs_dir, handler):
+        self.socket_path = os.path.join(str(vcs_dir), SOCKET_NAME)
+        self.handler = handler
+        self.running = False
+    
+    def serve_forever(self):
+        """Atiende peticiones hasta recibir una orden de parada."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        
+        import socket
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)  # Solo el propietario puede conectarse
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        
+        self.running = True
+        try:
+            while self.running:
+                conn, _ = server.accept()
+                try:
+                    self._handle(conn)
+                except Exception:
+                    # Cliente desconectado o petición no válida: seguir atendiendo
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+    
+    def _handle(self, conn):
+        request = next(_messages(conn), None)
+        if request is None:
+            return
+        
+        if request.get('shutdown'):
+            self.running = False
+            _send(conn, {'exit': 0})
+            return
+        
+        saved = (os.getcwd(), sys.stdout, sys.stderr, sys.stdin)
+        try:
+            os.chdir(request['cwd'])
+            sys.stdout = _SocketWriter(conn, 'out')
+            sys.stderr = _SocketWriter(conn, 'err')
+            sys.stdin = io.StringIO()
+            exit_code = self.handler(request['argv'])
+        finally:
+            os.chdir(saved[0])
+            sys.stdout, sys.stderr, sys.stdin = saved[1:]
+        
+        _send(conn, {'exit': exit_code})
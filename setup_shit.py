@@ -49,7 +49,7 @@ def crear_directorio_oculto():
 def copiar_archivos_necesarios(home_dir):
     """Copia los archivos necesarios al directorio oculto, sobrescribiendo siempre los existentes"""
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    files_to_copy = ["shit.py", "drive_sync.py", "requirements.txt"]
+    files_to_copy = ["shit.py", "drive_sync.py", "remote.py", "serve.py", "history.py", "requirements.txt"]
     
     for file in files_to_copy:
         src_file = os.path.join(current_dir, file)
@@ -133,19 +133,34 @@ def main():
     print("  shit commit archivo -m \"mensaje\"   - Guardar versión de un archivo específico")
     print("  shit log archivo                   - Ver historial de versiones de un archivo")
     print("  shit log                           - Ver historial de todos los archivos")
+    print("  shit log --since 2024-05-01 --grep regex --limit 50 --offset 50 --format ndjson - Historial filtrado y paginado")
     print("  shit status                        - Muestra archivos modificados, añadidos y sin seguimiento")
-    print("  shit checkout archivo versión      - Recuperar una versión")
+    print("  shit checkout archivo versión|hash - Recuperar una versión")
+    print("  shit checkout --all [-b rama]      - Restaurar el repositorio (o directorios) al estado de una rama")
+    print("  shit checkout --at fecha --all     - Restaurar el repositorio (o rutas concretas) al estado de una fecha")
+    print("  shit show hash                     - Ver los archivos y versiones con un hash (puede abreviarse)")
     print("  shit branch create nombre          - Crear una nueva rama")
     print("  shit branch list                   - Listar ramas disponibles")
-    print("  shit branch switch nombre          - Cambiar de rama")
+    print("  shit branch switch nombre          - Cambiar de rama (actualiza solo los archivos que difieren)")
     print("  shit branch merge origen [destino] - Fusionar ramas")
+    print("  shit branch diff origen [destino]  - Ver los archivos en que difieren dos ramas")
     print("  shit remote init nombre            - Inicializar repositorio remoto en Google Drive")
     print("  shit remote clone id               - Clonar desde Google Drive")
+    print("  shit remote init nombre --path dir - Inicializar repositorio remoto en un directorio o NAS")
+    print("  shit remote clone dir              - Clonar desde un directorio remoto")
     print("  shit remote push                   - Subir cambios al remoto")
     print("  shit remote pull                   - Obtener cambios del remoto")
     print("  shit remote share email            - Compartir el repositorio remoto")
     print("  shit reset --soft <hash>           - Retrocede HEAD y deja cambios en staging")
     print("  shit reflog                        - Ver historial de movimientos de HEAD")
+    print("  shit maintenance --budget 10G      - Limitar el espacio local de objetos (expulsa los ya subidos)")
+    print("  shit bundle create archivo [-b rama] - Empaquetar objetos y metadatos en un archivo")
+    print("  shit bundle unbundle archivo       - Verificar e importar un paquete")
+    print("  shit sparse set patrón...          - Materializar solo los archivos que coinciden (list, disable)")
+    print("  shit worktree add dir rama         - Otro directorio de trabajo que comparte objetos e historial")
+    print("  shit gc --share                    - Guardar los objetos una sola vez para todos los repositorios")
+    print("  shit sync start | stop | status    - Enviar los cambios al remoto en segundo plano")
+    print("  shit serve --detach | --stop       - Servidor persistente para respuestas inmediatas")
     print("\nPara más información, consulte la documentación en README.md")
 
 if __name__ == "__main__":
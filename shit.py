@@ -7,16 +7,30 @@ SHIT - Sistema de Historial Integral de Transformaciones
 
 import os # para manejar archivos y directorios
 import sys # para manejar argumentos de la linea de comandos
+
+# Si hay un servidor `shit serve` en marcha para el repositorio, el comando se
+# ejecuta en él sin cargar el resto del programa
+if __name__ == '__main__' and sys.argv[1:2] != ['serve'] and sys.argv[1:3] != ['sync', 'run']:
+    import serve
+    _exit_code = serve.run_client(sys.argv[1:])
+    if _exit_code is not None:
+        sys.exit(_exit_code)
+
 import hashlib # para calcular hashes de datos
 import zlib # para comprimir y descomprimir datos
 import json # para manejar datos en formato JSON
 import datetime # para manejar fechas y horas
+import re # para filtrar el historial por mensaje
+import bisect # para buscar rutas en los árboles ordenados
+import heapq # para recorrer los commits por fecha
+import fnmatch # para los patrones del checkout parcial
 import shutil # para copiar y mover archivos
 import time # para manejar tiempos
-import subprocess # para ejecutar comandos del sistema
-import argparse # para manejar argumentos de la linea de comandos
+import functools # para el decorador de los comandos que bloquean el repositorio
+import signal # para detener el proceso de sincronización
 import platform # para obtener información del sistema operativo
 import getpass # para obtener el nombre del usuario 
+from collections import namedtuple # para los resultados de la API de Python
 import click # para manejar comandos de la linea de comandos
 from pathlib import Path # para manejar rutas de archivos y directorios
 
@@ -24,12 +38,12 @@ from pathlib import Path # para manejar rutas de archivos y directorios
 if platform.system() == "Windows":
     import ctypes
 
-# Importar el módulo de sincronización con Google Drive
-try:
-    from drive_sync import DriveSync
-    DRIVE_SUPPORT = True
-except ImportError:
-    DRIVE_SUPPORT = False
+# Los módulos de remotos (Google Drive y directorios) y subprocess se importan
+# solo en los comandos que los usan: cargar las bibliotecas de Google tarda
+# mucho más que el resto del programa y lo pagaría cada `shit status`
+
+# Servidor persistente por repositorio (shit serve)
+import serve
 
 # Ubicación del directorio oculto donde se almacenará el repositorio
 # Ahora usamos un directorio oculto local, similar a Git
@@ -43,9 +57,303 @@ else:
 # Constante para atributos de archivo en Windows
 FILE_ATTRIBUTE_HIDDEN = 0x02
 
+# Tamaño máximo por defecto de la caché de objetos descargados bajo demanda (1 GB)
+DEFAULT_LAZY_CACHE_LIMIT = 1024 ** 3
+
+# Paquetes para transferencias sin conexión (shit bundle)
+BUNDLE_SIGNATURE = b"# shit bundle v1\n"
+BUNDLE_TRAILER = "# sha256 "
+BUNDLE_CHUNK_SIZE = 1024 * 1024
+
+# Estado de los repositorios en memoria, solo dentro de `shit serve`:
+# directorio .shit -> {'index_key', 'index', 'stat'}
+_REPO_STATE = None
+
+# Un archivo modificado hace menos de estos segundos se vuelve a leer aunque
+# su fecha y tamaño coincidan (la fecha puede no haber cambiado aún)
+STAT_CACHE_RACY_WINDOW = 2
+
+# Sincronización en segundo plano (shit sync)
+SYNC_INTERVAL = 30  # Segundos entre envíos
+SYNC_QUIET_PERIOD = 2  # Segundos sin cambios en el índice antes de enviar
+SYNC_MAX_BACKOFF = 600  # Espera máxima entre reintentos sin conexión (segundos)
+
+# Longitud mínima de un hash abreviado
+MIN_HASH_PREFIX = 4
+
+# Hilos para escribir archivos en paralelo al restaurar varios a la vez
+CHECKOUT_WORKERS = 8
+
+# Mapeos del modo centralizado: directorio de trabajo -> repositorio oculto
+MAPPINGS_DIR = os.path.join(HOME_DIR, "mappings")
+
+# Almacén de objetos compartido por los repositorios del modo centralizado (ver `shit gc`)
+SHARED_OBJECT_STORE = True
+SHARED_STORE_DIR = os.path.join(HOME_DIR, "objects")
+SHARED_STORE_LINK = 'objectstore'  # Archivo de .shit con la ruta del almacén compartido
+GC_GRACE_PERIOD = 3600  # Segundos que se conserva un objeto sin usar (podría estar enlazándose)
+
+# Archivo de un worktree con la ruta del .shit del repositorio principal
+WORKTREE_LINK = 'commondir'
+
+# Tamaño de los bloques al descomprimir objetos hacia disco
+OBJECT_CHUNK_SIZE = 1024 * 1024
+
+# ioctl de Linux para copiar un archivo compartiendo bloques (reflink en btrfs, XFS...)
+FICLONE = 0x40049409
+
+# Resultados de la API de Python (ver Repository)
+# Estado de un archivo: 'modified', 'deleted', 'unreadable', 'added' (sin commit) o 'untracked'
+StatusEntry = namedtuple('StatusEntry', ['path', 'state'])
+VersionRecord = namedtuple('VersionRecord', ['path', 'branch', 'version', 'hash', 'timestamp', 'message'])
+# `versions` son las versiones creadas y `skipped` los pares (ruta, motivo) omitidos
+CommitSummary = namedtuple('CommitSummary', ['branch', 'message', 'versions', 'skipped'])
+# `backup` es la copia de seguridad del archivo sobrescrito (None si no existía)
+CheckoutResult = namedtuple('CheckoutResult', ['path', 'version', 'backup'])
+# Archivo restaurado desde el árbol de una rama (sin número de versión)
+RestoreResult = namedtuple('RestoreResult', ['path', 'hash', 'backup'])
+ReflogEntry = namedtuple('ReflogEntry', ['timestamp', 'hash', 'command', 'branch'])
+# Diferencia entre dos instantáneas: 'added', 'modified' o 'deleted' (sin hash si no existe)
+TreeChange = namedtuple('TreeChange', ['path', 'state', 'old_hash', 'new_hash'])
+CommitRecord = namedtuple('CommitRecord', ['hash', 'tree', 'parents', 'branch', 'message', 'timestamp'])
+
+# Instantáneas: un árbol es un directorio, con una entrada (nombre, hash, 'blob' o
+# 'tree') por archivo o subdirectorio, de modo que los directorios sin cambios
+# comparten hash entre commits; un commit apunta a su árbol raíz y a sus padres.
+# Se guardan en el almacén de objetos como JSON y se reconocen por el comienzo.
+# Los primeros árboles eran planos (pares ruta, hash) y se siguen leyendo
+TREE_PREFIX = b'{"type": "tree"'
+COMMIT_PREFIX = b'{"type": "commit"'
+
+
+class ShitError(Exception):
+    """Error de una operación de la API de Python; el mensaje es el que mostraría la CLI."""
+
+def parse_size(text):
+    """Convierte un tamaño como '500M' o '2G' a bytes."""
+    text = str(text).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] == 'B':
+        text = text[:-1]
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_timestamp(text):
+    """Normaliza una fecha ISO 8601 ('2024-05-01', '2024-05-01 10:30', ...) al
+    formato de las marcas de tiempo del índice (hora local, sin zona horaria)."""
+    moment = datetime.datetime.fromisoformat(str(text).strip())
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat()
+
+def _write_records(records, output_format):
+    """Escribe registros (namedtuples) en la salida estándar a medida que se generan.
+    
+    'ndjson' escribe un objeto JSON por línea y 'json' una única lista.
+    """
+    out = sys.stdout
+    if output_format == 'ndjson':
+        for record in records:
+            out.write(json.dumps(record._asdict(), ensure_ascii=False) + '\n')
+        return
+    
+    separator = '[\n'
+    for record in records:
+        out.write(separator + json.dumps(record._asdict(), ensure_ascii=False))
+        separator = ',\n'
+    out.write('[]\n' if separator == '[\n' else '\n]\n')
+
+def _read_lines_reversed(path, block_size=64 * 1024):
+    """Genera las líneas de un archivo de la última a la primera, leyendo por bloques desde el final."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode('utf-8', 'replace')
+        yield remainder.decode('utf-8', 'replace')
+
+def _version_record(str_path, version_info):
+    """Convierte una versión del índice en un VersionRecord."""
+    return VersionRecord(str_path, version_info.get('branch', 'master'), version_info['version'],
+                         version_info['hash'], version_info['timestamp'], version_info.get('message', ''))
+
+def _encode_tree(entries):
+    """Serializa un nivel de un árbol (entradas nombre, hash, tipo) ordenado por nombre."""
+    return json.dumps({'type': 'tree', 'entries': sorted(entries)}, ensure_ascii=False).encode('utf-8')
+
+def _encode_commit(tree, parents, branch, message, timestamp):
+    """Serializa un commit."""
+    return json.dumps({'type': 'commit', 'tree': tree, 'parents': parents, 'branch': branch,
+                       'message': message, 'timestamp': timestamp}, ensure_ascii=False).encode('utf-8')
+
+def _diff_trees(old_entries, new_entries):
+    """Genera los TreeChange para pasar de un árbol completo a otro.
+    
+    Los árboles son listas de pares (ruta, hash) ordenadas por ruta y se
+    recorren a la vez, como en una mezcla, sin construir diccionarios. Para
+    dos árboles del almacén es mejor SHIT._diff_tree_objects, que no entra en
+    los subdirectorios iguales.
+    """
+    i = j = 0
+    while i < len(old_entries) or j < len(new_entries):
+        if j == len(new_entries) or (i < len(old_entries) and old_entries[i][0] < new_entries[j][0]):
+            yield TreeChange(old_entries[i][0], 'deleted', old_entries[i][1], None)
+            i += 1
+        elif i == len(old_entries) or new_entries[j][0] < old_entries[i][0]:
+            yield TreeChange(new_entries[j][0], 'added', None, new_entries[j][1])
+            j += 1
+        else:
+            if old_entries[i][1] != new_entries[j][1]:
+                yield TreeChange(old_entries[i][0], 'modified', old_entries[i][1], new_entries[j][1])
+            i += 1
+            j += 1
+
+def _clone_file(source, destination):
+    """Copia un archivo con un reflink si el sistema de archivos lo admite; si no, con shutil.copy2."""
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except (ImportError, OSError):
+        shutil.copy2(source, destination)
+        return
+    shutil.copystat(source, destination)
+
+def _make_backup(file_path, suffix='.bak'):
+    """Conserva el contenido actual de un archivo en `<archivo><suffix>` sin copiar datos.
+    
+    La copia es un enlace duro, así que después el original no puede
+    modificarse en su sitio: hay que reemplazarlo con os.replace o borrarlo.
+    Si el sistema de archivos no admite enlaces se usa _clone_file. Devuelve
+    la ruta de la copia.
+    """
+    file_path = Path(file_path)
+    backup_path = file_path.with_suffix(file_path.suffix + suffix)
+    if backup_path.is_file() or backup_path.is_symlink():
+        backup_path.unlink()
+    try:
+        os.link(file_path, backup_path)
+    except OSError:
+        _clone_file(file_path, backup_path)
+    return backup_path
+
+def _common_dir(vcs_dir):
+    """Devuelve el directorio .shit con los datos compartidos (el propio `vcs_dir` salvo en un worktree)."""
+    try:
+        with open(os.path.join(str(vcs_dir), WORKTREE_LINK), 'r', encoding='utf-8') as f:
+            return Path(f.read().strip())
+    except FileNotFoundError:
+        return Path(vcs_dir)
+
+def _shared_store(common_dir):
+    """Devuelve el almacén de objetos compartido que usa el repositorio, o None."""
+    try:
+        with open(os.path.join(str(common_dir), SHARED_STORE_LINK), 'r', encoding='utf-8') as f:
+            return Path(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+class SparsePatterns:
+    """Patrones del checkout parcial (.shit/sparse-checkout).
+    
+    Cada línea es una ruta relativa a la raíz del repositorio (un archivo, o
+    un directorio con todo su contenido) o un patrón con comodines de
+    fnmatch; con '!' delante excluye en lugar de incluir, y gana el último
+    patrón que coincide. Las líneas vacías y las que empiezan por '#' se
+    ignoran. Sin patrones de inclusión se incluye todo.
+    """
+    
+    FILE_NAME = 'sparse-checkout'
+    
+    def __init__(self, lines=()):
+        self.patterns = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            pattern = (line[1:] if negated else line).replace('\\', '/').strip('/')
+            if pattern.startswith('./'):
+                pattern = pattern[2:]
+            if pattern:
+                self.patterns.append((negated, pattern))
+        self.active = any(not negated for negated, _ in self.patterns)
+    
+    @classmethod
+    def load(cls, vcs_dir):
+        """Lee los patrones del repositorio (sin archivo, el checkout es completo)."""
+        try:
+            with open(os.path.join(str(vcs_dir), cls.FILE_NAME), 'r', encoding='utf-8') as f:
+                return cls(f.read().splitlines())
+        except FileNotFoundError:
+            return cls()
+    
+    def lines(self):
+        return [('!' if negated else '') + pattern for negated, pattern in self.patterns]
+    
+    def includes(self, path):
+        """Indica si un archivo (ruta relativa a la raíz) forma parte del checkout."""
+        if not self.active:
+            return True
+        path = path.replace(os.path.sep, '/')
+        included = False
+        for negated, pattern in self.patterns:
+            if path == pattern or path.startswith(pattern + '/') or fnmatch.fnmatchcase(path, pattern):
+                included = not negated
+        return included
+    
+    def may_contain(self, directory):
+        """Indica si un directorio puede contener archivos incluidos; si no, no hace falta recorrerlo."""
+        if not self.active:
+            return True
+        directory = directory.replace(os.path.sep, '/').strip('/')
+        if directory in ('', '.'):
+            return True
+        for negated, pattern in self.patterns:
+            if negated:
+                continue
+            # Parte literal del patrón, hasta el primer comodín
+            literal = re.split(r'[*?\[]', pattern, 1)[0]
+            if literal == pattern:
+                if directory == pattern or directory.startswith(pattern + '/') or pattern.startswith(directory + '/'):
+                    return True
+            elif literal.startswith(directory + '/') or (directory + '/').startswith(literal):
+                return True
+        return False
+
+def _locked(method):
+    """Ejecuta un método de SHIT con los metadatos del repositorio bloqueados.
+    
+    El índice, las ramas y las cachés se comparten con los directorios de
+    trabajo adicionales: quien los lee para modificarlos lo hace con el
+    bloqueo (reentrante) de `.shit/lock`. Si otro proceso lo mantiene se
+    muestra el error (salvo con `quiet`) y se devuelve False.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            with self._repo_lock():
+                return method(self, *args, **kwargs)
+        except TimeoutError as e:
+            if not self.quiet:
+                print(f"Error: {str(e)}")
+            return False
+    return wrapper
+
+
 def hide_directory(path):
     """Oculta un directorio en Windows usando múltiples métodos."""
     if platform.system() == "Windows":
+        import subprocess
+        
         # Convertir path a string para asegurar compatibilidad
         path_str = str(path)
         
@@ -76,6 +384,22 @@ def hide_directory(path):
             print(f'attrib +h "{path_str}"')
             return False
 
+def load_drive_sync(quiet=False):
+    """Importa bajo demanda la clase DriveSync.
+    
+    Devuelve None (e indica cómo instalarlas, salvo con `quiet`) si faltan las
+    bibliotecas de Google.
+    """
+    try:
+        from drive_sync import DriveSync
+    except ImportError:
+        if quiet:
+            return None
+        print("Error: El soporte para Google Drive no está disponible.")
+        print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+        return None
+    return DriveSync
+
 class SHIT:
     """Clase principal para el control de versiones de archivos binarios."""
 
@@ -83,15 +407,31 @@ class SHIT:
         """Inicializa el sistema de control de versiones."""
         self.repo_path = Path(repo_path)
         self.vcs_dir = self.repo_path / '.shit'
-        self.objects_dir = self.vcs_dir / 'objects'
-        self.refs_dir = self.vcs_dir / 'refs'
+        # En un worktree, .shit solo guarda HEAD y el checkout parcial: los
+        # objetos, las ramas y el historial son los del repositorio principal
+        self.common_dir = _common_dir(self.vcs_dir)
+        self.common_path = self.common_dir.parent
+        self.objects_dir = self.common_dir / 'objects'
+        self.shared_store = _shared_store(self.common_dir)
+        self.refs_dir = self.common_dir / 'refs'
         self.branches_dir = self.refs_dir / 'branches'
-        self.config_file = self.vcs_dir / 'config.json'
-        self.index_file = self.vcs_dir / 'index.json'
+        self.worktrees_dir = self.common_dir / 'worktrees'
+        self.config_file = self.common_dir / 'config.json'
+        self.index_file = self.common_dir / 'index.json'
         self.head_file = self.vcs_dir / 'HEAD'
+        self.object_cache_file = self.common_dir / 'object_cache.json'
+        self.sync_state_file = self.common_dir / 'sync.json'
+        self.sync_queue_file = self.common_dir / 'sync_queue.jsonl'
+        self.sync_pid_file = self.common_dir / 'sync.pid'
+        self.sparse_file = self.vcs_dir / SparsePatterns.FILE_NAME
         self.index = {}
         self.config = {}
         self.current_branch = "master"
+        self._remote = None
+        # Sin mensajes por consola: lo activa la API de Python (Repository)
+        self.quiet = False
+        # Niveles de árbol ya leídos (los objetos no cambian nunca)
+        self._tree_nodes = {}
 
     def init(self):
         """Inicializa un nuevo repositorio."""
@@ -99,6 +439,12 @@ class SHIT:
             print(f"El repositorio ya existe en: {self.vcs_dir}")
             return False
 
+        self._create()
+        print(f"Repositorio inicializado en: {self.repo_path}")
+        return True
+
+    def _create(self):
+        """Crea la estructura de un repositorio nuevo."""
         # Crear estructura de directorios
         self.vcs_dir.mkdir(exist_ok=True)
         self.objects_dir.mkdir(exist_ok=True)
@@ -118,7 +464,7 @@ class SHIT:
         self._set_head("master")
         
         # Inicializar reflog
-        reflog_file = self.vcs_dir / 'reflog'
+        reflog_file = self.common_dir / 'reflog'
         with open(reflog_file, 'w') as f:
             f.write("")
         
@@ -127,10 +473,8 @@ class SHIT:
         
         # Ocultar el directorio en Windows
         hide_directory(self.vcs_dir)
-        
-        print(f"Repositorio inicializado en: {self.repo_path}")
-        return True
 
+    @_locked
     def add(self, file_path):
         """Añade un archivo al control de versiones o marca archivos modificados para commit."""
         file_path = Path(file_path)
@@ -170,9 +514,7 @@ class SHIT:
                 
                 # Calcular el hash actual
                 try:
-                    with open(file_path, 'rb') as f:
-                        contenido = f.read()
-                    hash_actual = hashlib.sha256(contenido).hexdigest()
+                    hash_actual = self._hash_file(file_path.resolve())
                     
                     if hash_actual != hash_original:
                         # El archivo ha sido modificado
@@ -191,15 +533,11 @@ class SHIT:
                 return True
         else:
             # Añadir archivo nuevo al índice
-            self.index[str_path] = {
-                'added_at': datetime.datetime.now().isoformat(),
-                'versions': []
-            }
-            
-            self._save_index()
+            self._track_paths([str_path])
             print(f"Archivo {str_path} añadido al control de versiones.")
             return True
 
+    @_locked
     def add_all(self):
         """Añade todos los archivos modificados y nuevos al control de versiones."""
         # Cargar el índice actual
@@ -208,9 +546,8 @@ class SHIT:
         # Obtener la rama actual
         current_branch = self._get_current_branch()
         
-        # Variables para tracking
-        added_files = []  # Archivos nuevos añadidos
-        updated_files = []  # Archivos modificados re-añadidos
+        # Archivos modificados re-añadidos
+        updated_files = []
         
         # 1. Procesar archivos ya en el índice (modificados)
         for file_path, info in list(self.index.items()):
@@ -235,9 +572,7 @@ class SHIT:
             
             # Calcular el hash actual
             try:
-                with open(abs_path, 'rb') as f:
-                    contenido = f.read()
-                hash_actual = hashlib.sha256(contenido).hexdigest()
+                hash_actual = self._hash_file(abs_path.resolve())
                 
                 # Si los hashes son diferentes, el archivo ha sido modificado
                 if hash_actual != hash_original:
@@ -249,18 +584,63 @@ class SHIT:
                 pass
         
         # 2. Encontrar y añadir archivos sin seguimiento
-        # Crear un conjunto con todas las rutas normalizadas en el índice
-        rutas_en_indice = set()
-        for str_path in self.index.keys():
-            # Normalizar la ruta para comparaciones
-            ruta_normalizada = str_path.replace('\\', '/')
-            rutas_en_indice.add(ruta_normalizada)
-        
-        # Primero, obtener todos los archivos en disco
+        rutas_en_indice = {str_path.replace('\\', '/') for str_path in self.index}
+        sin_seguimiento = [archivo for archivo in self._working_tree_files() if archivo not in rutas_en_indice]
+        added_files = self._track_paths(sin_seguimiento)
+        
+        if added_files or updated_files:
+            if added_files:
+                print("Archivos nuevos añadidos al control de versiones:")
+                for file in sorted(added_files):
+                    print(f"  {file}")
+            
+            if updated_files:
+                print("Archivos modificados marcados para commit:")
+                for file in sorted(updated_files):
+                    print(f"  {file}")
+        else:
+            print("No hay archivos nuevos ni modificados para añadir.")
+            
+        return True
+
+    def _track_paths(self, str_paths):
+        """Pone bajo control de versiones las rutas que aún no lo están.
+        
+        Guarda el índice una sola vez y devuelve las rutas añadidas.
+        """
+        added_at = datetime.datetime.now().isoformat()
+        added = []
+        for str_path in str_paths:
+            if str_path not in self.index:
+                self.index[str_path] = {'added_at': added_at, 'versions': []}
+                added.append(str_path)
+        
+        if added:
+            records = [{'op': 'add', 'path': str_path, 'added_at': added_at} for str_path in added]
+            self._save_index(records)
+            self._append_index_log(*records)
+        return added
+
+    def _working_tree_files(self):
+        """Devuelve las rutas (con /) de los archivos del directorio de trabajo.
+        
+        Se omiten el directorio .shit, los archivos y directorios ocultos y lo
+        que queda fuera del checkout parcial (sin recorrer esos directorios).
+        """
         archivos_en_disco = set()
+        sparse = self._sparse()
+        # Un worktree creado dentro del directorio de trabajo no forma parte de él
+        worktrees = {str(path) for path in self._worktree_paths()[1:]}
         
         # Método 1: Usar os.walk para encontrar todos los archivos en todas las carpetas
-        for root, _, files in os.walk(self.repo_path):
+        for root, dirs, files in os.walk(self.repo_path):
+            # No entrar en los worktrees ni en los directorios excluidos del checkout parcial
+            if worktrees:
+                dirs[:] = [d for d in dirs if os.path.realpath(os.path.join(root, d)) not in worktrees]
+            if sparse.active:
+                dirs[:] = [d for d in dirs
+                           if sparse.may_contain(os.path.relpath(os.path.join(root, d), self.repo_path))]
+            
             # Ignorar el directorio .shit y otros directorios ocultos
             if '.shit' in root or os.path.basename(root).startswith('.'):
                 continue
@@ -269,17 +649,10 @@ class SHIT:
                 # Ignorar archivos ocultos
                 if file.startswith('.'):
                     continue
-                    
-                file_path = os.path.join(root, file)
-                try:
-                    # Convertir a ruta relativa
-                    rel_path = os.path.relpath(file_path, self.repo_path)
-                    # Normalizar para comparación (siempre usar /)
-                    rel_path_norm = rel_path.replace(os.path.sep, '/')
-                    archivos_en_disco.add(rel_path_norm)
-                except Exception as e:
-                    print(f"Error al procesar archivo {file_path}: {str(e)}")
-                    continue
+                
+                # Convertir a ruta relativa y normalizar con / para comparar con el índice
+                rel_path = os.path.relpath(os.path.join(root, file), self.repo_path)
+                archivos_en_disco.add(rel_path.replace(os.path.sep, '/'))
         
         # Método 2: Verificar explícitamente los archivos en el directorio raíz
         for item in os.listdir(self.repo_path):
@@ -287,36 +660,11 @@ class SHIT:
             # Solo incluir archivos (no directorios) y que no estén ocultos
             if os.path.isfile(item_path) and not item.startswith('.'):
                 rel_path = os.path.relpath(item_path, self.repo_path)
-                rel_path_norm = rel_path.replace(os.path.sep, '/')
-                archivos_en_disco.add(rel_path_norm)
-        
-        # Encontrar archivos sin seguimiento (en disco pero no en el índice)
-        for archivo in archivos_en_disco:
-            if archivo not in rutas_en_indice:
-                # Añadir archivo nuevo al índice
-                self.index[archivo] = {
-                    'added_at': datetime.datetime.now().isoformat(),
-                    'versions': []
-                }
-                added_files.append(archivo)
+                archivos_en_disco.add(rel_path.replace(os.path.sep, '/'))
         
-        if added_files or updated_files:
-            self._save_index()
-            
-            if added_files:
-                print("Archivos nuevos añadidos al control de versiones:")
-                for file in sorted(added_files):
-                    print(f"  {file}")
-            
-            if updated_files:
-                print("Archivos modificados marcados para commit:")
-                for file in sorted(updated_files):
-                    print(f"  {file}")
-        else:
-            print("No hay archivos nuevos ni modificados para añadir.")
-            
-        return True
+        return {archivo for archivo in archivos_en_disco if sparse.includes(archivo)}
 
+    @_locked
     def commit(self, file_path=None, message="", branch=None):
         """Guarda una nueva versión del archivo o de todos los archivos en staging."""
         # Obtener la rama actual si no se especificó una
@@ -332,48 +680,19 @@ class SHIT:
                 print("Error: Debe proporcionar un mensaje para el commit con -m")
                 return False
             
-            # Contar cuántos archivos se procesaron
-            archivos_commiteados = 0
-            ultimo_hash = None  # Para actualizar la rama
-            
-            # Iterar sobre todos los archivos en el índice
-            for str_path, info in list(self.index.items()):
-                file_sys_path = str_path.replace('/', os.path.sep)
-                file_abs_path = self.repo_path / file_sys_path
-                
-                # Verificar si el archivo existe
-                if not file_abs_path.exists():
-                    print(f"Advertencia: El archivo {str_path} no existe, se omitirá.")
-                    continue
-                
-                # Verificar si el archivo tiene versiones para esta rama
-                versiones = info.get('versions', [])
-                branch_versions = [v for v in versiones if v.get('branch', 'master') == branch]
-                
-                # Calcular el hash actual
-                try:
-                    with open(file_abs_path, 'rb') as f:
-                        contenido = f.read()
-                    hash_actual = hashlib.sha256(contenido).hexdigest()
-                except Exception as e:
-                    print(f"Error al leer archivo {str_path}: {str(e)}")
-                    continue
-                
-                # Si no tiene versiones o el hash ha cambiado, hacer commit
-                if not branch_versions or branch_versions[-1]['hash'] != hash_actual:
-                    # Crear un commit para este archivo
-                    if self._commit_file(file_abs_path, str_path, message, branch, update_branch=False):
-                        # Guardar el hash para actualizar la rama al final
-                        ultimo_hash = hash_actual
-                        archivos_commiteados += 1
+            sparse = self._sparse()
+            try:
+                summary = self._commit_paths([path for path in self.index if sparse.includes(path)], message, branch)
+            except ShitError as e:
+                print(f"Error: {str(e)}")
+                return False
+            for str_path, motivo in summary.skipped:
+                print(f"Advertencia: Se omite {str_path}: {motivo}")
+            for record in summary.versions:
+                print(f"Nueva versión de {record.path} guardada (v{record.version}) en rama {branch}.")
             
-            if archivos_commiteados > 0 and ultimo_hash:
-                # Actualizar la rama para que apunte al último hash
-                self._update_branch_ref(branch, ultimo_hash)
-                # Añadir al reflog
-                self._add_to_reflog(f"commit: {message} ({archivos_commiteados} archivos)", branch)
-                
-                print(f"Commit creado: {message} ({archivos_commiteados} archivos)")
+            if summary.versions:
+                print(f"Commit creado: {message} ({len(summary.versions)} archivos)")
                 return True
             else:
                 print("No hay archivos para commit. Use 'shit add' para añadir archivos.")
@@ -399,56 +718,118 @@ class SHIT:
                 print(f"Error: El archivo {str_path} no está bajo control de versiones. Usa 'add' primero.")
                 return False
                 
-            # Hacer commit del archivo específico - actualizar la rama en este caso
-            return self._commit_file(file_path, str_path, message, branch, update_branch=True)
+            # Hacer commit del archivo específico
+            return self._commit_file(file_path, str_path, message, branch)
             
-    def _commit_file(self, file_path, str_path, message, branch, update_branch=True):
+    def _commit_file(self, file_path, str_path, message, branch):
         """Método interno para hacer commit de un archivo específico"""
-        # Leer el contenido del archivo
         try:
-            with open(file_path, 'rb') as f:
-                content = f.read()
-        except Exception as e:
-            print(f"Error al leer el archivo {str_path}: {str(e)}")
+            # Antes de tocar el índice: el commit necesita el commit actual de la rama
+            self._branch_head(branch)
+            record = self._store_version(file_path, str_path, message, branch)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        except OSError as e:
+            print(f"Error al guardar la versión de {str_path}: {str(e)}")
             return False
-            
-        # Calcular hash del contenido
-        content_hash = hashlib.sha256(content).hexdigest()
-        
-        # Verificar si esta versión ya existe
-        versions = self.index[str_path]['versions']
-        branch_versions = [v for v in versions if v.get('branch', 'master') == branch]
         
-        if branch_versions and branch_versions[-1]['hash'] == content_hash:
+        if record is None:
             print(f"No hay cambios en el archivo {str_path} desde la última versión en la rama {branch}.")
             return False
-            
-        # Comprimir el contenido
-        compressed = zlib.compress(content)
         
-        # Guardar el objeto - usando os.path para mayor compatibilidad con Windows
-        hash_prefix = content_hash[:2]
-        hash_suffix = content_hash[2:]
-        object_dir = os.path.join(self.objects_dir, hash_prefix)
-        object_file = os.path.join(object_dir, hash_suffix)
+        index_record = {'op': 'version', 'path': str_path, 'version': self.index[str_path]['versions'][-1]}
+        self._save_index([index_record])
+        self._touch_object(record.hash)
+        self._append_index_log(index_record)
+        
+        # Crear la instantánea, mover la rama y registrar el commit en el reflog
+        self._update_branch_ref(branch, self._snapshot(branch, message, [record]))
+        self._add_to_reflog(f"commit {str_path}: {message}", branch)
+        
+        print(f"Nueva versión de {str_path} guardada (v{record.version}) en rama {branch}.")
+        return True
+
+    def _commit_paths(self, str_paths, message, branch, parents=()):
+        """Guarda en `branch` una versión de cada ruta modificada, sin mostrar nada.
+        
+        El índice se guarda una sola vez y la rama y el reflog se actualizan con
+        un único commit para todo el lote; `parents` son padres adicionales al
+        commit actual de la rama (el de la rama origen en una fusión).
+        Devuelve un CommitSummary. Lanza ShitError, antes de modificar nada, si
+        el commit actual de la rama no está disponible.
+        """
+        versions = []
+        skipped = []
+        self._branch_head(branch)
         
-        # Crear el directorio del objeto de forma manual con os.makedirs
-        if not os.path.exists(object_dir):
+        for str_path in str_paths:
+            file_abs_path = self.repo_path / str_path.replace('/', os.path.sep)
+            if not file_abs_path.exists():
+                skipped.append((str_path, "el archivo no existe"))
+                continue
+            
+            branch_versions = [v for v in self.index[str_path].get('versions', []) if v.get('branch', 'master') == branch]
             try:
-                os.makedirs(object_dir, exist_ok=True)
-            except Exception as e:
-                print(f"Error al crear directorio {object_dir}: {str(e)}")
-                return False
-                
-        # Escribir el objeto
-        try:
-            with open(object_file, 'wb') as f:
-                f.write(compressed)
-        except Exception as e:
-            print(f"Error al escribir objeto {object_file}: {str(e)}")
-            return False
+                # Comparar primero el hash (en caché dentro de `shit serve`) para no releer archivos sin cambios
+                if branch_versions and branch_versions[-1]['hash'] == self._hash_file(file_abs_path.resolve()):
+                    continue
+                record = self._store_version(file_abs_path, str_path, message, branch)
+            except OSError as e:
+                skipped.append((str_path, str(e)))
+                continue
             
-        # Actualizar el índice
+            if record is not None:
+                versions.append(record)
+        
+        if versions:
+            self._finish_commit(versions, message, branch, parents)
+        
+        return CommitSummary(branch, message, versions, skipped)
+
+    def _finish_commit(self, versions, message, branch, parents=()):
+        """Guarda el índice con las versiones nuevas, crea su commit y mueve la rama."""
+        records = [{'op': 'version', 'path': record.path, 'version': self.index[record.path]['versions'][-1]}
+                   for record in versions]
+        self._save_index(records)
+        self._touch_objects(dict.fromkeys(record.hash for record in versions))
+        self._append_index_log(*records)
+        self._update_branch_ref(branch, self._snapshot(branch, message, versions, parents))
+        self._add_to_reflog(f"commit: {message} ({len(versions)} archivos)", branch)
+
+    def _store_version(self, file_path, str_path, message, branch):
+        """Guarda el contenido actual de un archivo como nueva versión en `branch`.
+        
+        Escribe el objeto y añade la versión al índice en memoria, sin guardarlo
+        (el acceso al objeto lo registra quien guarda el índice).
+        Devuelve el VersionRecord creado, o None si el contenido no ha cambiado
+        desde la última versión de la rama. Los errores de E/S se propagan.
+        """
+        content_hash = self._hash_file(file_path)
+        
+        versions = self.index[str_path]['versions']
+        branch_versions = [v for v in versions if v.get('branch', 'master') == branch]
+        if branch_versions and branch_versions[-1]['hash'] == content_hash:
+            return None
+        
+        # Un contenido ya conocido no se vuelve a leer, comprimir ni escribir
+        if not self._adopt_object(content_hash):
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            # El hash se recalcula sobre lo leído por si el archivo ha cambiado entretanto
+            content_hash = self._write_object(content)
+        return self._add_version(str_path, content_hash, message, branch)
+
+    def _add_version(self, str_path, content_hash, message, branch):
+        """Añade al índice en memoria una versión de un archivo con un objeto ya guardado.
+        
+        Devuelve el VersionRecord creado.
+        """
+        if str_path not in self.index:
+            self.index[str_path] = {'added_at': datetime.datetime.now().isoformat(), 'versions': []}
+        versions = self.index[str_path]['versions']
+        branch_versions = [v for v in versions if v.get('branch', 'master') == branch]
+        
         version_info = {
             'hash': content_hash,
             'timestamp': datetime.datetime.now().isoformat(),
@@ -456,73 +837,171 @@ class SHIT:
             'version': len(branch_versions) + 1,
             'branch': branch
         }
-        
-        self.index[str_path]['versions'].append(version_info)
-        self._save_index()
-        
-        # Actualizar la referencia de la rama si se solicita
-        if update_branch:
-            self._update_branch_ref(branch, content_hash)
-            # Registrar el commit en el reflog
-            self._add_to_reflog(f"commit {str_path}: {message}", branch)
-        
-        print(f"Nueva versión de {str_path} guardada (v{version_info['version']}) en rama {branch}.")
-        return True
+        versions.append(version_info)
+        return _version_record(str_path, version_info)
 
-    def log(self, file_path=None, branch=None):
-        """Muestra el historial de versiones de un archivo o de todos los archivos si no se especifica."""
-        self._load_index()
+    def log(self, file_path=None, branch=None, limit=None, since=None, until=None, output_format='text',
+            pattern=None, offset=0):
+        """Muestra el historial de versiones de un archivo o de todos los archivos si no se especifica.
         
-        if file_path is None:
-            # Mostrar historial de todos los archivos
-            if not self.index:
-                print("No hay archivos bajo control de versiones.")
-                return True
-            for str_path in self.index:
-                print(f"\n{'='*70}\nHistorial de: {str_path}")
-                self.log(str_path, branch)
-            return True
-        
-        file_path = Path(file_path)
+        Las versiones se obtienen del historial indexado (history.py), por
+        fecha: `since` y `until` (fechas ISO 8601, inclusivas), `pattern`
+        (expresión regular sobre el mensaje), `limit` y `offset` se resuelven
+        con sus índices sin recorrer todo el historial. Con `output_format`
+        'json' o 'ndjson' las versiones se escriben a medida que se leen.
+        """
         try:
-            rel_path = file_path.resolve().relative_to(self.repo_path.resolve())
-            str_path = str(rel_path)
-        except Exception:
-            str_path = str(file_path)
-        
-        # Verificar que el archivo está en el índice
-        if str_path not in self.index:
-            print(f"Error: El archivo {str_path} no está bajo control de versiones.")
+            since = parse_timestamp(since) if since is not None else None
+            until = parse_timestamp(until) if until is not None else None
+        except ValueError as e:
+            print(f"Error: Fecha no válida: {str(e)}")
             return False
         
+        if pattern is not None:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                print(f"Error: Expresión regular no válida: {str(e)}")
+                return False
+        
+        str_path = None
+        if file_path is not None:
+            file_path = Path(file_path)
+            try:
+                rel_path = file_path.resolve().relative_to(self.repo_path.resolve())
+                str_path = str(rel_path)
+            except Exception:
+                str_path = str(file_path)
+            
+            # Verificar que el archivo está en el índice
+            if not self._history_tracks(str_path):
+                print(f"Error: El archivo {str_path} no está bajo control de versiones.")
+                return False
+        
         # Obtener la rama actual si no se especificó una
         if branch is None:
             branch = self._get_current_branch()
         
-        # Filtrar versiones por rama
-        all_versions = self.index[str_path]['versions']
-        versions = [v for v in all_versions if v.get('branch', 'master') == branch]
+        records = self._query_history(branch, str_path, since, until, pattern, limit, offset)
+        if output_format != 'text':
+            _write_records(records, output_format)
+            return True
+        
+        # Agrupar por archivo, en el orden en que aparece cada uno
+        por_archivo = {}
+        for record in records:
+            por_archivo.setdefault(record.path, []).append(record)
         
-        if not versions:
+        if str_path is not None and not por_archivo:
             print(f"El archivo {str_path} no tiene versiones guardadas en la rama {branch}.")
             return True
+        if not por_archivo:
+            print(f"No hay versiones en la rama {branch} que cumplan los criterios.")
+            return True
         
-        print(f"\nHistorial de versiones para {str_path} (rama {branch}):")
-        print("-" * 60)
-        for version in versions:
-            timestamp = datetime.datetime.fromisoformat(version['timestamp'])
-            formatted_time = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            print(f"Versión: {version['version']}")
-            print(f"Fecha: {formatted_time}")
-            print(f"Hash: {version['hash']}")
-            print(f"Mensaje: {version['message']}")
+        for path, versions in por_archivo.items():
+            if str_path is None:
+                print(f"\n{'='*70}\nHistorial de: {path}")
+            
+            print(f"\nHistorial de versiones para {path} (rama {branch}):")
             print("-" * 60)
+            for version in versions:
+                timestamp = datetime.datetime.fromisoformat(version.timestamp)
+                formatted_time = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+                print(f"Versión: {version.version}")
+                print(f"Fecha: {formatted_time}")
+                print(f"Hash: {version.hash}")
+                print(f"Mensaje: {version.message}")
+                print("-" * 60)
         return True
 
+    def _open_history(self):
+        """Abre el historial indexado de .shit/history.db, al día con el índice.
+        
+        Devuelve el HistoryIndex y la conexión, que debe cerrarse.
+        """
+        from history import HistoryIndex
+        
+        def load_index():
+            self._load_index()
+            return self.index
+        
+        history = HistoryIndex(self.common_dir)
+        return history, history.open(load_index)
+
+    def _history_tracks(self, str_path):
+        """Indica si un archivo está bajo control de versiones, sin cargar el índice."""
+        history, conn = self._open_history()
+        try:
+            return history.tracks(conn, str_path)
+        finally:
+            conn.close()
+
+    def _resolve_hash(self, prefix, objects=False):
+        """Devuelve el hash completo de la versión que empieza por `prefix`.
+        
+        Usa el índice de hashes del historial indexado (una búsqueda por rango,
+        sin recorrer las versiones). Con `objects` se buscan también los
+        objetos locales (commits y árboles), solo en el subdirectorio del
+        almacén que corresponde al prefijo. Lanza ShitError si el prefijo no es
+        válido, no corresponde a nada o es ambiguo.
+        """
+        prefix = str(prefix).strip().lower()
+        if len(prefix) < MIN_HASH_PREFIX or any(c not in '0123456789abcdef' for c in prefix):
+            raise ShitError(f"'{prefix}' no es un hash válido (al menos {MIN_HASH_PREFIX} caracteres hexadecimales).")
+        
+        history, conn = self._open_history()
+        try:
+            matches = history.match_hashes(conn, prefix)
+        finally:
+            conn.close()
+        
+        if objects:
+            object_dir = self.objects_dir / prefix[:2]
+            if object_dir.is_dir():
+                matches = sorted(set(matches).union(prefix[:2] + entry.name for entry in os.scandir(object_dir)
+                                                    if entry.name.startswith(prefix[2:]) and '.tmp' not in entry.name))
+        
+        if not matches:
+            raise ShitError(f"No se encontró ningún commit con hash '{prefix}'.")
+        if len(matches) > 1:
+            raise ShitError(f"El hash '{prefix}' es ambiguo ({', '.join(match[:12] for match in matches)}...). Use más caracteres.")
+        return matches[0]
+
+    def _versions_with_hash(self, content_hash):
+        """Devuelve, como VersionRecord, las versiones cuyo contenido tiene el hash indicado."""
+        history, conn = self._open_history()
+        try:
+            return [VersionRecord(*row) for row in history.versions_with_hash(conn, content_hash)]
+        finally:
+            conn.close()
+
+    def _query_history(self, branch, str_path=None, since=None, until=None, pattern=None, limit=None, offset=0):
+        """Genera, como VersionRecord y por fecha, las versiones de una rama que cumplen los filtros.
+        
+        Consulta el historial indexado de .shit/history.db, que se pone al día
+        con los cambios del índice antes de la consulta. `since` y `until` deben
+        estar normalizadas con parse_timestamp.
+        """
+        history, conn = self._open_history()
+        try:
+            for row in history.query(conn, branch, str_path, since, until, pattern, limit, offset):
+                yield VersionRecord(*row)
+        finally:
+            conn.close()
+
+    def _version_records(self, str_path, branch):
+        """Devuelve las versiones de un archivo en una rama como VersionRecord."""
+        return [_version_record(str_path, v) for v in self.index[str_path]['versions']
+                if v.get('branch', 'master') == branch]
+
     def checkout(self, file_path, version, branch=None):
-        """Recupera una versión específica de un archivo."""
+        """Recupera una versión específica de un archivo.
+        
+        `version` es el número de versión en la rama o un hash (completo o
+        abreviado) de una versión del archivo.
+        """
         file_path = Path(file_path)
-        version = int(version)
         
         try:
             # Intentar calcular ruta relativa al repositorio
@@ -535,59 +1014,501 @@ class SHIT:
         # Cargar el índice
         self._load_index()
         
-        # Verificar que el archivo está en el índice
-        if str_path not in self.index:
-            print(f"Error: El archivo {str_path} no está bajo control de versiones.")
-            return False
-            
         # Obtener la rama actual si no se especificó una
         if branch is None:
             branch = self._get_current_branch()
-            
-        # Filtrar versiones por rama
-        all_versions = self.index[str_path]['versions']
-        versions = [v for v in all_versions if v.get('branch', 'master') == branch]
         
-        if not versions:
-            print(f"El archivo {str_path} no tiene versiones guardadas en la rama {branch}.")
-            return False
-            
-        if version < 1 or version > len(versions):
-            print(f"Error: La versión {version} no existe en la rama {branch}. El rango válido es 1-{len(versions)}.")
+        try:
+            record = self._resolve_version_spec(str_path, version, branch)
+            backup_path = self._write_version(record, file_path)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
             return False
-            
-        # Obtener la versión solicitada
-        version_info = versions[version - 1]
-        content_hash = version_info['hash']
         
-        # Cargar el objeto
-        object_path = self.objects_dir / content_hash[:2] / content_hash[2:]
-        if not object_path.exists():
-            print(f"Error: No se encuentra el objeto {content_hash}.")
-            return False
-            
-        # Crear una copia de seguridad del archivo actual (si existe)
-        if file_path.exists():
-            backup_path = file_path.with_suffix(file_path.suffix + '.bak')
-            shutil.copy2(file_path, backup_path)
+        if backup_path is not None:
             print(f"Copia de seguridad creada: {backup_path}")
-            
-        # Leer, descomprimir y escribir el contenido
-        with open(object_path, 'rb') as f:
-            compressed = f.read()
-            
-        content = zlib.decompress(compressed)
+        print(f"Archivo {str_path} restaurado a la versión {record.version} de la rama {record.branch}.")
+        return True
+
+    def _resolve_version_spec(self, str_path, spec, branch):
+        """Como _resolve_version, pero `spec` puede ser también un hash completo o abreviado.
         
-        # Asegurar que los directorios existan
+        Un valor formado solo por dígitos es un número de versión, salvo que esa
+        versión no exista y el valor sea lo bastante largo para ser un hash
+        abreviado. Si el hash aparece en varias ramas se prefiere la versión de
+        `branch`.
+        """
+        if isinstance(spec, int):
+            return self._resolve_version(str_path, spec, branch)
+        
+        if str_path not in self.index:
+            raise ShitError(f"El archivo {str_path} no está bajo control de versiones.")
+        
+        spec = str(spec).strip()
+        if spec.isdigit():
+            count = len(self._version_records(str_path, branch))
+            if 1 <= int(spec) <= count or len(spec) < MIN_HASH_PREFIX:
+                return self._resolve_version(str_path, int(spec), branch)
+        
+        content_hash = self._resolve_hash(spec)
+        records = [record for record in self._versions_with_hash(content_hash) if record.path == str_path]
+        if not records:
+            raise ShitError(f"El hash {content_hash[:12]} no corresponde a ninguna versión de {str_path}.")
+        return next((record for record in records if record.branch == branch), records[-1])
+
+    def _resolve_version(self, str_path, version, branch):
+        """Devuelve el VersionRecord de la versión `version` de un archivo en `branch`.
+        
+        Lanza ShitError si el archivo o la versión no existen.
+        """
+        if str_path not in self.index:
+            raise ShitError(f"El archivo {str_path} no está bajo control de versiones.")
+        
+        versions = self._version_records(str_path, branch)
+        if not versions:
+            raise ShitError(f"El archivo {str_path} no tiene versiones guardadas en la rama {branch}.")
+        if version < 1 or version > len(versions):
+            raise ShitError(f"La versión {version} no existe en la rama {branch}. El rango válido es 1-{len(versions)}.")
+        return versions[version - 1]
+
+    def _write_version(self, record, file_path, backup=True):
+        """Escribe en `file_path` el contenido de una versión.
+        
+        Con `backup`, el archivo existente se copia antes a `<archivo>.bak`.
+        Devuelve la ruta de la copia de seguridad (o None) y lanza ShitError si
+        el objeto no está disponible.
+        """
+        # Descargar el objeto del remoto si no está en local
+        if not self._object_path(record.hash).exists():
+            self._fetch_objects([record.hash])
+            if not self._object_path(record.hash).exists():
+                raise ShitError(f"No se encuentra el objeto {record.hash}.")
+        self._touch_object(record.hash)
+        return self._write_content(self._iter_object(record.hash), file_path, backup)
+
+    def _write_content(self, content, file_path, backup=True, atomic=False, backup_suffix='.bak'):
+        """Escribe `content` (bytes o bloques de bytes) en `file_path`.
+        
+        Con `atomic` se escribe en un archivo temporal que luego reemplaza al
+        original, de modo que nunca queda a medio escribir. Con `backup` el
+        archivo existente se conserva en `<archivo><backup_suffix>` como enlace
+        duro (ver _make_backup), sin copiar sus datos; por eso en ese caso
+        también se escribe siempre de forma atómica. Devuelve la ruta de la
+        copia de seguridad o None.
+        """
+        file_path = Path(file_path)
+        chunks = (content,) if isinstance(content, bytes) else content
+        backup = backup and file_path.exists()
+        
+        # Asegurar que los directorios existan
         file_path.parent.mkdir(parents=True, exist_ok=True)
         
         # Escribir el contenido
-        with open(file_path, 'wb') as f:
-            f.write(content)
-            
-        print(f"Archivo {str_path} restaurado a la versión {version} de la rama {branch}.")
+        if not atomic and not backup:
+            with open(file_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return None
+        
+        temp_path = file_path.with_name(f".{file_path.name}.shit-tmp")
+        backup_path = None
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            if file_path.exists():
+                shutil.copymode(file_path, temp_path)
+            if backup:
+                backup_path = _make_backup(file_path, backup_suffix)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+        return backup_path
+
+    def _write_objects(self, targets, backup=True, skip_unchanged=False, atomic=False):
+        """Escribe en paralelo el contenido de varios objetos; `targets` son pares (hash, ruta).
+        
+        Los objetos que falten se descargan de una vez antes de escribir nada.
+        Los archivos se reparten entre los hilos en el orden de los objetos en
+        el almacén (por hash), para que las lecturas sean lo más secuenciales
+        posible; la descompresión y la escritura se hacen en los hilos, por
+        bloques, sin cargar en memoria los archivos grandes.
+        Con `skip_unchanged` no se tocan los archivos cuyo contenido ya es el
+        del objeto. Devuelve, por cada par y en el orden de `targets`, la copia
+        de seguridad (o None), o False si el archivo no se ha tocado. Lanza
+        ShitError si falta algún objeto.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        targets = list(targets)
+        hashes = [content_hash for content_hash, _ in targets]
+        self._fetch_objects(hashes)
+        missing = [h for h in dict.fromkeys(hashes) if not self._object_path(h).exists()]
+        if missing:
+            raise ShitError(f"No se encuentran los objetos: {', '.join(missing)}")
+        
+        def restore(position):
+            content_hash, file_path = targets[position]
+            if skip_unchanged and os.path.isfile(file_path) and self._hash_file(file_path) == content_hash:
+                return False
+            return self._write_content(self._iter_object(content_hash), file_path, backup, atomic)
+        
+        order = sorted(range(len(targets)), key=lambda position: targets[position][0])
+        results = [None] * len(targets)
+        with ThreadPoolExecutor(max_workers=CHECKOUT_WORKERS) as pool:
+            for position, result in zip(order, pool.map(restore, order)):
+                results[position] = result
+        
+        self._touch_objects(dict.fromkeys(hashes))
+        return results
+
+    def _write_versions(self, targets, backup=True, skip_unchanged=False):
+        """Escribe en paralelo varias versiones; `targets` son pares (VersionRecord, ruta).
+        
+        Devuelve un CheckoutResult por archivo escrito (ver _write_objects).
+        """
+        targets = list(targets)
+        results = self._write_objects(((record.hash, file_path) for record, file_path in targets),
+                                      backup, skip_unchanged)
+        return [CheckoutResult(record.path, record, result)
+                for (record, _), result in zip(targets, results) if result is not False]
+
+    def _versions_at(self, branch, at, str_paths=None):
+        """Devuelve, como VersionRecord, la versión de cada archivo vigente en la fecha `at`.
+        
+        `at` debe estar normalizada con parse_timestamp. Una ruta de `str_paths`
+        que no es un archivo bajo control de versiones se trata como directorio
+        e incluye los archivos que contiene. Sin `str_paths` (o con la raíz del
+        repositorio, '.'), todos los archivos. Se omiten los que quedan fuera
+        del checkout parcial. Lanza ShitError si una ruta no corresponde a
+        ningún archivo.
+        """
+        if str_paths is not None and '.' in str_paths:
+            str_paths = None
+        
+        history, conn = self._open_history()
+        try:
+            if str_paths is not None:
+                expanded = []
+                for str_path in str_paths:
+                    if history.tracks(conn, str_path):
+                        expanded.append(str_path)
+                        continue
+                    contained = history.paths_under(conn, str_path.rstrip(os.sep) + os.sep)
+                    if not contained:
+                        raise ShitError(f"{str_path} no está bajo control de versiones.")
+                    expanded.extend(contained)
+                str_paths = expanded
+            sparse = self._sparse()
+            return [VersionRecord(*row) for row in history.versions_at(conn, branch, at, str_paths)
+                    if sparse.includes(row[0])]
+        finally:
+            conn.close()
+
+    def checkout_at(self, paths, at, branch=None, backup=True):
+        """Restaura archivos al estado que tenían en una fecha.
+        
+        `paths` son archivos o directorios (None para todo el repositorio). De
+        cada archivo se toma la última versión de la rama con fecha igual o
+        anterior a `at` (ISO 8601); los archivos sin versiones hasta esa fecha
+        no se tocan, y tampoco los que ya tienen ese contenido.
+        """
+        try:
+            at = parse_timestamp(at)
+        except ValueError as e:
+            print(f"Error: Fecha no válida: {str(e)}")
+            return False
+        
+        if branch is None:
+            branch = self._get_current_branch()
+        
+        str_paths = None
+        if paths is not None:
+            str_paths = []
+            for path in paths:
+                try:
+                    str_paths.append(str(Path(path).resolve().relative_to(self.repo_path.resolve())))
+                except ValueError:
+                    print(f"Error: {path} está fuera del repositorio.")
+                    return False
+        
+        try:
+            records = self._versions_at(branch, at, str_paths)
+            results = self._write_versions(((record, self.repo_path / record.path) for record in records),
+                                           backup, skip_unchanged=True)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        for result in results:
+            print(f"Restaurado: {result.path} (versión {result.version.version})")
+        print(f"{len(results)} archivos restaurados al estado de {at} en la rama {branch} "
+              f"({len(records) - len(results)} ya estaban en esa versión).")
+        return True
+
+    def checkout_tree(self, paths, branch=None, backup=True):
+        """Restaura archivos o directorios (None para todo) al estado actual de una rama.
+        
+        Los hashes se toman del árbol del commit de la rama y se escriben en
+        paralelo; los archivos que ya tienen ese contenido no se tocan.
+        """
+        if branch is None:
+            branch = self._get_current_branch()
+        if not (self.branches_dir / branch).exists():
+            print(f"Error: La rama '{branch}' no existe.")
+            return False
+        
+        str_paths = None
+        if paths is not None:
+            str_paths = []
+            for path in paths:
+                try:
+                    str_paths.append(str(Path(path).resolve().relative_to(self.repo_path.resolve())))
+                except ValueError:
+                    print(f"Error: {path} está fuera del repositorio.")
+                    return False
+        
+        try:
+            results = self._restore_tree(branch, str_paths, backup)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        for result in results:
+            if result.backup is not None:
+                print(f"Copia de seguridad creada: {result.backup}")
+            print(f"Restaurado: {result.path} ({result.hash[:12]})")
+        print(f"{len(results)} archivos restaurados desde la rama {branch}.")
+        return True
+
+    def _restore_tree(self, branch, str_paths=None, backup=True):
+        """Escribe los archivos del árbol de `branch` (o los de `str_paths`) que difieran.
+        
+        Una ruta que no es un archivo del árbol se trata como directorio; '.'
+        equivale a todo el árbol. Los archivos fuera del checkout parcial no se
+        escriben. Devuelve una lista de RestoreResult y lanza
+        ShitError si alguna ruta no corresponde a ningún archivo de la rama.
+        """
+        if str_paths is not None and '.' in str_paths:
+            str_paths = None
+        commit = self._branch_head(branch)
+        if commit is not None and str_paths is not None:
+            # Solo se leen los niveles del árbol de cada ruta y los subárboles de los directorios
+            selected = {}
+            for str_path in str_paths:
+                tree_path = str_path.replace(os.sep, '/').strip('/')
+                entry = self._tree_entry(commit.tree, tree_path)
+                if entry is None:
+                    raise ShitError(f"{str_path} no está en la rama {branch}.")
+                if entry[1] == 'blob':
+                    selected[tree_path] = entry[0]
+                else:
+                    selected.update(self._iter_tree(entry[0], tree_path + '/'))
+            entries = sorted(selected.items())
+        elif commit is not None:
+            entries = self._load_tree(commit.tree)
+        else:
+            _, entries = self._branch_tree(branch)
+        if commit is None and str_paths is not None:
+            selected = {}
+            for str_path in str_paths:
+                # El árbol está ordenado por ruta: el archivo o el contenido del directorio es un tramo contiguo
+                position = bisect.bisect_left(entries, (str_path,))
+                if position < len(entries) and entries[position][0] == str_path:
+                    selected[str_path] = entries[position][1]
+                    continue
+                directory = str_path.rstrip(os.sep) + os.sep
+                position = bisect.bisect_left(entries, (directory,))
+                start = position
+                while position < len(entries) and entries[position][0].startswith(directory):
+                    selected[entries[position][0]] = entries[position][1]
+                    position += 1
+                if position == start:
+                    raise ShitError(f"{str_path} no está en la rama {branch}.")
+            entries = sorted(selected.items())
+        sparse = self._sparse()
+        if sparse.active:
+            entries = [entry for entry in entries if sparse.includes(entry[0])]
+        
+        targets = [(content_hash, self.repo_path / str_path.replace('/', os.path.sep))
+                   for str_path, content_hash in entries]
+        results = self._write_objects(targets, backup, skip_unchanged=True)
+        return [RestoreResult(str_path, content_hash, result)
+                for (str_path, content_hash), result in zip(entries, results) if result is not False]
+
+    def _sparse(self):
+        """Devuelve los SparsePatterns del repositorio."""
+        return SparsePatterns.load(self.vcs_dir)
+
+    def sparse_set(self, patterns):
+        """Limita el directorio de trabajo a los archivos que coinciden con `patterns`.
+        
+        Escribe los archivos de la rama actual que pasan a estar incluidos y
+        borra los que quedan fuera, salvo los que tienen cambios sin guardar.
+        """
+        sparse = SparsePatterns(patterns)
+        if not sparse.active:
+            print("Error: Debe indicar al menos un patrón de inclusión.")
+            return False
+        
+        previous = self._sparse()
+        with open(self.sparse_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(sparse.lines()) + '\n')
+        return self._apply_sparse(previous, sparse)
+
+    def sparse_list(self):
+        """Muestra los patrones del checkout parcial."""
+        sparse = self._sparse()
+        if not sparse.patterns:
+            print("El checkout parcial no está activado: se materializan todos los archivos.")
+            return True
+        for line in sparse.lines():
+            print(line)
+        return True
+
+    def sparse_disable(self):
+        """Desactiva el checkout parcial y materializa todos los archivos de la rama actual."""
+        previous = self._sparse()
+        if not previous.patterns:
+            print("El checkout parcial no está activado.")
+            return True
+        self.sparse_file.unlink()
+        return self._apply_sparse(previous, SparsePatterns())
+
+    @_locked
+    def worktree_add(self, path, branch):
+        """Crea en `path` otro directorio de trabajo del repositorio con la rama `branch`.
+        
+        El worktree solo tiene su propio HEAD (y su checkout parcial): los
+        objetos, las ramas y el historial se comparten con el repositorio
+        principal, así que solo se escriben los archivos de la rama.
+        """
+        try:
+            worktree = self._create_worktree(path, branch)
+            results = worktree._restore_tree(branch, backup=False)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        print(f"Worktree creado en {worktree.repo_path} con la rama '{branch}' ({len(results)} archivos).")
+        return True
+
+    def _create_worktree(self, path, branch):
+        """Crea el .shit de un worktree y lo registra; devuelve su SHIT sin escribir archivos."""
+        if not (self.branches_dir / branch).exists():
+            raise ShitError(f"La rama '{branch}' no existe.")
+        checked_out = self._worktree_heads()
+        checked_out[self.repo_path.resolve()] = self._get_current_branch()
+        if branch in checked_out.values():
+            owner = next(p for p, b in checked_out.items() if b == branch)
+            raise ShitError(f"La rama '{branch}' ya está en uso en {owner}.")
+        
+        path = Path(path).resolve()
+        if path.exists() and (not path.is_dir() or any(path.iterdir())):
+            raise ShitError(f"{path} ya existe y no está vacío.")
+        
+        vcs_dir = path / '.shit'
+        vcs_dir.mkdir(parents=True)
+        with open(vcs_dir / WORKTREE_LINK, 'w', encoding='utf-8') as f:
+            f.write(str(self.common_dir.resolve()))
+        hide_directory(str(vcs_dir))
+        
+        # Registrar el worktree en el repositorio principal con un nombre libre
+        self.worktrees_dir.mkdir(exist_ok=True)
+        name, suffix = path.name, 1
+        while (self.worktrees_dir / name).exists():
+            suffix += 1
+            name = f"{path.name}-{suffix}"
+        with open(self.worktrees_dir / name, 'w', encoding='utf-8') as f:
+            f.write(str(path))
+        
+        worktree = SHIT(path)
+        worktree._set_head(branch)
+        worktree._add_to_reflog(f"worktree add {path}", branch)
+        return worktree
+
+    def _worktree_heads(self):
+        """Devuelve la rama actual de cada directorio de trabajo del repositorio, por ruta.
+        
+        Incluye el repositorio principal y excluye este mismo directorio. Los
+        worktrees registrados que ya no existen se ignoran.
+        """
+        heads = {}
+        own = self.repo_path.resolve()
+        for path in self._worktree_paths():
+            if path == own or not (path / '.shit').is_dir():
+                continue
+            heads[path] = SHIT(path)._get_current_branch()
+        return heads
+
+    def _worktree_paths(self):
+        """Devuelve las rutas absolutas del repositorio principal y de sus worktrees registrados."""
+        paths = [self.common_path.resolve()]
+        if self.worktrees_dir.exists():
+            for entry in sorted(self.worktrees_dir.iterdir()):
+                with open(entry, 'r', encoding='utf-8') as f:
+                    paths.append(Path(f.read().strip()))
+        return paths
+
+    def worktree_list(self):
+        """Muestra los directorios de trabajo del repositorio y su rama."""
+        heads = self._worktree_heads()
+        heads[self.repo_path.resolve()] = self._get_current_branch()
+        for path in sorted(heads, key=lambda p: (p != self.common_path.resolve(), str(p))):
+            marca = '*' if path == self.repo_path.resolve() else ' '
+            print(f"{marca} {path}  [{heads[path]}]")
+        return True
+
+    def _apply_sparse(self, previous, sparse):
+        """Ajusta el directorio de trabajo al pasar de unos patrones a otros."""
+        branch = self._get_current_branch()
+        try:
+            _, entries = self._branch_tree(branch)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        to_write, to_remove = [], []
+        for str_path, content_hash in entries:
+            was_included = previous.includes(str_path)
+            is_included = sparse.includes(str_path)
+            if is_included and not was_included:
+                to_write.append((str_path, content_hash))
+            elif was_included and not is_included:
+                to_remove.append((str_path, content_hash))
+        
+        try:
+            results = self._write_objects([(content_hash, self.repo_path / str_path.replace('/', os.path.sep))
+                                           for str_path, content_hash in to_write],
+                                          backup=True, skip_unchanged=True)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        # Solo se borran los archivos sin cambios respecto a la rama
+        removed = 0
+        for str_path, content_hash in to_remove:
+            abs_path = self.repo_path / str_path.replace('/', os.path.sep)
+            if not abs_path.exists():
+                continue
+            if self._hash_file(abs_path) != content_hash:
+                print(f"Aviso: {str_path} tiene cambios sin guardar; se conserva.")
+                continue
+            abs_path.unlink()
+            removed += 1
+            parent = abs_path.parent
+            while parent != self.repo_path and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        
+        written = sum(1 for result in results if result is not False)
+        print(f"Checkout parcial actualizado en la rama {branch}: "
+              f"{written} archivos añadidos, {removed} eliminados.")
         return True
 
+    @_locked
     def branch_create(self, branch_name):
         """Crea una nueva rama."""
         if not branch_name:
@@ -621,7 +1542,8 @@ class SHIT:
         
         if self.branches_dir.exists():
             for branch_file in self.branches_dir.iterdir():
-                if branch_file.is_file():
+                # Sin los temporales de una actualización en curso
+                if branch_file.is_file() and '.tmp' not in branch_file.name:
                     branches.append(branch_file.name)
         
         if not branches:
@@ -637,8 +1559,12 @@ class SHIT:
                 
         return True
 
-    def branch_switch(self, branch_name):
-        """Cambia a otra rama."""
+    def branch_switch(self, branch_name, force=False):
+        """Cambia a otra rama y actualiza los archivos que difieren entre las dos.
+        
+        Si alguno de esos archivos tiene cambios sin guardar no se cambia de
+        rama, salvo con `force`, que los copia antes a `<archivo>.bak`.
+        """
         if not branch_name:
             print("Error: Debe especificar el nombre de la rama.")
             return False
@@ -647,16 +1573,136 @@ class SHIT:
         if not branch_path.exists():
             print(f"Error: La rama '{branch_name}' no existe.")
             return False
+        
+        # Actualizar el directorio de trabajo antes de mover HEAD
+        current_branch = self._get_current_branch()
+        try:
+            changes = self._switch_working_tree(current_branch, branch_name, force)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
             
         # Registrar el cambio de rama en el reflog
-        current_branch = self._get_current_branch()
         self._add_to_reflog(f"branch switch {branch_name}", current_branch)
         
         # Cambiar a la rama especificada
         self._set_head(branch_name)
         print(f"Cambiado a la rama '{branch_name}'.")
+        if changes:
+            print(f"Archivos actualizados: {len(changes)}")
+        return True
+
+    def _switch_working_tree(self, current_branch, target_branch, force=False):
+        """Lleva el directorio de trabajo del estado de una rama al de otra, sin mostrar nada.
+        
+        Solo se tocan los archivos que difieren entre los árboles de las dos
+        ramas: se escriben en paralelo y de forma atómica, y los que no existen
+        en la rama destino se borran (solo si ambas ramas apuntan a commits;
+        con un historial anterior a las instantáneas el árbol sale del índice
+        y no es fiable para borrar). Antes de escribir nada se comprueba que
+        ninguno tenga cambios sin guardar: si alguno los tiene se lanza
+        ShitError, salvo con `force`, que los copia a `<archivo>.bak`. Los
+        archivos fuera del checkout parcial no se tocan. Devuelve la lista de
+        TreeChange aplicados. Lanza ShitError si la rama destino es la actual
+        de otro worktree.
+        """
+        for path, branch in self._worktree_heads().items():
+            if branch == target_branch:
+                raise ShitError(f"La rama '{target_branch}' está en uso en el worktree {path}.")
+        
+        sparse = self._sparse()
+        changes = [change for change in self._branch_changes(current_branch, target_branch)
+                   if sparse.includes(change.path)]
+        if not changes:
+            return []
+        can_delete = (self._branch_head(current_branch) is not None and
+                      self._branch_head(target_branch) is not None)
+        
+        # Comprobar solo los archivos afectados, con el hash en caché dentro de `shit serve`
+        to_write, to_delete, dirty, applied = [], [], [], []
+        for change in changes:
+            abs_path = self.repo_path / change.path.replace('/', os.path.sep)
+            if change.state == 'deleted' and not can_delete:
+                continue
+            if not abs_path.exists():
+                if change.new_hash is not None:
+                    to_write.append((change.new_hash, abs_path))
+                    applied.append(change)
+                continue
+            try:
+                current_hash = self._hash_file(abs_path)
+            except OSError:
+                current_hash = None
+            if current_hash == change.new_hash:
+                continue
+            if current_hash != change.old_hash:
+                dirty.append(abs_path)
+            if change.new_hash is None:
+                to_delete.append(abs_path)
+            else:
+                to_write.append((change.new_hash, abs_path))
+            applied.append(change)
+        
+        if dirty and not force:
+            listado = ', '.join(str(path.relative_to(self.repo_path)) for path in dirty[:10])
+            if len(dirty) > 10:
+                listado += f" y {len(dirty) - 10} más"
+            raise ShitError(f"Hay cambios sin guardar en archivos que el cambio de rama sobrescribiría: {listado}. "
+                            f"Guárdelos con commit o use --force.")
+        # Los archivos se reemplazan o se borran después, así que basta con enlazarlos
+        for abs_path in dirty:
+            _make_backup(abs_path)
+        
+        self._write_objects(to_write, backup=False, atomic=True)
+        for abs_path in to_delete:
+            abs_path.unlink()
+        return applied
+
+    def branch_diff(self, source_branch, target_branch=None, output_format='text'):
+        """Muestra los archivos en los que `source_branch` difiere de `target_branch` (la actual por defecto).
+        
+        Compara los árboles de los commits de las dos ramas; si ambos son el
+        mismo árbol no hace falta recorrerlos.
+        """
+        if target_branch is None:
+            target_branch = self._get_current_branch()
+        
+        try:
+            changes = self._branch_changes(target_branch, source_branch)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        if output_format != 'text':
+            _write_records(changes, output_format)
+            return True
+        
+        if not changes:
+            print(f"Las ramas '{source_branch}' y '{target_branch}' tienen el mismo contenido.")
+            return True
+        
+        print(f"\nCambios de la rama '{source_branch}' respecto a '{target_branch}':")
+        etiquetas = {'added': 'añadido', 'modified': 'modificado', 'deleted': 'eliminado'}
+        for change in changes:
+            print(f"  {etiquetas[change.state]}: {change.path}")
+        print(f"\n{len(changes)} archivos distintos.")
         return True
 
+    def _branch_changes(self, old_branch, new_branch):
+        """Devuelve la lista de TreeChange para pasar del estado de una rama al de otra."""
+        for branch in (old_branch, new_branch):
+            if not (self.branches_dir / branch).exists():
+                raise ShitError(f"La rama '{branch}' no existe.")
+        
+        old_commit = self._branch_head(old_branch)
+        new_commit = self._branch_head(new_branch)
+        if old_commit is not None and new_commit is not None:
+            return sorted(self._diff_tree_objects(old_commit.tree, new_commit.tree))
+        _, old_tree = self._branch_tree(old_branch)
+        _, new_tree = self._branch_tree(new_branch)
+        return list(_diff_trees(old_tree, new_tree))
+
+    @_locked
     def branch_merge(self, source_branch, target_branch=None):
         """Fusiona una rama con otra."""
         if not source_branch:
@@ -684,65 +1730,71 @@ class SHIT:
         # Cargar el índice
         self._load_index()
         
-        # Obtener todos los archivos versionados
-        for file_path, file_info in self.index.items():
-            # Filtrar versiones por rama origen
-            source_versions = [v for v in file_info['versions'] if v.get('branch', 'master') == source_branch]
-            if not source_versions:
+        # Archivos que la rama origen añade o cambia respecto a la destino
+        try:
+            changes = [change for change in self._branch_changes(target_branch, source_branch)
+                       if change.state != 'deleted']
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        # Solo se escriben (y se descargan) los archivos del checkout parcial;
+        # los demás se fusionan únicamente en el historial
+        sparse = self._sparse()
+        self._fetch_objects([change.new_hash for change in changes if sparse.includes(change.path)])
+        
+        merged = []
+        for change in changes:
+            file_path = change.path
+            if not sparse.includes(file_path):
+                merged.append(change)
                 continue
-                
-            # Obtener la última versión de la rama origen
-            latest_source_version = source_versions[-1]
-            source_hash = latest_source_version['hash']
             
-            # Obtener la versión correspondiente en la rama destino
-            target_versions = [v for v in file_info['versions'] if v.get('branch', 'master') == target_branch]
+            # Recuperar el contenido de la versión de la rama origen
+            if not self._object_path(change.new_hash).exists():
+                print(f"Error: No se encuentra el objeto {change.new_hash} para {file_path}.")
+                continue
             
-            if not target_versions or target_versions[-1]['hash'] != source_hash:
-                # La versión más reciente de la rama origen es diferente, aplicar cambios
-                
-                # Recuperar el contenido de la versión de la rama origen
-                object_path = self.objects_dir / source_hash[:2] / source_hash[2:]
-                if not object_path.exists():
-                    print(f"Error: No se encuentra el objeto {source_hash} para {file_path}.")
-                    continue
-                    
-                # Leer, descomprimir y guardar una copia en la rama destino
-                with open(object_path, 'rb') as f:
-                    compressed = f.read()
-                    
-                content = zlib.decompress(compressed)
-                
-                # Crear la ruta de archivo
-                abs_file_path = self.repo_path / file_path
-                abs_file_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Crear una copia de seguridad si existe
-                if abs_file_path.exists():
-                    backup_path = abs_file_path.with_suffix(abs_file_path.suffix + '.merge.bak')
-                    shutil.copy2(abs_file_path, backup_path)
-                
-                # Escribir el contenido
-                with open(abs_file_path, 'wb') as f:
-                    f.write(content)
-                    
-                # Agregar la versión a la rama destino
-                merge_message = f"Fusionado desde rama '{source_branch}'"
-                self.commit(abs_file_path, merge_message, branch=target_branch)
-                
-                print(f"Fusionado: {file_path}")
-                
+            # Escribir el contenido, conservando el archivo existente en .merge.bak
+            self._write_content(self._iter_object(change.new_hash), self.repo_path / file_path,
+                                backup=True, backup_suffix='.merge.bak')
+            
+            merged.append(change)
+            print(f"Fusionado: {file_path}")
+        
+        # Un único commit de fusión en la rama destino, con la rama origen como segundo padre;
+        # los objetos ya están en el almacén, así que las versiones se registran con su hash
+        if merged:
+            merge_message = f"Fusionado desde rama '{source_branch}'"
+            source_head = self._branch_head(source_branch)
+            versions = [self._add_version(change.path, change.new_hash, merge_message, target_branch)
+                        for change in merged]
+            self._finish_commit(versions, merge_message, target_branch,
+                                parents=[source_head.hash] if source_head is not None else [])
+        
         print(f"Rama '{source_branch}' fusionada en '{target_branch}'.")
         return True
 
-    def remote_init(self, repo_name):
-        """Inicializa un repositorio remoto en Google Drive."""
-        if not DRIVE_SUPPORT:
-            print("Error: El soporte para Google Drive no está disponible.")
-            print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+    def remote_init(self, repo_name, path=None):
+        """Inicializa un repositorio remoto.
+        
+        Con `path` el remoto se crea en ese directorio (local o montado en red);
+        si no, en Google Drive.
+        """
+        if path is not None:
+            from remote import LocalRemote
+            remote_path = LocalRemote(self.common_path).init_remote(repo_name, path)
+            self._remote = None
+            if remote_path:
+                print(f"Para clonar este repositorio: shit remote clone {remote_path}")
+                return True
+            return False
+        
+        DriveSync = load_drive_sync()
+        if DriveSync is None:
             return False
         
-        drive = DriveSync(self.repo_path)
+        drive = DriveSync(self.common_path)
         repo_id = drive.init_remote(repo_name)
         
         if repo_id:
@@ -750,52 +1802,109 @@ class SHIT:
             return True
         return False
 
-    def remote_clone(self, repo_id, target_dir='.'):
-        """Clona un repositorio desde Google Drive."""
-        if not DRIVE_SUPPORT:
-            print("Error: El soporte para Google Drive no está disponible.")
-            print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+    def remote_clone(self, repo_id, target_dir='.', branch=None, depth=None, lazy=False, cache_limit=None):
+        """Clona un repositorio desde Google Drive o desde un directorio remoto.
+        
+        Si `repo_id` es un directorio existente se clona desde él; si no, se
+        interpreta como el ID de un repositorio de Google Drive.
+        Solo se descargan los objetos de la rama indicada (master por defecto),
+        limitados opcionalmente a las `depth` versiones más recientes por archivo.
+        Con `lazy` solo se descarga el índice y los objetos se obtienen bajo
+        demanda, en una caché local limitada a `cache_limit` bytes.
+        """
+        if branch is None:
+            branch = "master"
+        
+        if os.path.isdir(repo_id):
+            from remote import LocalRemote
+            result = LocalRemote().clone(repo_id, target_dir, branch, depth, lazy)
+        else:
+            DriveSync = load_drive_sync()
+            if DriveSync is None:
+                return False
+            
+            drive = DriveSync()
+            result = drive.clone(repo_id, target_dir, branch, depth, lazy)
+        
+        if result is None:
             return False
         
-        drive = DriveSync()
-        result = drive.clone(repo_id, target_dir)
-        return result is not None
+        clone = SHIT(result)
+        if lazy:
+            # Guardar el límite de la caché bajo demanda en la configuración del clon
+            clone._load_config()
+            clone.config['lazy_cache_limit'] = cache_limit if cache_limit is not None else DEFAULT_LAZY_CACHE_LIMIT
+            clone._save_config()
+        
+        # Descargar el commit de la rama y su árbol, como en remote pull
+        try:
+            clone._fetch_branch_tree(branch)
+        except ShitError as e:
+            print(f"Advertencia: {str(e)}")
+        return True
 
     def remote_push(self, branch=None):
         """Envía cambios al repositorio remoto."""
-        if not DRIVE_SUPPORT:
-            print("Error: El soporte para Google Drive no está disponible.")
-            print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+        remote = self._get_remote()
+        if remote is None:
             return False
         
         if branch is None:
             branch = self._get_current_branch()
         
-        drive = DriveSync(self.repo_path)
-        return drive.push(branch)
+        return remote.push(branch)
 
-    def remote_pull(self, branch=None):
-        """Obtiene cambios desde el repositorio remoto."""
-        if not DRIVE_SUPPORT:
-            print("Error: El soporte para Google Drive no está disponible.")
-            print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+    def remote_pull(self, branch=None, depth=None):
+        """Obtiene cambios desde el repositorio remoto.
+        
+        Solo se descargan los objetos alcanzables desde la rama indicada,
+        limitados opcionalmente a las `depth` versiones más recientes por archivo.
+        """
+        remote = self._get_remote()
+        if remote is None:
             return False
         
         if branch is None:
             branch = self._get_current_branch()
         
-        drive = DriveSync(self.repo_path)
-        return drive.pull(branch)
+        if not remote.pull(branch, depth):
+            return False
+        
+        # Descargar también el commit de la rama y su árbol para compararla sin conexión
+        try:
+            self._fetch_branch_tree(branch)
+        except ShitError as e:
+            print(f"Advertencia: {str(e)}")
+        return True
 
     def remote_share(self, email, role='writer'):
         """Comparte el repositorio remoto con otro usuario."""
-        if not DRIVE_SUPPORT:
-            print("Error: El soporte para Google Drive no está disponible.")
-            print("Instale los paquetes requeridos: google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+        remote = self._get_remote()
+        if remote is None:
             return False
         
-        drive = DriveSync(self.repo_path)
-        return drive.share(email, role)
+        return remote.share(email, role)
+
+    def _has_remote(self):
+        """Indica si el repositorio tiene configurado un remoto (directorio o Google Drive)."""
+        return ((self.common_dir / 'remote_config.json').exists() or
+                (self.common_dir / 'drive_config.json').exists())
+
+    def _get_remote(self, quiet=False):
+        """Devuelve el transporte del repositorio remoto, reutilizado entre operaciones.
+        
+        Se usa el directorio remoto si hay uno configurado y Google Drive en
+        otro caso. Devuelve None si hace falta Google Drive y no está disponible.
+        """
+        if self._remote is None:
+            if (self.common_dir / 'remote_config.json').exists():
+                from remote import LocalRemote
+                self._remote = LocalRemote(self.common_path)
+            else:
+                DriveSync = load_drive_sync(quiet)
+                if DriveSync is not None:
+                    self._remote = DriveSync(self.common_path)
+        return self._remote
 
     def _get_current_branch(self):
         """Obtiene el nombre de la rama actual."""
@@ -813,7 +1922,7 @@ class SHIT:
     def _update_branch_ref(self, branch_name, content_hash):
         """Actualiza la referencia de una rama."""
         # Usar os.path en lugar de pathlib para mayor compatibilidad con directorios ocultos
-        branch_dir = os.path.join(self.vcs_dir, "refs", "branches")
+        branch_dir = os.path.join(self.common_dir, "refs", "branches")
         if not os.path.exists(branch_dir):
             try:
                 os.makedirs(branch_dir, exist_ok=True)
@@ -824,230 +1933,1603 @@ class SHIT:
         branch_path = os.path.join(branch_dir, branch_name)
         
         try:
-            with open(branch_path, 'w') as f:
-                f.write(content_hash)
+            from remote import write_atomic
+            with self._repo_lock():
+                write_atomic(branch_path, content_hash)
         except Exception as e:
             print(f"Error al escribir referencia de rama {branch_path}: {str(e)}")
             return False
         
+        self._enqueue_sync(branch_name)
         return True
 
-    def _save_config(self):
-        """Guarda la configuración en disco."""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, indent=2)
+    def _read_ref(self, branch):
+        """Devuelve el valor de la referencia de una rama (None si no existe o está vacía)."""
+        try:
+            with open(self.branches_dir / branch, 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
 
-    def _load_config(self):
-        """Carga la configuración desde disco."""
-        if self.config_file.exists():
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
+    def _write_object(self, content, content_hash=None):
+        """Guarda un contenido en el almacén de objetos y devuelve su hash.
+        
+        Si el objeto ya existe (en el repositorio o en el almacén compartido)
+        no se comprime ni se escribe nada. Con almacén compartido el objeto se
+        escribe allí y el del repositorio es un enlace duro a él.
+        """
+        if content_hash is None:
+            content_hash = hashlib.sha256(content).hexdigest()
+        if self._adopt_object(content_hash):
+            return content_hash
+        compressed = zlib.compress(content)
+        
+        # Usar os.path para mayor compatibilidad con Windows
+        object_dir = os.path.join(self.objects_dir, content_hash[:2])
+        os.makedirs(object_dir, exist_ok=True)
+        object_path = os.path.join(object_dir, content_hash[2:])
+        if self.shared_store is not None:
+            shared_path = self.shared_store / content_hash[:2] / content_hash[2:]
+            shared_path.parent.mkdir(parents=True, exist_ok=True)
+            # Otro repositorio puede estar escribiendo el mismo objeto: escribir aparte y reemplazar
+            temp_path = shared_path.with_name(f"{shared_path.name}.{os.urandom(6).hex()}.tmp")
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, shared_path)
+            try:
+                os.link(shared_path, object_path)
+                return content_hash
+            except FileExistsError:
+                return content_hash
+            except OSError:
+                # Otro sistema de archivos, o `shit gc` lo ha borrado entretanto: guardar una copia propia
+                pass
+        with open(object_path, 'wb') as f:
+            f.write(compressed)
+        return content_hash
+
+    def _adopt_object(self, content_hash):
+        """Indica si un objeto ya está en el repositorio, enlazándolo desde el almacén compartido si hace falta."""
+        object_path = self._object_path(content_hash)
+        if object_path.exists():
+            return True
+        if self.shared_store is None:
+            return False
+        try:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.link(self.shared_store / content_hash[:2] / content_hash[2:], object_path)
+        except FileExistsError:
+            return True
+        except OSError:
+            return False
+        return True
 
-    def _save_index(self):
-        """Guarda el índice en disco."""
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(self.index, f, indent=2)
+    def _load_commit(self, commit_hash):
+        """Lee un commit del almacén y lo devuelve como CommitRecord.
+        
+        Devuelve None si el hash no es de un commit: las ramas anteriores a las
+        instantáneas apuntan a la última versión guardada de algún archivo.
+        """
+        if not commit_hash:
+            return None
+        content = self._read_object(commit_hash)
+        if content is None or not content.startswith(COMMIT_PREFIX):
+            return None
+        data = json.loads(content)
+        return CommitRecord(commit_hash, data['tree'], data['parents'], data['branch'],
+                            data['message'], data['timestamp'])
 
-    def _load_index(self):
-        """Carga el índice desde disco."""
-        if self.index_file.exists():
-            with open(self.index_file, 'r', encoding='utf-8') as f:
-                self.index = json.load(f)
+    def _load_tree_node(self, tree_hash):
+        """Lee un nivel de un árbol: lista de (nombre, hash, tipo) ordenada por nombre.
+        
+        Un árbol plano (anterior a los subárboles) se convierte antes a
+        subárboles, que se guardan en el almacén.
+        """
+        node = self._tree_nodes.get(tree_hash)
+        if node is not None:
+            return node
+        content = self._read_object(tree_hash)
+        if content is None or not content.startswith(TREE_PREFIX):
+            raise ShitError(f"No se encuentra el árbol {tree_hash}.")
+        entries = json.loads(content)['entries']
+        if entries and len(entries[0]) == 2:
+            node = self._load_tree_node(self._build_tree(dict(entries)))
         else:
-            self.index = {}
+            node = [tuple(entry) for entry in entries]
+        self._tree_nodes[tree_hash] = node
+        return node
 
-    def status(self):
-        """Muestra el estado de los archivos: modificados, añadidos y sin seguimiento."""
-        # Cargar el índice
-        self._load_index()
+    def _load_tree(self, tree_hash):
+        """Lee un árbol completo como lista de pares (ruta, hash) ordenada por ruta."""
+        return sorted(self._iter_tree(tree_hash))
+
+    def _iter_tree(self, tree_hash, prefix=''):
+        """Genera los pares (ruta, hash) de los archivos de un árbol, con `prefix` delante de cada ruta."""
+        for name, entry_hash, kind in self._load_tree_node(tree_hash):
+            if kind == 'tree':
+                yield from self._iter_tree(entry_hash, prefix + name + '/')
+            else:
+                yield prefix + name, entry_hash
+
+    def _tree_entry(self, tree_hash, str_path):
+        """Devuelve el (hash, tipo) de una ruta en un árbol, o None, leyendo solo los niveles del camino."""
+        entry = (tree_hash, 'tree')
+        for name in str_path.strip('/').split('/'):
+            if entry[1] != 'tree':
+                return None
+            entry = next(((entry_hash, kind) for entry_name, entry_hash, kind in self._load_tree_node(entry[0])
+                          if entry_name == name), None)
+            if entry is None:
+                return None
+        return entry
+
+    def _tree_objects(self, tree_hash, found=None, local_only=False):
+        """Devuelve los hashes de todos los niveles de un árbol (no los de los archivos).
         
-        # Inicializar listas para cada categoría
-        modificados = []
-        sin_commit = []
-        sin_seguimiento = []
+        Se recorre por niveles y los que falten en local se descargan de una
+        vez por nivel; con `local_only` no se descarga nada y se omiten los que
+        falten. Los niveles que ya están en `found` no se recorren de nuevo
+        (se añaden a ese mismo conjunto).
+        """
+        found = set() if found is None else found
+        level = [tree_hash] if tree_hash not in found else []
+        while level:
+            if local_only:
+                level = [node_hash for node_hash in level if self._object_path(node_hash).exists()]
+            else:
+                self._fetch_objects(level)
+            found.update(level)
+            next_level = []
+            for node_hash in level:
+                for _, entry_hash, kind in self._load_tree_node(node_hash):
+                    if kind == 'tree' and entry_hash not in found:
+                        next_level.append(entry_hash)
+            level = list(dict.fromkeys(next_level))
+        return found
+
+    def _build_tree(self, entries):
+        """Guarda como subárboles un árbol dado como diccionario ruta -> hash; devuelve el hash de la raíz."""
+        files, children = [], {}
+        for str_path, content_hash in entries.items():
+            name, sep, rest = str_path.partition('/')
+            if sep:
+                children.setdefault(name, {})[rest] = content_hash
+            else:
+                files.append((name, content_hash, 'blob'))
+        node = files + [(name, self._build_tree(child), 'tree') for name, child in children.items()]
+        return self._write_object(_encode_tree(node))
+
+    def _update_tree(self, tree_hash, changes):
+        """Aplica `changes` (ruta -> hash, o None para quitarla) a un árbol y devuelve el hash del nuevo.
         
-        # Crear un conjunto con todas las rutas normalizadas en el índice
-        rutas_en_indice = set()
-        for str_path in self.index.keys():
-            # Normalizar la ruta para comparaciones
-            # Convertir todas las barras a formato Unix (/) para consistencia
-            ruta_normalizada = str_path.replace('\\', '/')
-            rutas_en_indice.add(ruta_normalizada)
+        Solo se leen y se guardan los niveles de los directorios con cambios;
+        los demás subárboles se reutilizan por su hash. Devuelve None si el
+        árbol queda vacío.
+        """
+        node = {}
+        if tree_hash is not None:
+            node = {name: (entry_hash, kind) for name, entry_hash, kind in self._load_tree_node(tree_hash)}
+        children = {}
+        for str_path, content_hash in changes.items():
+            name, sep, rest = str_path.partition('/')
+            if sep:
+                children.setdefault(name, {})[rest] = content_hash
+            elif content_hash is None:
+                node.pop(name, None)
+            else:
+                node[name] = (content_hash, 'blob')
+        for name, child_changes in children.items():
+            current = node.get(name)
+            child_hash = self._update_tree(current[0] if current and current[1] == 'tree' else None, child_changes)
+            if child_hash is None:
+                node.pop(name, None)
+            else:
+                node[name] = (child_hash, 'tree')
+        if not node:
+            return None
+        return self._write_object(_encode_tree([(name, entry_hash, kind) for name, (entry_hash, kind) in node.items()]))
+
+    def _diff_tree_objects(self, old_hash, new_hash, prefix=''):
+        """Genera los TreeChange entre dos árboles del almacén (None es un árbol vacío).
         
-        # Obtener la rama actual
-        branch = self._get_current_branch()
-        print(f"\nEstado de la rama '{branch}':")
+        Los subdirectorios con el mismo hash en los dos árboles no se leen, así
+        que el coste depende de los directorios con cambios y no del tamaño del
+        árbol. Los cambios salen en el orden de los niveles, no por ruta.
+        """
+        if old_hash == new_hash:
+            return
+        old = {name: (entry_hash, kind) for name, entry_hash, kind in self._load_tree_node(old_hash)} if old_hash else {}
+        new = {name: (entry_hash, kind) for name, entry_hash, kind in self._load_tree_node(new_hash)} if new_hash else {}
+        for name in sorted(old.keys() | new.keys()):
+            path = prefix + name
+            old_entry, new_entry = old.get(name, (None, None)), new.get(name, (None, None))
+            old_blob = old_entry[0] if old_entry[1] == 'blob' else None
+            new_blob = new_entry[0] if new_entry[1] == 'blob' else None
+            if old_blob != new_blob:
+                if old_blob is None:
+                    yield TreeChange(path, 'added', None, new_blob)
+                elif new_blob is None:
+                    yield TreeChange(path, 'deleted', old_blob, None)
+                else:
+                    yield TreeChange(path, 'modified', old_blob, new_blob)
+            old_tree = old_entry[0] if old_entry[1] == 'tree' else None
+            new_tree = new_entry[0] if new_entry[1] == 'tree' else None
+            if old_tree != new_tree:
+                yield from self._diff_tree_objects(old_tree, new_tree, path + '/')
+
+    def _branch_head(self, branch):
+        """Devuelve el CommitRecord al que apunta una rama, o None si no apunta a un commit.
         
-        # Analizar todos los archivos bajo control de versiones
-        for file_path, info in self.index.items():
-            # Convertir la ruta para el sistema operativo actual
-            file_sys_path = file_path.replace('/', os.path.sep)
-            abs_path = self.repo_path / file_sys_path
+        Una rama sin commits apunta a nada o, con un historial anterior a las
+        instantáneas, a la última versión guardada de algún archivo. Si apunta
+        a un objeto que no está en local ni se puede descargar se lanza
+        ShitError: tratarlo como una rama sin commits cortaría su historial.
+        """
+        ref = self._read_ref(branch)
+        if not ref:
+            return None
+        commit = self._load_commit(ref)
+        if commit is None and not self._object_path(ref).exists() and not self._versions_with_hash(ref):
+            raise ShitError(f"No se encuentra el commit {ref[:12]} de la rama {branch} "
+                            f"(no está en local y no se ha podido descargar del remoto).")
+        return commit
+
+    def _branch_tree(self, branch):
+        """Devuelve el commit (o None) y el árbol del estado actual de una rama.
+        
+        Si la rama no apunta a un commit (historial anterior a las
+        instantáneas) el árbol se calcula con la última versión de cada archivo
+        en el índice.
+        """
+        commit = self._branch_head(branch)
+        if commit is not None:
+            return commit, self._load_tree(commit.tree)
+        
+        if not self.index:
+            self._load_index()
+        entries = {}
+        for str_path, info in self.index.items():
+            versions = [v for v in info.get('versions', []) if v.get('branch', 'master') == branch]
+            if versions:
+                entries[str_path] = versions[-1]['hash']
+        return None, sorted(entries.items())
+
+    def _fetch_branch_tree(self, branch):
+        """Descarga, si faltan en local, el commit de una rama y todos los niveles de su árbol."""
+        commit = self._branch_head(branch)
+        if commit is not None:
+            self._tree_objects(commit.tree)
+
+    def _snapshot_objects(self):
+        """Devuelve los commits y niveles de árbol locales alcanzables desde alguna rama.
+        
+        Se siguen todos los padres; lo que no está en local no se recorre.
+        """
+        found = set()
+        pending = [self._read_ref(branch_file.name) for branch_file in self.branches_dir.iterdir()
+                   if branch_file.is_file() and '.tmp' not in branch_file.name] if self.branches_dir.exists() else []
+        while pending:
+            commit_hash = pending.pop()
+            if not commit_hash or commit_hash in found or not self._object_path(commit_hash).exists():
+                continue
+            commit = self._load_commit(commit_hash)
+            if commit is None:
+                continue
+            found.add(commit_hash)
+            self._tree_objects(commit.tree, found, local_only=True)
+            pending.extend(commit.parents)
+        return found
+
+    def _snapshot(self, branch, message, records, parents=()):
+        """Crea un commit de `branch` con las versiones `records` y devuelve su hash.
+        
+        El árbol nuevo es el del commit actual de la rama con las entradas de
+        `records` reemplazadas (solo se guardan los directorios que cambian); el
+        commit actual es el primer padre, seguido de `parents`. Lanza ShitError
+        si el commit actual no está disponible.
+        """
+        changes = {record.path: record.hash for record in records}
+        head = self._branch_head(branch)
+        if head is not None:
+            tree_hash = self._update_tree(head.tree, changes) or self._write_object(_encode_tree([]))
+        else:
+            # Historial anterior a las instantáneas: árbol completo a partir del índice
+            _, entries = self._branch_tree(branch)
+            entries = dict(entries)
+            entries.update(changes)
+            tree_hash = self._build_tree(entries)
+        parent_hashes = ([head.hash] if head is not None else []) + [parent for parent in parents if parent]
+        commit_hash = self._write_object(_encode_commit(tree_hash, parent_hashes, branch, message,
+                                                        datetime.datetime.now().isoformat()))
+        self._touch_objects([tree_hash, commit_hash])
+        return commit_hash
+
+    def _commit_introducing(self, branch, content_hash):
+        """Busca, siguiendo el primer padre desde la rama, el commit que introdujo una versión.
+        
+        Devuelve el CommitRecord más antiguo del último tramo de commits cuyo
+        árbol contiene el hash, o None.
+        """
+        # Solo hace falta mirar las rutas que han tenido ese contenido
+        paths = {record.path.replace(os.sep, '/') for record in self._versions_with_hash(content_hash)}
+        found = None
+        commit = self._branch_head(branch)
+        while commit is not None:
+            if any(self._tree_entry(commit.tree, path) == (content_hash, 'blob') for path in paths):
+                found = commit
+            elif found is not None:
+                break
+            commit = self._load_commit(commit.parents[0]) if commit.parents else None
+        return found
+
+    def _repo_lock(self):
+        """Devuelve el bloqueo de los metadatos compartidos del repositorio (índice, ramas y cachés)."""
+        from remote import repo_lock
+        return repo_lock(self.common_dir)
+
+    def _save_config(self):
+        """Guarda la configuración en disco."""
+        with open(self.config_file, 'w', encoding='utf-8') as f:
+            json.dump(self.config, f, indent=2)
+
+    def _load_config(self):
+        """Carga la configuración desde disco."""
+        if self.config_file.exists():
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                self.config = json.load(f)
+
+    def _save_index(self, records=None):
+        """Guarda el índice en disco (de forma atómica).
+        
+        `records` son los registros del índice (como los del registro
+        incremental) que se han añadido desde que se cargó; se anotan en el
+        diario del historial para actualizarlo sin reconstruirlo. Sin ellos el
+        historial se reconstruye en la próxima consulta.
+        """
+        from remote import write_atomic
+        from history import HistoryIndex
+        
+        history = HistoryIndex(self.common_dir)
+        base_key = history.index_key()
+        write_atomic(self.index_file, json.dumps(self.index, indent=2))
+        if records:
+            history.log_changes(base_key, records)
+        
+        state = self._memory_state()
+        if state is not None:
+            st = os.stat(self.index_file)
+            state['index_key'] = (st.st_mtime_ns, st.st_size)
+            state['index'] = self.index
+
+    def _load_index(self):
+        """Carga el índice desde disco.
+        
+        Dentro de `shit serve` se reutiliza el índice en memoria mientras el
+        archivo no cambie.
+        """
+        state = self._memory_state()
+        if state is not None:
+            try:
+                st = os.stat(self.index_file)
+            except FileNotFoundError:
+                self.index = {}
+                return
+            key = (st.st_mtime_ns, st.st_size)
+            if state.get('index_key') == key:
+                self.index = state['index']
+                return
+        
+        if self.index_file.exists():
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        
+        if state is not None:
+            state['index_key'] = key
+            state['index'] = self.index
+
+    def _memory_state(self):
+        """Devuelve el estado en memoria del repositorio (None fuera de `shit serve`)."""
+        if _REPO_STATE is None:
+            return None
+        key = str(self.vcs_dir.resolve())
+        if key not in _REPO_STATE:
+            _REPO_STATE[key] = {'index_key': None, 'index': None, 'stat': {}}
+        return _REPO_STATE[key]
+
+    def _hash_file(self, file_path):
+        """Calcula el hash SHA-256 del contenido de un archivo.
+        
+        Dentro de `shit serve` se reutiliza el hash calculado antes mientras
+        no cambien la fecha de modificación, el tamaño ni el inodo del archivo.
+        """
+        state = self._memory_state()
+        if state is not None:
+            st = os.stat(file_path)
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            cached = state['stat'].get(str(file_path))
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        
+        # Por bloques, para no cargar en memoria archivos de varios GB
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(OBJECT_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        content_hash = hasher.hexdigest()
+        
+        # No guardar archivos modificados hace muy poco: podrían cambiar sin que cambie su fecha
+        if state is not None and time.time() - st.st_mtime > STAT_CACHE_RACY_WINDOW:
+            state['stat'][str(file_path)] = (key, content_hash)
+        return content_hash
+
+    def _append_index_log(self, *records):
+        """Registra cambios del índice pendientes de enviar al remoto.
+        
+        Solo se registran si hay un repositorio remoto configurado; `remote push`
+        envía únicamente estos registros en lugar del índice completo.
+        """
+        if not self._has_remote():
+            return
+        
+        with open(self.common_dir / 'index_log.jsonl', 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def _object_path(self, content_hash):
+        """Devuelve la ruta del objeto con el hash indicado."""
+        return self.objects_dir / content_hash[:2] / content_hash[2:]
+
+    def _read_object(self, content_hash):
+        """Lee y descomprime un objeto, descargándolo del remoto si falta en local.
+        
+        Devuelve None si el objeto no está disponible. No registra el acceso:
+        reescribir el registro en cada lectura lo haría en cada nivel de un
+        árbol; quien lee objetos los registra de una vez con _touch_objects.
+        """
+        object_path = self._object_path(content_hash)
+        if not object_path.exists():
+            self._fetch_objects([content_hash])
+            if not object_path.exists():
+                return None
+        
+        with open(object_path, 'rb') as f:
+            compressed = f.read()
+        return zlib.decompress(compressed)
+
+    def _iter_object(self, content_hash):
+        """Genera el contenido de un objeto local en bloques, sin descomprimirlo entero en memoria."""
+        decompressor = zlib.decompressobj()
+        with open(self._object_path(content_hash), 'rb') as f:
+            for compressed in iter(lambda: f.read(OBJECT_CHUNK_SIZE), b''):
+                data = decompressor.decompress(compressed, OBJECT_CHUNK_SIZE)
+                while data:
+                    yield data
+                    data = decompressor.decompress(decompressor.unconsumed_tail, OBJECT_CHUNK_SIZE)
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def _fetch_objects(self, hashes):
+        """Descarga del remoto los objetos indicados que falten en local.
+        
+        Los objetos descargados se registran en la caché bajo demanda.
+        Devuelve el número de objetos descargados.
+        """
+        missing = [h for h in dict.fromkeys(hashes) if not self._object_path(h).exists()]
+        if not missing:
+            return 0
+        
+        # Solo es posible si hay un remoto configurado
+        remote = self._get_remote(quiet=True) if self._has_remote() else None
+        if remote is None:
+            return 0
+        
+        if not self.quiet:
+            print(f"Descargando {len(missing)} objetos desde el repositorio remoto...")
+        fetched = remote.fetch_objects(missing, quiet=self.quiet)
+        
+        self._register_cached_objects(fetched)
+        return len(fetched)
+
+    def _load_object_cache(self):
+        """Carga el registro de accesos a objetos (tamaño, último acceso, origen)."""
+        if self.object_cache_file.exists():
+            with open(self.object_cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_object_cache(self, cache):
+        """Guarda el registro de accesos a objetos (de forma atómica)."""
+        from remote import write_atomic
+        write_atomic(self.object_cache_file, json.dumps(cache, indent=2))
+
+    def _touch_object(self, content_hash):
+        """Registra el acceso a un objeto para la expulsión LRU."""
+        self._touch_objects([content_hash])
+
+    def _tracks_object_access(self):
+        """Indica si hay que registrar los accesos a objetos.
+        
+        Solo los usan `maintenance` (con presupuesto) y la caché de un clon
+        perezoso; sin ninguno de los dos no se toca el registro.
+        """
+        self._load_config()
+        return bool(self.config.get('object_budget') or self.config.get('lazy_cache_limit'))
+
+    def _touch_objects(self, hashes):
+        """Registra el acceso a varios objetos leyendo y guardando el registro una sola vez."""
+        if self._tracks_object_access():
+            self._record_object_access(hashes)
+
+    @_locked
+    def _record_object_access(self, hashes):
+        """Anota la hora de acceso de los objetos locales en el registro de la caché."""
+        hashes = [h for h in hashes if self._object_path(h).exists()]
+        if not hashes:
+            return
+        
+        cache = self._load_object_cache()
+        now = time.time()
+        for content_hash in hashes:
+            entry = cache.setdefault(content_hash, {'size': self._object_path(content_hash).stat().st_size})
+            entry['last_access'] = now
+        self._save_object_cache(cache)
+
+    @_locked
+    def _register_cached_objects(self, hashes):
+        """Registra objetos descargados bajo demanda y aplica el límite de la caché.
+        
+        Si la caché supera el límite configurado se eliminan los objetos con el
+        acceso más antiguo; siguen en el remoto y se volverán a descargar si hacen falta.
+        """
+        if not hashes:
+            return
+        
+        cache = self._load_object_cache()
+        now = time.time()
+        for content_hash in hashes:
+            object_path = self._object_path(content_hash)
+            if object_path.exists():
+                cache[content_hash] = {
+                    'size': object_path.stat().st_size,
+                    'last_access': now,
+                    'fetched': True
+                }
+        
+        self._load_config()
+        limit = self.config.get('lazy_cache_limit')
+        if limit:
+            fetched = [h for h in cache if cache[h].get('fetched')]
+            total = sum(cache[h]['size'] for h in fetched)
+            # Nunca desalojar los objetos que se acaban de pedir
+            candidates = sorted(
+                (h for h in fetched if h not in hashes),
+                key=lambda h: cache[h]['last_access']
+            )
+            for content_hash in candidates:
+                if total <= limit:
+                    break
+                try:
+                    self._object_path(content_hash).unlink()
+                except FileNotFoundError:
+                    pass
+                total -= cache.pop(content_hash)['size']
+        
+        self._save_object_cache(cache)
+
+    def status(self, output_format='text'):
+        """Muestra el estado de los archivos: modificados, añadidos y sin seguimiento.
+        
+        Con `output_format` 'json' o 'ndjson' cada archivo con cambios se
+        escribe en cuanto se examina (sin ordenar).
+        """
+        if output_format != 'text':
+            _write_records(self._iter_status_entries(), output_format)
+            return True
+        
+        # Obtener la rama actual
+        branch = self._get_current_branch()
+        print(f"\nEstado de la rama '{branch}':")
+        
+        entries = self._status_entries()
+        etiquetas = {'deleted': 'eliminado', 'modified': 'modificado', 'unreadable': 'error al leer'}
+        modificados = [f"{etiquetas[e.state]}: {e.path}" for e in entries if e.state in etiquetas]
+        sin_commit = [e.path for e in entries if e.state == 'added']
+        sin_seguimiento = [e.path for e in entries if e.state == 'untracked']
+        
+        # Mostrar los resultados
+        if modificados:
+            print("\nArchivos modificados:")
+            for file in sorted(modificados):
+                print(f"  {file}")
+                
+        if sin_commit:
+            print("\nArchivos añadidos al control de versiones (sin commit):")
+            for file in sin_commit:
+                print(f"  {file}")
+                
+        if sin_seguimiento:
+            print("\nArchivos sin seguimiento:")
+            for file in sin_seguimiento:
+                print(f"  {file}")
+                
+        if not modificados and not sin_commit and not sin_seguimiento:
+            print("No hay cambios en los archivos.")
+            
+        return True
+
+    def _status_entries(self, paths=None):
+        """Calcula el estado de los archivos de la rama actual sin mostrar nada.
+        
+        Devuelve una lista de StatusEntry ordenada por ruta; los archivos sin
+        cambios no aparecen. Con `paths` (rutas con / relativas al repositorio)
+        solo se examinan esas rutas y no se recorre el directorio de trabajo.
+        """
+        return sorted(self._iter_status_entries(paths))
+
+    def _iter_status_entries(self, paths=None):
+        """Genera los StatusEntry de _status_entries a medida que se examinan los archivos."""
+        # Cargar el índice
+        self._load_index()
+        branch = self._get_current_branch()
+        
+        # Los archivos fuera del checkout parcial no están en disco a propósito
+        sparse = self._sparse()
+        if paths is None:
+            tracked = [(path, info) for path, info in self.index.items() if sparse.includes(path)]
+        else:
+            paths = set(paths)
+            tracked = [(path, self.index[path]) for path in paths if path in self.index and sparse.includes(path)]
+        
+        # Analizar los archivos bajo control de versiones
+        for file_path, info in tracked:
+            # Convertir la ruta para el sistema operativo actual
+            abs_path = self.repo_path / file_path.replace('/', os.path.sep)
             
             # Si el archivo no existe en disco, ha sido eliminado
             if not abs_path.exists():
-                modificados.append(f"eliminado: {file_path}")
-                continue
-                
-            # Verificar si el archivo tiene versiones
-            if not info.get('versions'):
-                sin_commit.append(file_path)
+                yield StatusEntry(file_path, 'deleted')
                 continue
                 
             # Filtrar versiones para la rama actual
-            versiones_rama = [v for v in info['versions'] if v.get('branch', 'master') == branch]
+            versiones_rama = [v for v in info.get('versions', []) if v.get('branch', 'master') == branch]
             if not versiones_rama:
-                sin_commit.append(file_path)
+                yield StatusEntry(file_path, 'added')
                 continue
                 
-            # Obtener la última versión y comparar con el contenido actual
-            ultima_version = versiones_rama[-1]
-            hash_original = ultima_version['hash']
-            
-            # Leer el contenido actual y calcular su hash
+            # Comparar el hash de la última versión con el del contenido actual
             try:
-                with open(abs_path, 'rb') as f:
-                    contenido = f.read()
-                hash_actual = hashlib.sha256(contenido).hexdigest()
-                
-                # Si los hashes son diferentes, el archivo ha sido modificado
-                if hash_actual != hash_original:
-                    modificados.append(f"modificado: {file_path}")
+                if self._hash_file(abs_path.resolve()) != versiones_rama[-1]['hash']:
+                    yield StatusEntry(file_path, 'modified')
             except Exception:
-                modificados.append(f"error al leer: {file_path}")
+                yield StatusEntry(file_path, 'unreadable')
         
-        # Recolectar todos los archivos del sistema de archivos
-        archivos_en_disco = set()
+        # Encontrar archivos sin seguimiento (en disco pero no en el índice)
+        rutas_en_indice = {str_path.replace('\\', '/') for str_path in self.index}
+        if paths is None:
+            candidatos = self._working_tree_files()
+        else:
+            candidatos = [path for path in paths
+                          if (self.repo_path / path.replace('/', os.path.sep)).is_file()]
+        for archivo in candidatos:
+            if archivo not in rutas_en_indice:
+                yield StatusEntry(archivo, 'untracked')
+
+    @_locked
+    def reset(self, commit_hash, mode="soft"):
+        """Retrocede HEAD a un commit específico.
         
-        # Método 1: Usar os.walk para encontrar todos los archivos en todas las carpetas
-        for root, _, files in os.walk(self.repo_path):
-            # Ignorar el directorio .shit y otros directorios ocultos
-            if '.shit' in root or os.path.basename(root).startswith('.'):
+        Modos:
+        - soft: Retrocede HEAD y deja cambios en staging
+        
+        `commit_hash` es un commit (como los del reflog) o el hash de una
+        versión, que lleva al commit de la rama que la introdujo. Puede
+        abreviarse mientras no sea ambiguo.
+        """
+        # Verificar que el modo es válido
+        if mode not in ["soft"]:
+            print(f"Error: Modo '{mode}' no soportado. Use 'soft'.")
+            return False
+            
+        # Obtener la rama actual
+        current_branch = self._get_current_branch()
+        
+        # Resolver el hash (puede estar abreviado): un commit o una versión de un archivo
+        try:
+            target_hash = self._resolve_hash(commit_hash, objects=True)
+            commit = self._load_commit(target_hash)
+            if commit is None:
+                # Una versión: volver al commit de la rama que la introdujo
+                commit = self._commit_introducing(current_branch, target_hash)
+            
+            if commit is not None:
+                # Los archivos afectados son la diferencia entre las dos instantáneas
+                current = self._branch_head(current_branch)
+                if current is not None:
+                    affected_files = list(self._diff_tree_objects(current.tree, commit.tree))
+                else:
+                    _, current_tree = self._branch_tree(current_branch)
+                    affected_files = list(_diff_trees(current_tree, self._load_tree(commit.tree)))
+                target_hash = commit.hash
+            else:
+                # Historial anterior a las instantáneas: la rama apunta a la versión
+                affected_files = self._versions_with_hash(target_hash)
+                if not affected_files:
+                    raise ShitError(f"'{commit_hash}' no es un commit ni una versión de un archivo.")
+        except ShitError as e:
+            print(f"Error: {str(e)}")
+            return False
+        
+        # Guardar el estado actual en reflog
+        self._add_to_reflog(f"reset --{mode} {target_hash}", current_branch)
+        
+        # Actualizar la referencia de la rama
+        self._update_branch_ref(current_branch, target_hash)
+        
+        print(f"HEAD retrocedió a {target_hash} en modo {mode}.")
+        print(f"Archivos afectados: {len(affected_files)}")
+        
+        return True
+        
+    @_locked
+    def gc(self, share=False):
+        """Deduplica los objetos del repositorio en el almacén compartido y limpia este.
+        
+        Cada objeto del repositorio pasa a ser un enlace duro al del almacén
+        compartido (que se crea con él si no existía). El número de enlaces de
+        un objeto del almacén cuenta los repositorios que lo usan: los que solo
+        tienen el del propio almacén no los usa nadie y se borran, salvo los
+        escritos hace menos de GC_GRACE_PERIOD segundos. Con `share` el
+        repositorio empieza a usar el almacén compartido si aún no lo hacía.
+        """
+        if self.shared_store is None:
+            if not share:
+                print("Este repositorio no usa el almacén de objetos compartido. Use 'shit gc --share'.")
+                return False
+            shared_store = Path(SHARED_STORE_DIR)
+            # Los enlaces duros exigen que el almacén esté en el mismo sistema de archivos
+            probe = self.objects_dir / f"shared-store-{os.urandom(6).hex()}.tmp"
+            try:
+                shared_store.mkdir(parents=True, exist_ok=True)
+                probe.touch()
+                os.link(probe, shared_store / probe.name)
+                os.unlink(shared_store / probe.name)
+            except OSError as e:
+                print(f"Error: No se pueden enlazar los objetos con {shared_store}: {e}")
+                return False
+            finally:
+                if probe.exists():
+                    probe.unlink()
+            self.shared_store = shared_store
+            with open(self.common_dir / SHARED_STORE_LINK, 'w', encoding='utf-8') as f:
+                f.write(str(self.shared_store))
+            print(f"El repositorio usa ahora el almacén compartido {self.shared_store}.")
+        
+        try:
+            self.shared_store.mkdir(parents=True, exist_ok=True)
+            adopted, saved = self._link_to_shared_store()
+        except OSError as e:
+            print(f"Error: No se pueden enlazar los objetos con {self.shared_store}: {e}")
+            return False
+        print(f"{adopted} objetos enlazados con el almacén compartido ({saved} bytes ahorrados).")
+        
+        removed, freed = 0, 0
+        limit = time.time() - GC_GRACE_PERIOD
+        for prefix_dir in os.scandir(self.shared_store):
+            if not prefix_dir.is_dir():
                 continue
-                
-            for file in files:
-                # Ignorar archivos ocultos
-                if file.startswith('.'):
+            for obj_file in os.scandir(prefix_dir.path):
+                stat = obj_file.stat()
+                if stat.st_nlink == 1 and stat.st_mtime < limit:
+                    os.unlink(obj_file.path)
+                    removed += 1
+                    freed += stat.st_size
+        print(f"{removed} objetos sin usar eliminados del almacén compartido ({freed} bytes liberados).")
+        return True
+
+    def _link_to_shared_store(self):
+        """Convierte los objetos del repositorio en enlaces al almacén compartido.
+        
+        Devuelve el número de objetos enlazados y los bytes ahorrados.
+        """
+        adopted, saved = 0, 0
+        if not self.objects_dir.exists():
+            return adopted, saved
+        for prefix_dir in os.scandir(self.objects_dir):
+            if not prefix_dir.is_dir():
+                continue
+            for obj_file in os.scandir(prefix_dir.path):
+                if not obj_file.is_file() or '.tmp' in obj_file.name:
                     continue
-                    
-                file_path = os.path.join(root, file)
-                try:
-                    # Convertir a ruta relativa para comparar con el índice
-                    rel_path = os.path.relpath(file_path, self.repo_path)
-                    # Normalizar la ruta con / para comparar correctamente
-                    rel_path = rel_path.replace(os.path.sep, '/')
-                    archivos_en_disco.add(rel_path)
-                except Exception as e:
-                    print(f"Error al procesar archivo {file_path}: {str(e)}")
+                shared_path = self.shared_store / prefix_dir.name / obj_file.name
+                shared_path.parent.mkdir(parents=True, exist_ok=True)
+                if not shared_path.exists():
+                    os.link(obj_file.path, shared_path)
+                    adopted += 1
+                elif not os.path.samefile(obj_file.path, shared_path):
+                    # Mismo contenido guardado dos veces: quedarse con el del almacén
+                    temp_path = f"{obj_file.path}.tmp"
+                    os.link(shared_path, temp_path)
+                    os.replace(temp_path, obj_file.path)
+                    adopted += 1
+                    saved += shared_path.stat().st_size
+        return adopted, saved
+
+    @_locked
+    def maintenance(self, budget=None):
+        """Mantiene el almacén local de objetos dentro del presupuesto configurado.
+        
+        Expulsa los objetos usados hace más tiempo (LRU) que estén confirmados en
+        el repositorio remoto, hasta que el almacén local quepa en el presupuesto.
+        Los objetos expulsados se vuelven a descargar bajo demanda.
+        """
+        self._load_config()
+        
+        # Guardar el nuevo presupuesto si se especifica
+        if budget is not None:
+            self.config['object_budget'] = budget
+            self._save_config()
+            print(f"Presupuesto de objetos locales: {budget} bytes.")
+        
+        budget = self.config.get('object_budget')
+        if not budget:
+            print("No hay presupuesto de objetos configurado. Use 'shit maintenance --budget <tamaño>'.")
+            return False
+        
+        # Recolectar los objetos locales con su tamaño
+        local_objects = {}
+        if self.objects_dir.exists():
+            for prefix_dir in os.scandir(self.objects_dir):
+                if not prefix_dir.is_dir():
                     continue
+                for obj_file in os.scandir(prefix_dir.path):
+                    if obj_file.is_file():
+                        stat = obj_file.stat()
+                        local_objects[prefix_dir.name + obj_file.name] = (stat.st_size, stat.st_mtime)
+        
+        total = sum(size for size, _ in local_objects.values())
+        print(f"Almacén local: {len(local_objects)} objetos, {total} bytes (presupuesto {budget} bytes).")
+        if total <= budget:
+            print("El almacén local está dentro del presupuesto.")
+            return True
+        
+        # Solo se pueden expulsar objetos que estén a salvo en el remoto
+        remote = self._get_remote(quiet=True) if self._has_remote() else None
+        if remote is None:
+            print("Error: No hay repositorio remoto configurado; no se pueden expulsar objetos.")
+            return False
+        
+        try:
+            remote_objects = remote.remote_objects()
+        except Exception as e:
+            print(f"Error al consultar los objetos remotos: {e}")
+            return False
+        if remote_objects is None:
+            print("Error: No hay repositorio remoto configurado; no se pueden expulsar objetos.")
+            return False
+        
+        # Proteger la última versión de cada archivo en la rama actual y los
+        # commits y árboles de todas las ramas (sin ellos no se puede hacer commit sin conexión)
+        self._load_index()
+        branch = self._get_current_branch()
+        protected = self._snapshot_objects()
+        for info in self.index.values():
+            branch_versions = [v for v in info.get('versions', []) if v.get('branch', 'master') == branch]
+            if branch_versions:
+                protected.add(branch_versions[-1]['hash'])
+        
+        # Ordenar por último acceso (o fecha de escritura si nunca se registró)
+        cache = self._load_object_cache()
+        candidates = sorted(
+            (h for h in local_objects if h in remote_objects and h not in protected),
+            key=lambda h: cache.get(h, {}).get('last_access', local_objects[h][1])
+        )
+        
+        expulsados = 0
+        liberados = 0
+        for content_hash in candidates:
+            if total <= budget:
+                break
+            size = local_objects[content_hash][0]
+            try:
+                self._object_path(content_hash).unlink()
+            except FileNotFoundError:
+                pass
+            cache.pop(content_hash, None)
+            total -= size
+            liberados += size
+            expulsados += 1
+        
+        self._save_object_cache(cache)
+        
+        print(f"Expulsados {expulsados} objetos ({liberados} bytes liberados).")
+        if total > budget:
+            print(f"Advertencia: El almacén local sigue ocupando {total} bytes; "
+                  "el resto de objetos no está en el remoto o está en uso.")
+        return True
+
+    def bundle_create(self, bundle_path, branches=None, since=None):
+        """Escribe en un único archivo los objetos y metadatos de las ramas indicadas.
+        
+        El paquete contiene una cabecera con las referencias de las ramas y los
+        registros del índice, los objetos comprimidos tal como están en el
+        almacén y una suma SHA-256 de todo lo anterior. Con `since` (una rama o
+        un commit, que puede abreviarse) solo se incluyen los commits
+        posteriores a ese estado, con sus versiones y sus árboles: el destino
+        debe tenerlo ya.
+        """
+        self._load_index()
+        if not branches:
+            branches = [self._get_current_branch()]
+        
+        since_hash = None
+        if since is not None:
+            try:
+                since_hash = self._resolve_commit_spec(since)
+            except ShitError as e:
+                print(f"Error: {str(e)}")
+                return False
+        
+        # Referencias de las ramas a empaquetar
+        refs = {}
+        for branch in branches:
+            branch_file = self.branches_dir / branch
+            if not branch_file.exists():
+                print(f"Error: La rama '{branch}' no existe.")
+                return False
+            with open(branch_file, 'r') as f:
+                refs[branch] = f.read().strip()
+        
+        records = []
+        hashes = set()
+        if since_hash is None:
+            # Registros del índice y objetos alcanzables desde las ramas
+            for file_path, info in self.index.items():
+                versions = [v for v in info.get('versions', []) if v.get('branch', 'master') in refs]
+                if not versions:
+                    continue
+                records.append({'op': 'add', 'path': file_path, 'added_at': info.get('added_at')})
+                for version in versions:
+                    records.append({'op': 'version', 'path': file_path, 'version': version})
+                    hashes.add(version['hash'])
+            
+            # El commit de cada rama y los niveles de su árbol (los commits anteriores no se incluyen)
+            for ref in refs.values():
+                commit = self._load_commit(ref)
+                if commit is not None:
+                    hashes.add(commit.hash)
+                    hashes.update(self._tree_objects(commit.tree))
+        else:
+            # Los commits posteriores a `since`, sus árboles (sin repetir los
+            # niveles compartidos) y las versiones que guardó cada uno: las de su
+            # rama y su mensaje con fecha entre la del commit padre y la suya
+            trees = set()
+            added = set()
+            for commit in self._commits_since(refs.values(), since_hash):
+                hashes.add(commit.hash)
+                self._tree_objects(commit.tree, trees)
+                parent = self._load_commit(commit.parents[0]) if commit.parents else None
+                lower = parent.timestamp if parent is not None else None
+                for record in self._query_history(commit.branch, since=lower, until=commit.timestamp):
+                    if record.message != commit.message or record.timestamp == lower:
+                        continue
+                    info = self.index[record.path]
+                    if record.path not in added:
+                        added.add(record.path)
+                        records.append({'op': 'add', 'path': record.path, 'added_at': info.get('added_at')})
+                    version = next(v for v in info['versions'] if v['timestamp'] == record.timestamp
+                                   and v.get('branch', 'master') == record.branch)
+                    records.append({'op': 'version', 'path': record.path, 'version': version})
+                    hashes.add(record.hash)
+            hashes.update(trees)
+            # Al importarlos, los números de versión se asignan por orden de llegada
+            records.sort(key=lambda record: (record['op'] == 'version', record.get('version', {}).get('timestamp', '')))
+        
+        # En clones bajo demanda los objetos que falten se descargan antes
+        self._fetch_objects(hashes)
+        missing = [h for h in hashes if not self._object_path(h).exists()]
+        if missing:
+            print(f"Error: Faltan {len(missing)} objetos en el almacén local.")
+            return False
+        
+        header = {'branches': refs, 'since': since_hash, 'objects': len(hashes), 'records': records}
+        bundle_path = Path(bundle_path)
+        temp_path = bundle_path.with_name(bundle_path.name + '.tmp')
+        hasher = hashlib.sha256()
+        
+        try:
+            with open(temp_path, 'wb') as out:
+                def write(data):
+                    hasher.update(data)
+                    out.write(data)
+                
+                write(BUNDLE_SIGNATURE)
+                write(json.dumps(header).encode('utf-8') + b'\n')
+                
+                # Cada objeto va precedido de su hash y su tamaño comprimido
+                for content_hash in sorted(hashes):
+                    object_path = self._object_path(content_hash)
+                    write(f"{content_hash} {object_path.stat().st_size}\n".encode('ascii'))
+                    with open(object_path, 'rb') as f:
+                        while True:
+                            chunk = f.read(BUNDLE_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            write(chunk)
+                
+                out.write(f"{BUNDLE_TRAILER}{hasher.hexdigest()}\n".encode('ascii'))
+            os.replace(temp_path, bundle_path)
+        except Exception as e:
+            if temp_path.exists():
+                temp_path.unlink()
+            print(f"Error al crear el paquete: {str(e)}")
+            return False
+        
+        print(f"Paquete creado: {bundle_path} ({len(hashes)} objetos, {len(records)} registros, "
+              f"ramas: {', '.join(refs)}).")
+        return True
+
+    def _resolve_commit_spec(self, spec):
+        """Devuelve el hash del commit al que se refiere `spec`: una rama o un hash (abreviable).
+        
+        Lanza ShitError si no es ninguna de las dos cosas.
+        """
+        if (self.branches_dir / spec).is_file():
+            commit = self._branch_head(spec)
+            if commit is None:
+                raise ShitError(f"La rama '{spec}' no apunta a ningún commit.")
+            return commit.hash
+        commit = self._load_commit(self._resolve_hash(spec, objects=True))
+        if commit is None:
+            raise ShitError(f"'{spec}' no es una rama ni un commit.")
+        return commit.hash
+
+    def _commits_since(self, heads, since_hash):
+        """Devuelve los commits alcanzables desde `heads` que no lo son desde `since_hash`.
+        
+        Los dos recorridos avanzan a la vez del commit más reciente al más
+        antiguo (como `git log A..B`): se detienen en cuanto solo quedan por
+        visitar commits alcanzables desde `since_hash`, así que el coste depende
+        de los commits nuevos y no de todo el historial.
+        """
+        reached = {}  # hash -> alcanzable desde since_hash
+        queue = []
+        
+        def push(commit_hash, old):
+            if commit_hash in reached and (reached[commit_hash] or not old):
+                return
+            reached[commit_hash] = old
+            commit = self._load_commit(commit_hash)
+            if commit is not None:
+                moment = datetime.datetime.fromisoformat(commit.timestamp).timestamp()
+                heapq.heappush(queue, (-moment, commit_hash, commit))
+        
+        push(since_hash, True)
+        for head in heads:
+            push(head, False)
+        
+        visited = []
+        while any(not reached[commit_hash] for _, commit_hash, _ in queue):
+            _, commit_hash, commit = heapq.heappop(queue)
+            old = reached[commit_hash]
+            if not old:
+                visited.append(commit)
+            for parent in commit.parents:
+                push(parent, old)
+        return [commit for commit in visited if not reached[commit.hash]]
+
+    @_locked
+    def unbundle(self, bundle_path):
+        """Importa un paquete creado con `bundle create`.
+        
+        El paquete se lee de forma secuencial. Cada objeto nuevo se descomprime
+        y se comprueba su hash mientras se escribe, y la suma final se verifica
+        antes de tocar el índice y las referencias: si el paquete está dañado
+        no se importa nada.
+        """
+        from remote import apply_index_records
+        
+        bundle_path = Path(bundle_path)
+        if not bundle_path.exists():
+            print(f"Error: El paquete {bundle_path} no existe.")
+            return False
+        
+        hasher = hashlib.sha256()
+        written = []
+        
+        try:
+            with open(bundle_path, 'rb') as f:
+                def read_line():
+                    line = f.readline()
+                    hasher.update(line)
+                    return line
+                
+                if read_line() != BUNDLE_SIGNATURE:
+                    raise ValueError("no es un paquete de SHIT")
+                header = json.loads(read_line())
+                
+                for _ in range(header['objects']):
+                    content_hash, size = read_line().decode('ascii').split()
+                    if self._read_bundle_object(f, hasher, content_hash, int(size)):
+                        written.append(content_hash)
+                
+                if f.readline().decode('ascii').strip() != BUNDLE_TRAILER + hasher.hexdigest():
+                    raise ValueError("la suma de comprobación no coincide")
+        except Exception as e:
+            # Deshacer la importación de objetos
+            for content_hash in written:
+                self._object_path(content_hash).unlink()
+            print(f"Error: Paquete no válido ({str(e)}). No se ha importado nada.")
+            return False
+        
+        # Incorporar los registros del índice
+        self._load_index()
+        aplicados = apply_index_records(self.index, header['records'])
+        self._save_index()
+        self._append_index_log(*header['records'])
+        
+        # Actualizar las ramas que no existen o que el paquete solo hace avanzar
+        def ref_timestamp(branch, content_hash):
+            commit = self._load_commit(content_hash)
+            if commit is not None:
+                return commit.timestamp
+            # Historial anterior a las instantáneas: la versión, por el índice de hashes del historial
+            return max((record.timestamp for record in self._versions_with_hash(content_hash)
+                        if record.branch == branch), default='')
+        
+        actualizadas = []
+        divergentes = []
+        for branch, ref in header['branches'].items():
+            branch_file = self.branches_dir / branch
+            current = None
+            if branch_file.exists():
+                with open(branch_file, 'r') as f:
+                    current = f.read().strip()
+            if current == ref:
+                continue
+            if current is None:
+                avanza = True
+            elif self._load_commit(current) is not None and self._load_commit(ref) is not None:
+                # Solo avance rápido: el commit local debe ser antecesor del del paquete
+                avanza = not self._commits_since([current], ref)
+                if not avanza and self._commits_since([ref], current):
+                    divergentes.append(branch)
+            else:
+                avanza = ref_timestamp(branch, ref) > ref_timestamp(branch, current)
+            if avanza:
+                self._update_branch_ref(branch, ref)
+                actualizadas.append(branch)
+        
+        self._add_to_reflog(f"unbundle {bundle_path.name}", self._get_current_branch())
+        
+        print(f"Paquete importado: {len(written)} objetos nuevos, {aplicados} registros del índice.")
+        if actualizadas:
+            print(f"Ramas actualizadas: {', '.join(actualizadas)}")
+        for branch in divergentes:
+            print(f"Advertencia: La rama '{branch}' tiene commits locales que no están en el paquete; "
+                  f"no se ha movido (el commit del paquete es {header['branches'][branch][:8]}).")
+        return True
+
+    def _read_bundle_object(self, f, hasher, content_hash, size):
+        """Lee un objeto del paquete y lo guarda si falta en el almacén.
+        
+        Devuelve True si el objeto se ha escrito.
+        """
+        from remote import ObjectWriter
+        
+        def read_chunks():
+            remaining = size
+            while remaining:
+                chunk = f.read(min(BUNDLE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ValueError("el paquete está truncado")
+                remaining -= len(chunk)
+                hasher.update(chunk)
+                yield chunk
+        
+        # Los objetos que ya existen solo se leen para la suma del paquete
+        if self._object_path(content_hash).exists():
+            for _ in read_chunks():
+                pass
+            return False
+        
+        with ObjectWriter(content_hash, self._object_path(content_hash)) as writer:
+            for chunk in read_chunks():
+                writer.write(chunk)
+            writer.commit()
+        return True
+
+    def sync_start(self, interval=None):
+        """Inicia la sincronización en segundo plano con el repositorio remoto.
+        
+        Activa la cola persistente de envíos (cada actualización de rama se
+        encola) y lanza un proceso que la vacía periódicamente con `remote push`.
+        """
+        if not self._has_remote():
+            print("Error: No hay repositorio remoto configurado.")
+            return False
+        
+        state = self._load_sync_state()
+        state['enabled'] = True
+        if interval is not None:
+            state['interval'] = interval
+        self._save_sync_state(state)
+        
+        pid = self._sync_pid()
+        if pid:
+            print(f"La sincronización en segundo plano ya está en marcha (PID {pid}).")
+            return True
+        
+        process = self._spawn_detached(['sync', 'run'], self.common_dir / 'sync.log')
+        print(f"Sincronización en segundo plano iniciada (PID {process.pid}).")
+        print(f"Registro: {self.common_dir / 'sync.log'}")
+        return True
+
+    def _spawn_detached(self, args, log_path):
+        """Lanza `shit <args>` en segundo plano, desacoplado de la terminal."""
+        import subprocess
+        
+        kwargs = {}
+        if platform.system() == "Windows":
+            kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+        
+        with open(log_path, 'a') as log:
+            return subprocess.Popen(
+                [sys.executable, '-u', os.path.abspath(__file__)] + args,
+                cwd=str(self.repo_path.resolve()),
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                **kwargs
+            )
+
+    def serve(self, detach=False, stop=False):
+        """Atiende los comandos de la CLI del repositorio desde un proceso persistente.
+        
+        El servidor mantiene en memoria el índice y los hashes de los archivos
+        del directorio de trabajo, y recibe los comandos por el socket
+        `.shit/serve.sock`. Mientras está en marcha, `shit` le envía los comandos
+        en lugar de ejecutarlos en un proceso nuevo.
+        """
+        global _REPO_STATE
+        
+        if not serve.supported():
+            print("Error: 'shit serve' necesita sockets Unix, no disponibles en este sistema.")
+            return False
+        
+        if stop:
+            if serve.stop_server(self.vcs_dir):
+                print("Servidor detenido.")
+            else:
+                print("No hay ningún servidor en marcha para este repositorio.")
+            return True
+        
+        if serve.server_running(self.vcs_dir):
+            print("Ya hay un servidor en marcha para este repositorio.")
+            return True
+        
+        if detach:
+            process = self._spawn_detached(['serve'], self.vcs_dir / 'serve.log')
+            print(f"Servidor iniciado en segundo plano (PID {process.pid}).")
+            return True
+        
+        _REPO_STATE = {}
+        print(f"Servidor escuchando en {self.vcs_dir / serve.SOCKET_NAME}")
+        try:
+            serve.ServeDaemon(self.vcs_dir, _serve_command).serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _REPO_STATE = None
+        print("Servidor detenido.")
+        return True
+
+    def sync_stop(self):
+        """Detiene la sincronización en segundo plano.
+        
+        Los envíos pendientes se conservan en la cola hasta el próximo `sync start`.
+        """
+        state = self._load_sync_state()
+        state['enabled'] = False
+        self._save_sync_state(state)
+        
+        pid = self._sync_pid()
+        if pid:
+            os.kill(pid, signal.SIGTERM)
+            print(f"Sincronización en segundo plano detenida (PID {pid}).")
+        else:
+            print("La sincronización en segundo plano no está en marcha.")
+        
+        pendientes = len(self._read_sync_queue())
+        if pendientes:
+            print(f"Quedan {pendientes} envíos pendientes en la cola.")
+        return True
+
+    def sync_status(self):
+        """Muestra el estado de la sincronización en segundo plano."""
+        state = self._load_sync_state()
+        pid = self._sync_pid()
+        queue = self._read_sync_queue()
+        
+        if pid:
+            print(f"Sincronización en segundo plano: activa (PID {pid}).")
+        elif state.get('enabled'):
+            print("Sincronización en segundo plano: detenida (los cambios se siguen encolando).")
+        else:
+            print("Sincronización en segundo plano: desactivada.")
         
-        # Método 2: Verificar explícitamente los archivos en el directorio raíz
-        for item in os.listdir(self.repo_path):
-            item_path = os.path.join(self.repo_path, item)
-            # Solo incluir archivos (no directorios) y que no estén ocultos
-            if os.path.isfile(item_path) and not item.startswith('.'):
-                rel_path = os.path.relpath(item_path, self.repo_path)
-                rel_path = rel_path.replace(os.path.sep, '/')
-                archivos_en_disco.add(rel_path)
+        branches = list(dict.fromkeys(entry['branch'] for entry in queue))
+        print(f"Envíos pendientes: {len(queue)}" + (f" (ramas: {', '.join(branches)})" if branches else ""))
+        if state.get('last_sync'):
+            print(f"Último envío: {state['last_sync']}")
+        if state.get('last_failure'):
+            print(f"Último fallo: {state['last_failure']}")
+        return True
+
+    def sync_run(self, once=False):
+        """Bucle de sincronización en primer plano (lo ejecuta `sync start`).
         
-        # Encontrar archivos sin seguimiento (en disco pero no en el índice)
-        for archivo in archivos_en_disco:
-            # Normalizar ruta para comparación consistente
-            archivo_normalizado = archivo.replace('\\', '/')
-            if archivo_normalizado not in rutas_en_indice:
-                sin_seguimiento.append(archivo_normalizado)
+        Cada `interval` segundos envía las ramas encoladas. Sin conexión la cola
+        se conserva y la espera se duplica hasta SYNC_MAX_BACKOFF.
+        """
+        if not self._create_pid_file():
+            print("Ya hay un proceso de sincronización en marcha.")
+            return False
         
-        # Mostrar los resultados
-        if modificados:
-            print("\nArchivos modificados:")
-            for file in sorted(modificados):
-                print(f"  {file}")
-                
-        if sin_commit:
-            print("\nArchivos añadidos al control de versiones (sin commit):")
-            for file in sorted(sin_commit):
-                print(f"  {file}")
+        stopped = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+        
+        interval = self._load_sync_state().get('interval', SYNC_INTERVAL)
+        delay = interval
+        print(f"[{datetime.datetime.now().isoformat()}] Sincronización iniciada (cada {interval} s).")
+        
+        try:
+            while not stopped:
+                result = self._sync_once()
+                if once:
+                    return result is not False
                 
-        if sin_seguimiento:
-            print("\nArchivos sin seguimiento:")
-            for file in sorted(sin_seguimiento):
-                print(f"  {file}")
+                if result is None:
+                    # Repositorio en uso: volver a intentarlo en cuanto se calme
+                    delay = SYNC_QUIET_PERIOD
+                elif result:
+                    delay = interval
+                else:
+                    delay = min(max(delay, interval) * 2, SYNC_MAX_BACKOFF)
                 
-        if not modificados and not sin_commit and not sin_seguimiento:
-            print("No hay cambios en los archivos.")
-            
-        return True
+                # Esperar en pasos cortos para atender la señal de parada
+                deadline = time.monotonic() + delay
+                while not stopped and time.monotonic() < deadline:
+                    time.sleep(min(1, deadline - time.monotonic()))
+            return True
+        finally:
+            if self._read_pid_file() == os.getpid():
+                self.sync_pid_file.unlink()
+            print(f"[{datetime.datetime.now().isoformat()}] Sincronización detenida.")
 
-    def reset(self, commit_hash, mode="soft"):
-        """Retrocede HEAD a un commit específico.
+    def _sync_once(self):
+        """Envía las ramas de la cola de sincronización.
         
-        Modos:
-        - soft: Retrocede HEAD y deja cambios en staging
+        Devuelve True si la cola quedó vacía, False si el envío falló y None si
+        el índice se modificó hace muy poco y conviene esperar.
         """
-        # Verificar que el modo es válido
-        if mode not in ["soft"]:
-            print(f"Error: Modo '{mode}' no soportado. Use 'soft'.")
+        queue = self._read_sync_queue()
+        branches = list(dict.fromkeys(entry['branch'] for entry in queue))
+        
+        # Registros del índice pendientes sin actualización de rama (p. ej. `add`)
+        pending_log = self.common_dir / 'index_log.jsonl'
+        if not branches and pending_log.exists() and pending_log.stat().st_size > 0:
+            branches = [self._get_current_branch()]
+        if not branches:
+            return True
+        
+        # No enviar mientras se está escribiendo el índice (p. ej. un commit en curso)
+        if self.index_file.exists() and time.time() - self.index_file.stat().st_mtime < SYNC_QUIET_PERIOD:
+            return None
+        
+        now = datetime.datetime.now().isoformat()
+        print(f"[{now}] Enviando ramas: {', '.join(branches)}")
+        
+        remote = self._get_remote()
+        ok = remote is not None
+        for branch in branches:
+            if not ok:
+                break
+            try:
+                ok = remote.push(branch)
+            except Exception as e:
+                print(f"Error al enviar la rama {branch}: {str(e)}")
+                ok = False
+        
+        state = self._load_sync_state()
+        if not ok:
+            state['last_failure'] = now
+            self._save_sync_state(state)
+            print(f"[{now}] Envío fallido; la cola se conserva y se reintentará.")
             return False
-            
-        # Cargar el índice
-        self._load_index()
         
-        # Verificar que el hash existe en algún archivo
-        hash_exists = False
-        affected_files = []
+        # Quitar de la cola lo enviado (conservar lo encolado mientras tanto);
+        # si solo había registros del índice pendientes puede no haber cola
+        if queue:
+            from remote import write_atomic
+            with self._repo_lock():
+                with open(self.sync_queue_file, 'r', encoding='utf-8') as f:
+                    remaining = [line for line in f if line.strip()][len(queue):]
+                write_atomic(self.sync_queue_file, ''.join(remaining))
         
-        for file_path, info in self.index.items():
-            versions = info.get('versions', [])
-            for version in versions:
-                if version.get('hash') == commit_hash:
-                    hash_exists = True
-                    affected_files.append((file_path, version))
+        state['last_sync'] = now
+        self._save_sync_state(state)
+        return True
+
+    def _enqueue_sync(self, branch):
+        """Encola el envío de una rama si la sincronización en segundo plano está activa."""
+        if not self.sync_state_file.exists() or not self._load_sync_state().get('enabled'):
+            return
+        
+        with open(self.sync_queue_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'branch': branch, 'queued_at': datetime.datetime.now().isoformat()}) + '\n')
+
+    def _read_sync_queue(self):
+        """Lee la cola persistente de envíos."""
+        if not self.sync_queue_file.exists():
+            return []
+        with open(self.sync_queue_file, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _load_sync_state(self):
+        """Carga el estado de la sincronización en segundo plano."""
+        if self.sync_state_file.exists():
+            with open(self.sync_state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_sync_state(self, state):
+        """Guarda el estado de la sincronización en segundo plano."""
+        from remote import write_atomic
+        write_atomic(self.sync_state_file, json.dumps(state, indent=2))
+
+    def _create_pid_file(self):
+        """Crea el archivo de PID del proceso de sincronización (con O_EXCL).
+        
+        Devuelve False si otro proceso en marcha ya lo tiene; el archivo de un
+        proceso terminado se sustituye.
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.sync_pid_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._sync_pid():
+                    return False
+                # Archivo de un proceso que ya no existe
+                try:
+                    self.sync_pid_file.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return True
+        return False
+
+    def _read_pid_file(self):
+        """Lee el PID del proceso de sincronización (None si no hay)."""
+        try:
+            with open(self.sync_pid_file, 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _sync_pid(self):
+        """Devuelve el PID del proceso de sincronización si sigue en marcha."""
+        pid = self._read_pid_file()
+        if pid is None:
+            return None
+        
+        if platform.system() == "Windows":
+            # os.kill(pid, 0) terminaría el proceso en Windows
+            handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+            if not handle:
+                return None
+            exit_code = ctypes.c_ulong()
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            ctypes.windll.kernel32.CloseHandle(handle)
+            return pid if exit_code.value == 259 else None
+        
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return pid
+
+    def show(self, hash_prefix, output_format='text'):
+        """Muestra el objeto y las versiones (archivo, rama, número) que tienen un hash.
         
-        if not hash_exists:
-            print(f"Error: No se encontró ningún commit con hash '{commit_hash}'.")
+        Si el hash es de un commit se muestran sus datos y los archivos que
+        cambió respecto a su primer padre. El hash puede abreviarse mientras no
+        sea ambiguo.
+        """
+        try:
+            content_hash = self._resolve_hash(hash_prefix, objects=True)
+            commit = self._load_commit(content_hash)
+            if commit is not None:
+                return self._show_commit(commit, output_format)
+            records = self._versions_with_hash(content_hash)
+        except ShitError as e:
+            print(f"Error: {str(e)}")
             return False
-            
-        # Obtener la rama actual
-        current_branch = self._get_current_branch()
         
-        # Guardar el estado actual en reflog
-        self._add_to_reflog(f"reset --{mode} {commit_hash}", current_branch)
+        if output_format != 'text':
+            _write_records(records, output_format)
+            return True
         
-        # Actualizar la referencia de la rama
-        self._update_branch_ref(current_branch, commit_hash)
+        print(f"\nObjeto: {content_hash}")
+        object_path = self._object_path(content_hash)
+        if object_path.exists():
+            print(f"Tamaño comprimido: {object_path.stat().st_size} bytes")
+        else:
+            print("El objeto no está en el almacén local (se descargará al usarlo).")
+        print("-" * 60)
+        for record in records:
+            formatted_time = datetime.datetime.fromisoformat(record.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{record.path} - rama {record.branch}, versión {record.version} - {formatted_time}")
+            print(f"  {record.message}")
+        print("-" * 60)
+        return True
+
+    def _show_commit(self, commit, output_format):
+        """Muestra un commit y sus cambios respecto al primer padre."""
+        if output_format != 'text':
+            _write_records([commit], output_format)
+            return True
         
-        print(f"HEAD retrocedió a {commit_hash} en modo {mode}.")
-        print(f"Archivos afectados: {len(affected_files)}")
+        parent = self._load_commit(commit.parents[0]) if commit.parents else None
+        formatted_time = datetime.datetime.fromisoformat(commit.timestamp).strftime("%Y-%m-%d %H:%M:%S")
         
+        print(f"\nCommit: {commit.hash}")
+        print(f"Rama: {commit.branch}")
+        print(f"Fecha: {formatted_time}")
+        if commit.parents:
+            print(f"Padres: {' '.join(parent_hash[:12] for parent_hash in commit.parents)}")
+        print(f"Mensaje: {commit.message}")
+        print("-" * 60)
+        etiquetas = {'added': 'añadido', 'modified': 'modificado', 'deleted': 'eliminado'}
+        for change in sorted(self._diff_tree_objects(parent.tree if parent is not None else None, commit.tree)):
+            print(f"  {etiquetas[change.state]}: {change.path}")
+        print("-" * 60)
         return True
+
+    def reflog(self, output_format='text'):
+        """Muestra el historial de movimientos de HEAD.
         
-    def reflog(self):
-        """Muestra el historial de movimientos de HEAD."""
-        reflog_file = self.vcs_dir / 'reflog'
+        Con `output_format` 'json' o 'ndjson' las entradas se escriben a medida
+        que se leen, de la más reciente a la más antigua.
+        """
+        reflog_file = self.common_dir / 'reflog'
         
         if not reflog_file.exists():
-            print("No hay historial de movimientos de HEAD.")
+            if output_format == 'text':
+                print("No hay historial de movimientos de HEAD.")
+            else:
+                _write_records([], output_format)
             return True
             
         try:
-            with open(reflog_file, 'r') as f:
-                entries = f.readlines()
-                
+            if output_format != 'text':
+                _write_records(self._iter_reflog(), output_format)
+                return True
+            
             print("\nHistorial de movimientos de HEAD:")
             print("-" * 60)
             
-            # Mostrar entradas del más reciente al más antiguo
-            for entry in reversed(entries):
-                entry = entry.strip()
-                if entry:
-                    # Formato: timestamp|hash|command|branch
-                    parts = entry.split('|')
-                    if len(parts) >= 4:
-                        timestamp, hash_val, command, branch = parts[:4]
-                        # Convertir timestamp a formato legible
-                        dt = datetime.datetime.fromtimestamp(float(timestamp))
-                        formatted_time = dt.strftime("%Y-%m-%d %H:%M:%S")
-                        print(f"{hash_val[:8]} - {formatted_time} - {branch}: {command}")
+            for entry in self._iter_reflog():
+                formatted_time = datetime.datetime.fromisoformat(entry.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"{entry.hash[:8]} - {formatted_time} - {entry.branch}: {entry.command}")
             
             print("-" * 60)
             return True
@@ -1055,9 +3537,22 @@ class SHIT:
             print(f"Error al leer el reflog: {str(e)}")
             return False
     
+    def _iter_reflog(self):
+        """Genera las entradas del reflog como ReflogEntry, de la más reciente a la más antigua.
+        
+        El archivo se lee por bloques desde el final, sin cargarlo entero.
+        """
+        for entry in _read_lines_reversed(self.common_dir / 'reflog'):
+            # Formato: timestamp|hash|command|branch
+            parts = entry.strip().split('|')
+            if len(parts) >= 4:
+                timestamp, hash_val, command, branch = parts[:4]
+                timestamp = datetime.datetime.fromtimestamp(float(timestamp)).isoformat()
+                yield ReflogEntry(timestamp, hash_val, command, branch)
+    
     def _add_to_reflog(self, command, branch):
         """Añade una entrada al reflog."""
-        reflog_file = self.vcs_dir / 'reflog'
+        reflog_file = self.common_dir / 'reflog'
         
         # Obtener el hash actual de la rama
         branch_file = self.branches_dir / branch
@@ -1079,17 +3574,242 @@ class SHIT:
             with open(reflog_file, 'a+') as f:
                 f.write(entry)
         except Exception as e:
-            print(f"Advertencia: No se pudo actualizar el reflog: {str(e)}")
+            if not self.quiet:
+                print(f"Advertencia: No se pudo actualizar el reflog: {str(e)}")
 
 
 # Funciones para el modo local (como Git)
+class Repository:
+    """API de Python de SHIT, sin salida por consola.
+    
+    Las operaciones devuelven StatusEntry, VersionRecord, CommitSummary y
+    CheckoutResult y lanzan ShitError en lugar de mostrar mensajes, de modo
+    que SHIT puede usarse desde otros programas sin lanzar un proceso por
+    comando. Las rutas son relativas a la raíz del repositorio (o absolutas
+    dentro de él), no al directorio actual.
+    
+        repo = Repository('proyecto')
+        repo.add(['datos.bin'])
+        resumen = repo.commit_many(['datos.bin'], "Nuevos datos")
+    """
+    
+    def __init__(self, path='.'):
+        self._vcs = SHIT(path)
+        self._vcs.quiet = True
+        if not self._vcs.vcs_dir.exists():
+            raise ShitError(f"No se encontró un repositorio en {path}.")
+        self._root = self._vcs.repo_path.resolve()
+    
+    @classmethod
+    def init(cls, path='.'):
+        """Crea un repositorio nuevo en `path` y lo devuelve."""
+        vcs = SHIT(path)
+        if vcs.vcs_dir.exists():
+            raise ShitError(f"El repositorio ya existe en: {vcs.vcs_dir}")
+        vcs.repo_path.mkdir(parents=True, exist_ok=True)
+        vcs._create()
+        return cls(path)
+    
+    @property
+    def branch(self):
+        """Rama actual."""
+        return self._vcs._get_current_branch()
+    
+    def _relative_path(self, path):
+        """Convierte una ruta en la clave del índice (relativa al repositorio, con /)."""
+        path = Path(path)
+        if path.is_absolute():
+            try:
+                path = path.resolve().relative_to(self._root)
+            except ValueError:
+                raise ShitError(f"La ruta {path} está fuera del repositorio.")
+        return path.as_posix()
+    
+    def add(self, paths):
+        """Pone bajo control de versiones los archivos indicados.
+        
+        Devuelve las rutas que no lo estaban ya.
+        """
+        str_paths = [self._relative_path(path) for path in paths]
+        missing = [path for path in str_paths if not (self._root / path).is_file()]
+        if missing:
+            raise ShitError(f"No existen los archivos: {', '.join(missing)}")
+        
+        try:
+            with self._vcs._repo_lock():
+                self._vcs._load_index()
+                return self._vcs._track_paths(str_paths)
+        except TimeoutError as e:
+            raise ShitError(str(e))
+    
+    def commit(self, path, message, branch=None):
+        """Guarda una versión de un archivo. Devuelve un CommitSummary."""
+        return self.commit_many([path], message, branch)
+    
+    def commit_many(self, paths=None, message="", branch=None):
+        """Guarda en una sola operación una versión de cada archivo modificado.
+        
+        Sin `paths` se incluyen todos los archivos bajo control de versiones.
+        El índice, la rama y el reflog se actualizan una sola vez para todo el
+        lote. Devuelve un CommitSummary (sin versiones si no había cambios).
+        """
+        if not message:
+            raise ShitError("Debe proporcionar un mensaje para el commit.")
+        
+        vcs = self._vcs
+        try:
+            with vcs._repo_lock():
+                vcs._load_index()
+                if paths is None:
+                    sparse = vcs._sparse()
+                    str_paths = [path for path in vcs.index if sparse.includes(path)]
+                else:
+                    str_paths = [self._relative_path(path) for path in paths]
+                    untracked = [path for path in str_paths if path not in vcs.index]
+                    if untracked:
+                        raise ShitError(f"Archivos que no están bajo control de versiones: {', '.join(untracked)}")
+                
+                return vcs._commit_paths(str_paths, message, branch or vcs._get_current_branch())
+        except TimeoutError as e:
+            raise ShitError(str(e))
+    
+    def checkout(self, path, version, branch=None, backup=True):
+        """Restaura un archivo a una versión. Devuelve un CheckoutResult."""
+        return self.checkout_many([(path, version)], branch, backup)[0]
+    
+    def checkout_many(self, versions, branch=None, backup=True):
+        """Restaura varios archivos a versiones concretas.
+        
+        `versions` es un diccionario {ruta: versión} o una secuencia de pares
+        (ruta, versión); la versión puede ser un número o un hash abreviado. Todas las versiones se comprueban, y los objetos que
+        falten se descargan de una vez, antes de escribir ningún archivo.
+        Devuelve una lista de CheckoutResult.
+        """
+        vcs = self._vcs
+        vcs._load_index()
+        if branch is None:
+            branch = vcs._get_current_branch()
+        
+        items = versions.items() if isinstance(versions, dict) else versions
+        records = [vcs._resolve_version_spec(self._relative_path(path), version, branch)
+                   for path, version in items]
+        return vcs._write_versions(((record, self._root / record.path) for record in records), backup)
+    
+    def checkout_tree(self, paths=None, branch=None, backup=True):
+        """Restaura archivos o directorios (todo el repositorio sin `paths`) al estado actual de una rama.
+        
+        Los archivos que ya tienen ese contenido no se tocan. Devuelve una
+        lista de RestoreResult con los archivos escritos.
+        """
+        vcs = self._vcs
+        branch = branch or vcs._get_current_branch()
+        if not (vcs.branches_dir / branch).exists():
+            raise ShitError(f"La rama '{branch}' no existe.")
+        str_paths = None if paths is None else [self._relative_path(path) for path in paths]
+        return vcs._restore_tree(branch, str_paths, backup)
+    
+    def checkout_at(self, at, paths=None, branch=None, backup=True):
+        """Restaura archivos (o directorios) al estado que tenían en la fecha `at` (ISO 8601).
+        
+        Sin `paths` se restaura todo el repositorio. Los archivos que ya tienen
+        el contenido de esa fecha no se tocan. Devuelve una lista de
+        CheckoutResult con los archivos escritos.
+        """
+        vcs = self._vcs
+        if branch is None:
+            branch = vcs._get_current_branch()
+        try:
+            at = parse_timestamp(at)
+        except ValueError as e:
+            raise ShitError(f"Fecha no válida: {str(e)}")
+        
+        str_paths = None if paths is None else [self._relative_path(path) for path in paths]
+        records = vcs._versions_at(branch, at, str_paths)
+        return vcs._write_versions(((record, self._root / record.path) for record in records),
+                                   backup, skip_unchanged=True)
+    
+    def status(self, paths=None):
+        """Devuelve el estado de los archivos con cambios como lista de StatusEntry.
+        
+        Con `paths` solo se examinan esas rutas.
+        """
+        if paths is not None:
+            paths = [self._relative_path(path) for path in paths]
+        return self._vcs._status_entries(paths)
+    
+    def log(self, path=None, branch=None, limit=None, since=None, until=None, pattern=None, offset=0):
+        """Devuelve, por fecha, las versiones de un archivo (o de todos) en una rama como VersionRecord.
+        
+        `since` y `until` son fechas ISO 8601 (inclusivas), `pattern` una
+        expresión regular sobre el mensaje y `limit` y `offset` paginan el
+        resultado.
+        """
+        vcs = self._vcs
+        if branch is None:
+            branch = vcs._get_current_branch()
+        
+        try:
+            since = parse_timestamp(since) if since is not None else None
+            until = parse_timestamp(until) if until is not None else None
+            if pattern is not None:
+                re.compile(pattern)
+        except (ValueError, re.error) as e:
+            raise ShitError(f"Filtro no válido: {str(e)}")
+        
+        str_path = None
+        if path is not None:
+            str_path = self._relative_path(path)
+            if not vcs._history_tracks(str_path):
+                raise ShitError(f"El archivo {str_path} no está bajo control de versiones.")
+        return list(vcs._query_history(branch, str_path, since, until, pattern, limit, offset))
+    
+    def show(self, hash_prefix):
+        """Devuelve las versiones con el hash indicado (completo o abreviado) como VersionRecord."""
+        return self._vcs._versions_with_hash(self._vcs._resolve_hash(hash_prefix))
+    
+    def head(self, branch=None):
+        """Devuelve el commit actual de una rama como CommitRecord (None si aún no tiene)."""
+        vcs = self._vcs
+        return vcs._load_commit(vcs._read_ref(branch or vcs._get_current_branch()))
+    
+    def switch(self, branch, force=False):
+        """Cambia a otra rama actualizando solo los archivos que difieren.
+        
+        Lanza ShitError si alguno de ellos tiene cambios sin guardar (salvo con
+        `force`, que los copia a `<archivo>.bak`). Devuelve los TreeChange aplicados.
+        """
+        vcs = self._vcs
+        if not (vcs.branches_dir / branch).exists():
+            raise ShitError(f"La rama '{branch}' no existe.")
+        current_branch = vcs._get_current_branch()
+        changes = vcs._switch_working_tree(current_branch, branch, force)
+        vcs._add_to_reflog(f"branch switch {branch}", current_branch)
+        vcs._set_head(branch)
+        return changes
+    
+    def diff(self, source, target=None):
+        """Devuelve los TreeChange para pasar del estado de `target` (la rama actual por defecto) al de `source`."""
+        vcs = self._vcs
+        return vcs._branch_changes(target or vcs._get_current_branch(), source)
+    
+    def add_worktree(self, path, branch):
+        """Crea en `path` un worktree con la rama `branch`, que comparte objetos e historial, y lo devuelve."""
+        worktree = self._vcs._create_worktree(path, branch)
+        worktree._restore_tree(branch, backup=False)
+        return Repository(worktree.repo_path)
+    
+    @property
+    def sparse_patterns(self):
+        """Patrones del checkout parcial (lista vacía si no está activado)."""
+        return self._vcs._sparse().lines()
+
 def setup_shit():
     """Configura el entorno para SHIT"""
     # En modo local, no necesitamos un directorio global
     if LOCAL_MODE:
         # Copiar los scripts necesarios si no existen
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        files_to_copy = ["drive_sync.py", "requirements.txt"]
+        files_to_copy = ["drive_sync.py", "remote.py", "serve.py", "history.py", "requirements.txt"]
         
         # El directorio oculto está en el directorio actual
         vcs_dir = os.path.join(os.getcwd(), ".shit")
@@ -1115,7 +3835,7 @@ def setup_shit():
         
         # Copiamos los scripts necesarios si no existen
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        files_to_copy = ["shit.py", "drive_sync.py", "requirements.txt"]
+        files_to_copy = ["shit.py", "drive_sync.py", "remote.py", "serve.py", "history.py", "requirements.txt"]
         
         for file in files_to_copy:
             src_file = os.path.join(current_dir, file)
@@ -1147,38 +3867,62 @@ def find_repo_root():
         return None
     else:
         # Modo centralizado (original)
-        current_dir = os.getcwd()
-        
-        # Buscar un mapeo en el archivo de configuración
-        mapping_file = os.path.join(HOME_DIR, "mapping.txt")
-        if os.path.exists(mapping_file):
-            with open(mapping_file, "r") as f:
-                for line in f:
-                    if line.strip():
-                        work_dir, repo_dir = line.strip().split("=")
-                        if current_dir.startswith(work_dir):
-                            return repo_dir
+        _migrate_mapping_file()
         
+        # El mapeo más largo es el del primer directorio con mapeo subiendo desde el actual
+        current = os.path.abspath(os.getcwd())
+        while True:
+            repo_dir = _read_repo_mapping(current)
+            if repo_dir is not None:
+                return repo_dir
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None
+            current = parent
+
+def _mapping_path(work_dir):
+    """Devuelve el archivo del mapeo de un directorio de trabajo.
+    
+    Cada mapeo es un archivo de MAPPINGS_DIR nombrado con el hash de la ruta,
+    así que buscar un directorio no exige leer los demás mapeos.
+    """
+    key = os.path.normcase(os.path.abspath(work_dir))
+    return os.path.join(MAPPINGS_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+def _read_repo_mapping(work_dir):
+    """Devuelve el repositorio oculto asignado exactamente a `work_dir`, o None."""
+    try:
+        with open(_mapping_path(work_dir), 'r', encoding='utf-8') as f:
+            mapped_dir, repo_dir = f.read().split('\n')[:2]
+    except (FileNotFoundError, ValueError):
+        return None
+    if os.path.normcase(mapped_dir) != os.path.normcase(os.path.abspath(work_dir)):
         return None
+    return repo_dir
+
+def _migrate_mapping_file():
+    """Pasa los mapeos del antiguo mapping.txt (una línea directorio=repositorio) a MAPPINGS_DIR."""
+    mapping_file = os.path.join(HOME_DIR, "mapping.txt")
+    if not os.path.exists(mapping_file):
+        return
+    with open(mapping_file, "r") as f:
+        for line in f:
+            if line.strip():
+                w_dir, r_dir = line.strip().split("=", 1)
+                create_repo_mapping(w_dir, r_dir)
+    os.replace(mapping_file, mapping_file + ".bak")
 
 def create_repo_mapping(work_dir, repo_dir):
     """Crea un mapeo entre el directorio de trabajo y el repositorio oculto"""
-    mapping_file = os.path.join(HOME_DIR, "mapping.txt")
-    
-    # Crear o actualizar el mapeo
-    mappings = {}
-    if os.path.exists(mapping_file):
-        with open(mapping_file, "r") as f:
-            for line in f:
-                if line.strip():
-                    w_dir, r_dir = line.strip().split("=")
-                    mappings[w_dir] = r_dir
+    os.makedirs(MAPPINGS_DIR, exist_ok=True)
+    work_dir = os.path.abspath(work_dir)
     
-    mappings[work_dir] = repo_dir
-    
-    with open(mapping_file, "w") as f:
-        for w_dir, r_dir in mappings.items():
-            f.write(f"{w_dir}={r_dir}\n")
+    # Escribir solo el archivo de este mapeo, de forma atómica
+    mapping_path = _mapping_path(work_dir)
+    temp_path = f"{mapping_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(f"{work_dir}\n{repo_dir}\n")
+    os.replace(temp_path, mapping_path)
     
     return True
 
@@ -1240,6 +3984,11 @@ def init_repo():
         result = vcs.init()
         
         if result:
+            # Guardar los objetos una sola vez para todos los repositorios
+            if SHARED_OBJECT_STORE:
+                with open(os.path.join(repo_dir, ".shit", SHARED_STORE_LINK), 'w', encoding='utf-8') as f:
+                    f.write(SHARED_STORE_DIR)
+            
             # Crear mapeo entre el directorio de trabajo y el repositorio
             create_repo_mapping(work_dir, repo_dir)
             print(f"Repositorio inicializado para: {work_dir}")
@@ -1249,6 +3998,15 @@ def init_repo():
             print(f"Error al inicializar el repositorio")
             return False
 
+def _format_option(args):
+    """Obtiene el formato de salida de `--format X` o `--format=X` (text por defecto)."""
+    for i, arg in enumerate(args):
+        if arg.startswith("--format="):
+            return arg.split("=", 1)[1]
+        if arg == "--format" and i + 1 < len(args):
+            return args[i + 1]
+    return 'text'
+
 def execute_shit_command(args):
     """Ejecuta un comando de SHIT en el repositorio correspondiente"""
     if LOCAL_MODE:
@@ -1277,7 +4035,7 @@ def execute_shit_command(args):
     
     # Convertir rutas relativas a absolutas para los comandos que toman archivos
     if args and args[0] in ["add", "commit", "log", "checkout"]:
-        if len(args) > 1 and not os.path.isabs(args[1]):
+        if len(args) > 1 and not args[1].startswith("-") and not os.path.isabs(args[1]):
             args[1] = os.path.abspath(args[1])
     
     # Ejecutar el comando correspondiente
@@ -1333,31 +4091,77 @@ def execute_shit_command(args):
         else:
             # Commit de todos los archivos en staging
             return vcs.commit(None, message, branch)
-    elif args and args[0] == "log" and len(args) > 1:
+    elif args and args[0] == "log":
         branch = None
         if "-b" in args:
             b_index = args.index("-b") + 1
             if b_index < len(args):
                 branch = args[b_index]
+        limit = None
+        if "--limit" in args:
+            l_index = args.index("--limit") + 1
+            if l_index < len(args):
+                limit = int(args[l_index])
+        since = None
+        if "--since" in args:
+            s_index = args.index("--since") + 1
+            if s_index < len(args):
+                since = args[s_index]
+        until = None
+        if "--until" in args:
+            u_index = args.index("--until") + 1
+            if u_index < len(args):
+                until = args[u_index]
+        pattern = None
+        if "--grep" in args:
+            g_index = args.index("--grep") + 1
+            if g_index < len(args):
+                pattern = args[g_index]
+        offset = 0
+        if "--offset" in args:
+            o_index = args.index("--offset") + 1
+            if o_index < len(args):
+                offset = int(args[o_index])
         
-        # Usar ruta absoluta
-        abs_path = os.path.abspath(args[1])
-        return vcs.log(abs_path, branch)
-    elif args and args[0] == "checkout" and len(args) > 2:
+        # El archivo es el primer argumento que no es una opción ni su valor
+        abs_path = None
+        for i, arg in enumerate(args[1:], start=1):
+            if not arg.startswith("-") and args[i-1] not in ("-b", "--limit", "--since", "--until", "--grep", "--offset", "--format"):
+                # Usar ruta absoluta
+                abs_path = os.path.abspath(arg)
+                break
+        return vcs.log(abs_path, branch, limit, since, until, _format_option(args), pattern, offset)
+    elif args and args[0] == "checkout" and len(args) > 1:
         branch = None
         if "-b" in args:
             b_index = args.index("-b") + 1
             if b_index < len(args):
                 branch = args[b_index]
+        at = None
+        for option in ("--at", "--version-at"):
+            if option in args:
+                a_index = args.index(option) + 1
+                if a_index >= len(args):
+                    print(f"Error: Falta la fecha de {option}")
+                    return False
+                at = args[a_index]
         
-        try:
-            version = int(args[2])
-            # Usar ruta absoluta
-            abs_path = os.path.abspath(args[1])
-            return vcs.checkout(abs_path, version, branch)
-        except ValueError:
-            print(f"Error: La versión debe ser un número entero")
+        # Los argumentos que no son opciones ni sus valores
+        positional = [arg for i, arg in enumerate(args[1:], start=1)
+                      if not arg.startswith("-") and args[i-1] not in ("-b", "--at", "--version-at")]
+        if at is None and "--all" not in args and len(positional) == 2 and not os.path.exists(positional[1]):
+            # Un archivo y una versión (número o hash abreviado); usar ruta absoluta
+            return vcs.checkout(os.path.abspath(positional[0]), positional[1], branch)
+        
+        paths = None if "--all" in args else [os.path.abspath(arg) for arg in positional]
+        if paths == []:
+            print("Error: Indique los archivos o directorios a restaurar, o --all")
             return False
+        if at is not None:
+            return vcs.checkout_at(paths, at, branch, "--no-backup" not in args)
+        return vcs.checkout_tree(paths, branch, "--no-backup" not in args)
+    elif args and args[0] == "show" and len(args) > 1:
+        return vcs.show(args[1], _format_option(args))
     elif args and args[0] == "branch":
         if len(args) > 1:
             if args[1] == "create" and len(args) > 2:
@@ -1365,23 +4169,48 @@ def execute_shit_command(args):
             elif args[1] == "list":
                 return vcs.branch_list()
             elif args[1] == "switch" and len(args) > 2:
-                return vcs.branch_switch(args[2])
+                return vcs.branch_switch(args[2], "--force" in args)
             elif args[1] == "merge" and len(args) > 2:
                 target = None
                 if len(args) > 3:
                     target = args[3]
                 return vcs.branch_merge(args[2], target)
+            elif args[1] == "diff" and len(args) > 2:
+                target = None
+                if len(args) > 3 and not args[3].startswith("-"):
+                    target = args[3]
+                return vcs.branch_diff(args[2], target, _format_option(args))
         print("Comando de rama no válido")
         return False
     elif args and args[0] == "remote":
         if len(args) > 1:
             if args[1] == "init" and len(args) > 2:
-                return vcs.remote_init(args[2])
+                path = None
+                if "--path" in args:
+                    p_index = args.index("--path") + 1
+                    if p_index < len(args):
+                        path = args[p_index]
+                return vcs.remote_init(args[2], path)
             elif args[1] == "clone" and len(args) > 2:
                 target_dir = '.'
-                if len(args) > 3:
+                if len(args) > 3 and not args[3].startswith("-"):
                     target_dir = args[3]
-                return vcs.remote_clone(args[2], target_dir)
+                branch = None
+                if "-b" in args:
+                    b_index = args.index("-b") + 1
+                    if b_index < len(args):
+                        branch = args[b_index]
+                depth = None
+                if "--depth" in args:
+                    d_index = args.index("--depth") + 1
+                    if d_index < len(args):
+                        depth = int(args[d_index])
+                cache_limit = None
+                if "--cache-size" in args:
+                    c_index = args.index("--cache-size") + 1
+                    if c_index < len(args):
+                        cache_limit = parse_size(args[c_index])
+                return vcs.remote_clone(args[2], target_dir, branch, depth, "--lazy" in args, cache_limit)
             elif args[1] == "push":
                 branch = None
                 if "-b" in args:
@@ -1395,7 +4224,12 @@ def execute_shit_command(args):
                     b_index = args.index("-b") + 1
                     if b_index < len(args):
                         branch = args[b_index]
-                return vcs.remote_pull(branch)
+                depth = None
+                if "--depth" in args:
+                    d_index = args.index("--depth") + 1
+                    if d_index < len(args):
+                        depth = int(args[d_index])
+                return vcs.remote_pull(branch, depth)
             elif args[1] == "share" and len(args) > 2:
                 role = "writer"
                 if "-r" in args:
@@ -1406,7 +4240,7 @@ def execute_shit_command(args):
         print("Comando remoto no válido")
         return False
     elif args and args[0] == "status":
-        return vcs.status()
+        return vcs.status(_format_option(args))
     elif args and args[0] == "reset":
         if len(args) > 1:
             mode = "soft"
@@ -1423,7 +4257,63 @@ def execute_shit_command(args):
                 mode = "soft"
             return vcs.reset(args[1], mode)
     elif args and args[0] == "reflog":
-        return vcs.reflog()
+        return vcs.reflog(_format_option(args))
+    elif args and args[0] == "maintenance":
+        budget = None
+        if "--budget" in args:
+            b_index = args.index("--budget") + 1
+            if b_index < len(args):
+                budget = parse_size(args[b_index])
+        return vcs.maintenance(budget)
+    elif args and args[0] == "bundle":
+        if len(args) > 2 and args[1] == "create":
+            branches = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == "-b"]
+            since = None
+            if "--since" in args:
+                s_index = args.index("--since") + 1
+                if s_index < len(args):
+                    since = args[s_index]
+            return vcs.bundle_create(args[2], branches, since)
+        elif len(args) > 2 and args[1] == "unbundle":
+            return vcs.unbundle(args[2])
+        print("Comando de paquete no válido")
+        return False
+    elif args and args[0] == "gc":
+        return vcs.gc("--share" in args)
+    elif args and args[0] == "worktree":
+        if len(args) > 3 and args[1] == "add":
+            return vcs.worktree_add(args[2], args[3])
+        elif len(args) > 1 and args[1] == "list":
+            return vcs.worktree_list()
+        print("Comando de worktree no válido")
+        return False
+    elif args and args[0] == "sparse":
+        if len(args) > 2 and args[1] == "set":
+            return vcs.sparse_set(args[2:])
+        elif len(args) > 1 and args[1] == "list":
+            return vcs.sparse_list()
+        elif len(args) > 1 and args[1] == "disable":
+            return vcs.sparse_disable()
+        print("Comando de checkout parcial no válido")
+        return False
+    elif args and args[0] == "sync":
+        if len(args) > 1 and args[1] == "start":
+            interval = None
+            if "--interval" in args:
+                i_index = args.index("--interval") + 1
+                if i_index < len(args):
+                    interval = int(args[i_index])
+            return vcs.sync_start(interval)
+        elif len(args) > 1 and args[1] == "stop":
+            return vcs.sync_stop()
+        elif len(args) > 1 and args[1] == "status":
+            return vcs.sync_status()
+        elif len(args) > 1 and args[1] == "run":
+            return vcs.sync_run("--once" in args)
+        print("Comando de sincronización no válido")
+        return False
+    elif args and args[0] == "serve":
+        return vcs.serve("--detach" in args, "--stop" in args)
     else:
         print("Uso: shit <comando> [argumentos]")
         print("Comandos disponibles:")
@@ -1432,20 +4322,31 @@ def execute_shit_command(args):
         print("  add -A          - Añade todos los archivos modificados")
         print("  commit -m \"mensaje\" - Guarda versión de todos los archivos en staging")
         print("  commit <archivo> -m \"mensaje\" - Guarda versión de un archivo específico")
-        print("  log <archivo>    - Muestra el historial de versiones")
-        print("  status           - Muestra archivos modificados, añadidos y sin seguimiento")
-        print("  checkout <archivo> <versión> - Recupera una versión")
+        print("  log [archivo] [-b rama] [--since fecha] [--until fecha] [--grep regex] [--limit N] [--offset N] [--format text|json|ndjson] - Muestra el historial de versiones")
+        print("  status [--format text|json|ndjson] - Muestra archivos modificados, añadidos y sin seguimiento")
+        print("  checkout <archivo> <versión|hash> - Recupera una versión")
+        print("  checkout [--at <fecha>] (<rutas>... | --all) [-b rama] [--no-backup] - Restaura archivos o directorios al estado de la rama o de una fecha")
+        print("  show <hash> [--format text|json|ndjson] - Muestra las versiones con un hash (puede abreviarse)")
         print("  branch create <nombre> - Crea una nueva rama")
         print("  branch list      - Lista las ramas disponibles")
-        print("  branch switch <nombre> - Cambia a otra rama")
+        print("  branch switch <nombre> [--force] - Cambia a otra rama y actualiza los archivos que difieren")
         print("  branch merge <origen> [destino] - Fusiona ramas")
-        print("  remote init <nombre> - Inicializa un repositorio remoto en Google Drive")
-        print("  remote clone <repo_id> [target_dir] - Clona un repositorio desde Google Drive")
+        print("  branch diff <origen> [destino] [--format text|json|ndjson] - Archivos en que difieren dos ramas")
+        print("  remote init <nombre> [--path DIR] - Inicializa un repositorio remoto en Google Drive o en un directorio (local o NAS)")
+        print("  remote clone <repo_id|DIR> [target_dir] [-b branch] [--depth N] [--lazy [--cache-size 1G]] - Clona un repositorio desde Google Drive o desde un directorio")
         print("  remote push [-b branch] - Envía cambios al repositorio remoto")
-        print("  remote pull [-b branch] - Obtiene cambios desde el repositorio remoto")
+        print("  remote pull [-b branch] [--depth N] - Obtiene cambios desde el repositorio remoto")
         print("  remote share <email> [-r role] - Comparte el repositorio con otro usuario")
         print("  reset <commit_hash> [-m mode] - Retrocede HEAD a un commit específico")
-        print("  reflog           - Muestra el historial de movimientos de HEAD")
+        print("  reflog [--format text|json|ndjson] - Muestra el historial de movimientos de HEAD")
+        print("  maintenance [--budget 10G] - Expulsa objetos locales que ya están en el remoto")
+        print("  bundle create <archivo> [-b rama]... [--since rama|commit] - Empaqueta objetos y metadatos en un archivo")
+        print("  bundle unbundle <archivo> - Verifica e importa un paquete")
+        print("  sparse set <patrón>... | list | disable - Materializa solo una parte del árbol")
+        print("  worktree add <dir> <rama> | list - Otro directorio de trabajo que comparte objetos e historial")
+        print("  gc [--share]     - Deduplica los objetos en el almacén compartido y elimina los que no usa nadie")
+        print("  sync start [--interval 30] | stop | status - Envía los cambios al remoto en segundo plano")
+        print("  serve [--detach] [--stop] - Atiende los comandos desde un proceso persistente")
         return False
 
 
@@ -1491,20 +4392,49 @@ def commit(file, message, branch):
 @cli.command()
 @click.argument('file', required=False)
 @click.option('-b', '--branch', help='Rama específica a consultar')
-def log(file, branch):
+@click.option('--limit', type=click.IntRange(min=1), help='Número máximo de versiones a mostrar')
+@click.option('--since', help='Solo versiones desde esta fecha (ISO 8601)')
+@click.option('--until', help='Solo versiones hasta esta fecha (ISO 8601)')
+@click.option('--grep', 'pattern', help='Solo versiones cuyo mensaje coincide con esta expresión regular')
+@click.option('--offset', type=click.IntRange(min=0), default=0, help='Versiones a saltar (para paginar con --limit)')
+@click.option('--format', 'output_format', type=click.Choice(['text', 'json', 'ndjson']), default='text',
+              help='Formato de salida (json y ndjson se escriben a medida que se generan)')
+def log(file, branch, limit, since, until, pattern, offset, output_format):
     """Muestra el historial de versiones de un archivo o de todos los archivos si no se especifica."""
     vcs = SHIT()
-    vcs.log(file, branch)
+    vcs.log(file, branch, limit, since, until, output_format, pattern, offset)
 
 
 @cli.command()
-@click.argument('file', required=True, type=click.Path())
-@click.argument('version', required=True, type=int)
+@click.argument('targets', nargs=-1, type=click.Path())
 @click.option('-b', '--branch', help='Rama de la que recuperar')
-def checkout(file, version, branch):
-    """Recupera una versión específica de un archivo."""
+@click.option('--at', '--version-at', 'at',
+              help='Fecha (ISO 8601): restaura los archivos o directorios al estado que tenían entonces')
+@click.option('--all', 'all_files', is_flag=True, default=False, help='Todo el repositorio')
+@click.option('--no-backup', is_flag=True, default=False, help='Al restaurar varios archivos, no crear copias .bak')
+def checkout(targets, branch, at, all_files, no_backup):
+    """Recupera una versión de un archivo (ARCHIVO VERSIÓN, con número de versión o hash
+    abreviado) o el estado de archivos, directorios o todo el repositorio (--all) en la
+    rama o, con --at, en una fecha."""
+    vcs = SHIT()
+    if at is None and not all_files and len(targets) == 2 and not os.path.exists(targets[1]):
+        vcs.checkout(targets[0], targets[1], branch)
+    elif all_files == bool(targets):
+        click.echo("Uso: shit checkout ARCHIVO VERSIÓN | shit checkout [--at FECHA] (RUTAS... | --all)")
+    elif at is not None:
+        vcs.checkout_at(None if all_files else targets, at, branch, not no_backup)
+    else:
+        vcs.checkout_tree(None if all_files else targets, branch, not no_backup)
+
+
+@cli.command()
+@click.argument('hash_prefix', required=True)
+@click.option('--format', 'output_format', type=click.Choice(['text', 'json', 'ndjson']), default='text',
+              help='Formato de salida')
+def show(hash_prefix, output_format):
+    """Muestra las versiones con un hash (completo o abreviado)."""
     vcs = SHIT()
-    vcs.checkout(file, version, branch)
+    vcs.show(hash_prefix, output_format)
 
 
 # Grupo de comandos para ramas
@@ -1531,10 +4461,12 @@ def branch_list_cmd():
 
 @branch.command(name='switch')
 @click.argument('name', required=True)
-def branch_switch_cmd(name):
-    """Cambia a otra rama."""
+@click.option('--force', is_flag=True, default=False,
+              help='Sobrescribir archivos con cambios sin guardar (se copian a .bak)')
+def branch_switch_cmd(name, force):
+    """Cambia a otra rama y actualiza los archivos que difieren."""
     vcs = SHIT()
-    vcs.branch_switch(name)
+    vcs.branch_switch(name, force)
 
 
 @branch.command(name='merge')
@@ -1546,6 +4478,17 @@ def branch_merge_cmd(source, target):
     vcs.branch_merge(source, target)
 
 
+@branch.command(name='diff')
+@click.argument('source', required=True)
+@click.argument('target', required=False)
+@click.option('--format', 'output_format', type=click.Choice(['text', 'json', 'ndjson']), default='text',
+              help='Formato de salida')
+def branch_diff_cmd(source, target, output_format):
+    """Muestra los archivos en que una rama difiere de otra (la actual por defecto)."""
+    vcs = SHIT()
+    vcs.branch_diff(source, target, output_format)
+
+
 # Grupo de comandos para repositorios remotos
 @cli.group()
 def remote():
@@ -1555,19 +4498,25 @@ def remote():
 
 @remote.command(name='init')
 @click.argument('name', required=True)
-def remote_init_cmd(name):
-    """Inicializa un repositorio remoto en Google Drive."""
+@click.option('--path', type=click.Path(file_okay=False), help='Directorio (local o de red) donde crear el remoto en lugar de Google Drive')
+def remote_init_cmd(name, path):
+    """Inicializa un repositorio remoto en Google Drive o en un directorio."""
     vcs = SHIT()
-    vcs.remote_init(name)
+    vcs.remote_init(name, path)
 
 
 @remote.command(name='clone')
 @click.argument('repo_id', required=True)
 @click.argument('directory', required=False, default='.')
-def remote_clone_cmd(repo_id, directory):
-    """Clona un repositorio desde Google Drive."""
+@click.option('-b', '--branch', help='Rama a clonar (master por defecto)')
+@click.option('--depth', type=click.IntRange(min=1), help='Número de versiones más recientes por archivo')
+@click.option('--lazy', is_flag=True, help='Descarga los objetos bajo demanda en lugar de al clonar')
+@click.option('--cache-size', help='Tamaño máximo de la caché bajo demanda (p. ej. 500M, 2G)')
+def remote_clone_cmd(repo_id, directory, branch, depth, lazy, cache_size):
+    """Clona un repositorio desde Google Drive o desde un directorio remoto."""
     vcs = SHIT()
-    vcs.remote_clone(repo_id, directory)
+    cache_limit = parse_size(cache_size) if cache_size else None
+    vcs.remote_clone(repo_id, directory, branch, depth, lazy, cache_limit)
 
 
 @remote.command(name='push')
@@ -1580,10 +4529,11 @@ def remote_push_cmd(branch):
 
 @remote.command(name='pull')
 @click.option('-b', '--branch', help='Rama específica a obtener')
-def remote_pull_cmd(branch):
+@click.option('--depth', type=click.IntRange(min=1), help='Número de versiones más recientes por archivo')
+def remote_pull_cmd(branch, depth):
     """Obtiene cambios desde el repositorio remoto."""
     vcs = SHIT()
-    vcs.remote_pull(branch)
+    vcs.remote_pull(branch, depth)
 
 
 @remote.command(name='share')
@@ -1598,10 +4548,12 @@ def remote_share_cmd(email, role):
 
 
 @cli.command()
-def status():
+@click.option('--format', 'output_format', type=click.Choice(['text', 'json', 'ndjson']), default='text',
+              help='Formato de salida (json y ndjson se escriben a medida que se generan)')
+def status(output_format):
     """Muestra archivos modificados, añadidos y sin seguimiento."""
     vcs = SHIT()
-    vcs.status()
+    vcs.status(output_format)
 
 
 @cli.command()
@@ -1618,10 +4570,176 @@ def reset(commit_hash, mode, soft):
 
 
 @cli.command()
-def reflog():
+@click.option('--format', 'output_format', type=click.Choice(['text', 'json', 'ndjson']), default='text',
+              help='Formato de salida (json y ndjson se escriben a medida que se generan)')
+def reflog(output_format):
     """Muestra el historial de movimientos de HEAD."""
     vcs = SHIT()
-    vcs.reflog()
+    vcs.reflog(output_format)
+
+
+@cli.command()
+@click.option('--budget', help='Presupuesto de objetos locales (p. ej. 500M, 10G)')
+def maintenance(budget):
+    """Expulsa objetos locales poco usados que ya están en el remoto."""
+    vcs = SHIT()
+    vcs.maintenance(parse_size(budget) if budget else None)
+
+
+# Grupo de comandos para paquetes sin conexión
+@cli.group()
+def bundle():
+    """Transferencia de repositorios mediante archivos de paquete."""
+    pass
+
+
+@bundle.command(name='create')
+@click.argument('file', required=True)
+@click.option('-b', '--branch', 'branches', multiple=True, help='Rama a empaquetar (puede repetirse; la actual por defecto)')
+@click.option('--since', help='Incluir solo los commits posteriores a esta rama o commit')
+def bundle_create_cmd(file, branches, since):
+    """Empaqueta los objetos y metadatos de las ramas en un único archivo."""
+    vcs = SHIT()
+    vcs.bundle_create(file, list(branches), since)
+
+
+@bundle.command(name='unbundle')
+@click.argument('file', required=True)
+def bundle_unbundle_cmd(file):
+    """Verifica un paquete e importa su contenido."""
+    vcs = SHIT()
+    vcs.unbundle(file)
+
+
+@cli.command()
+@click.option('--share', is_flag=True, default=False, help='Empezar a usar el almacén de objetos compartido')
+def gc(share):
+    """Deduplica los objetos en el almacén compartido y elimina los que no usa ningún repositorio."""
+    vcs = SHIT()
+    vcs.gc(share)
+
+
+# Grupo de comandos para los worktrees
+@cli.group()
+def worktree():
+    """Directorios de trabajo adicionales que comparten el repositorio."""
+    pass
+
+
+@worktree.command(name='add')
+@click.argument('path', required=True)
+@click.argument('branch', required=True)
+def worktree_add_cmd(path, branch):
+    """Crea otro directorio de trabajo con una rama, sin copiar objetos."""
+    vcs = SHIT()
+    vcs.worktree_add(path, branch)
+
+
+@worktree.command(name='list')
+def worktree_list_cmd():
+    """Muestra los directorios de trabajo y su rama."""
+    vcs = SHIT()
+    vcs.worktree_list()
+
+
+# Grupo de comandos para el checkout parcial
+@cli.group()
+def sparse():
+    """Checkout parcial: materializar solo una parte del árbol."""
+    pass
+
+
+@sparse.command(name='set')
+@click.argument('patterns', nargs=-1, required=True)
+def sparse_set_cmd(patterns):
+    """Limita el directorio de trabajo a los archivos que coinciden con los patrones."""
+    vcs = SHIT()
+    vcs.sparse_set(list(patterns))
+
+
+@sparse.command(name='list')
+def sparse_list_cmd():
+    """Muestra los patrones del checkout parcial."""
+    vcs = SHIT()
+    vcs.sparse_list()
+
+
+@sparse.command(name='disable')
+def sparse_disable_cmd():
+    """Desactiva el checkout parcial y materializa todos los archivos."""
+    vcs = SHIT()
+    vcs.sparse_disable()
+
+
+# Grupo de comandos para la sincronización en segundo plano
+@cli.group()
+def sync():
+    """Sincronización en segundo plano con el repositorio remoto."""
+    pass
+
+
+@sync.command(name='start')
+@click.option('--interval', type=click.IntRange(min=1), help='Segundos entre envíos (30 por defecto)')
+def sync_start_cmd(interval):
+    """Inicia el envío periódico de cambios en segundo plano."""
+    vcs = SHIT()
+    vcs.sync_start(interval)
+
+
+@sync.command(name='stop')
+def sync_stop_cmd():
+    """Detiene la sincronización en segundo plano."""
+    vcs = SHIT()
+    vcs.sync_stop()
+
+
+@sync.command(name='status')
+def sync_status_cmd():
+    """Muestra el estado de la sincronización y la cola de envíos."""
+    vcs = SHIT()
+    vcs.sync_status()
+
+
+@sync.command(name='run')
+@click.option('--once', is_flag=True, help='Vacía la cola una vez y termina')
+def sync_run_cmd(once):
+    """Ejecuta el bucle de sincronización en primer plano."""
+    vcs = SHIT()
+    vcs.sync_run(once)
+
+
+@cli.command(name='serve')
+@click.option('--detach', is_flag=True, help='Inicia el servidor en segundo plano')
+@click.option('--stop', is_flag=True, help='Detiene el servidor del repositorio')
+def serve_cmd(detach, stop):
+    """Mantiene el repositorio en memoria y atiende los comandos por un socket."""
+    vcs = SHIT()
+    vcs.serve(detach, stop)
+
+
+def _serve_command(argv):
+    """Ejecuta dentro de `shit serve` un comando recibido por el socket.
+    
+    Devuelve el código de salida que verá el cliente.
+    """
+    try:
+        result = cli.main(args=argv, prog_name='shit', standalone_mode=False)
+        return result if isinstance(result, int) else 0
+    except click.exceptions.Exit as e:
+        return e.exit_code
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    except click.exceptions.Abort:
+        print("Abortado.", file=sys.stderr)
+        return 1
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 0
+    except Exception as e:
+        # El estado en memoria puede haber quedado a medias: descartarlo
+        _REPO_STATE.clear()
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
 
 
 # Punto de entrada para la ejecución del script
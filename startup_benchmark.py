@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Medición del tiempo de arranque de SHIT
+Ejecuta varios comandos habituales en un repositorio temporal, informa de los
+módulos que más tardan en importarse (python -X importtime) y falla si el
+arranque supera el presupuesto o si un comando local carga módulos de remotos.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+SHIT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shit.py')
+
+# Comandos que no deben tocar el remoto
+COMMANDS = ['status', 'log', 'branch list', 'reflog', '--help']
+
+# Módulos que solo deben importarse en los comandos de remotos
+FORBIDDEN_MODULES = ('drive_sync', 'remote', 'googleapiclient', 'google_auth_oauthlib', 'google')
+
+# Presupuesto por defecto, en milisegundos, del arranque de SHIT por encima del
+# intérprete vacío (el coste de `python -c pass` depende de la instalación)
+DEFAULT_BUDGET_MS = 150
+
+
+def run_timed(args, cwd):
+    """Ejecuta un proceso y devuelve (milisegundos, stderr)."""
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"'{' '.join(args)}' terminó con código {result.returncode}:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def median_ms(args, cwd, runs):
+    return statistics.median(run_timed(args, cwd)[0] for _ in range(runs))
+
+
+def parse_importtime(stderr):
+    """Convierte la salida de -X importtime en {módulo: (propio_us, acumulado_us, nivel)}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), level)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el tiempo de arranque de la CLI de SHIT.")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"Máximo por comando por encima del intérprete vacío ({DEFAULT_BUDGET_MS} por defecto)")
+    parser.add_argument('--runs', type=int, default=5, help="Ejecuciones por comando (se usa la mediana)")
+    parser.add_argument('--top', type=int, default=8, help="Módulos a mostrar por comando")
+    options = parser.parse_args()
+
+    python = sys.executable
+    failed = False
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        run_timed([python, SHIT_SCRIPT, 'init'], work_dir)
+
+        baseline = median_ms([python, '-c', 'pass'], work_dir, options.runs)
+        _, stderr = run_timed([python, '-X', 'importtime', '-c', 'pass'], work_dir)
+        interpreter_modules = set(parse_importtime(stderr))
+        print(f"Intérprete vacío: {baseline:.1f} ms")
+        print(f"Presupuesto: {options.budget_ms:.0f} ms por encima del intérprete\n")
+
+        for command in COMMANDS:
+            args = [python, SHIT_SCRIPT] + command.split()
+            total = median_ms(args, work_dir, options.runs)
+            overhead = total - baseline
+
+            _, stderr = run_timed([python, '-X', 'importtime'] + args[1:], work_dir)
+            modules = parse_importtime(stderr)
+
+            status = 'OK' if overhead <= options.budget_ms else 'FUERA DE PRESUPUESTO'
+            print(f"shit {command}: {total:.1f} ms (+{overhead:.1f} ms) {status}")
+
+            # Los módulos de primer nivel con más tiempo acumulado, sin los que
+            # ya carga el intérprete vacío
+            top_level = [(cumulative, name) for name, (_, cumulative, level) in modules.items()
+                         if level == 0 and name not in interpreter_modules]
+            for cumulative, name in sorted(top_level, reverse=True)[:options.top]:
+                print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+            forbidden = sorted(name for name in modules if name.split('.')[0] in FORBIDDEN_MODULES)
+            if forbidden:
+                print(f"    Error: se importan módulos de remotos: {', '.join(forbidden)}")
+                failed = True
+            if overhead > options.budget_ms:
+                failed = True
+            print()
+
+    if failed:
+        print("El arranque no cumple el presupuesto.")
+        return 1
+    print("El arranque cumple el presupuesto.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())